@@ -1,7 +1,8 @@
 #!/usr/bin/python
 # This program is designed to run on a Beaglebone Black. 
 # You will need to install the Adafruit BBB-IO Python library.
-# If you want to use charting you will also need to install gnuplot and gnuplot-x11
+# Charts are written as PNG/SVG files by bcc.py itself - gnuplot and gnuplot-x11 are only
+# needed for CHART_BACKEND = "gnuplot"
 #
 # Licensing is as follows:
 # http://opensource.org/licenses/GPL-3.0
@@ -24,30 +25,46 @@
 """
 
 #import the libraries we will use in our program
-try:
-  import Adafruit_BBIO.ADC as ADC
-  import Adafruit_BBIO.GPIO as GPIO
-except ImportError:
-  print "bcc.py needs adafruit bbio library installed"
-  exit(1)
-
 import time
 import math
 import sys
 import select
 import csv
 import os
+import heapq
+
+from array import array
+from collections import deque
+
+import bcchw #hardware backends - real BBB pins or the simulated chamber
+import bcctemp #thermistor lookup table
+import bccscreen #flicker free screen updates
+import bccdb #buffered database.csv writer
+import bccsettings #bccsettings.json settings file
+import bccyeast #yeast strain catalog
+import bccchart #charts without gnuplot
+import bccgnuplot #long running gnuplot chart
+import bccrollup #1 minute, 15 minute and hourly history
+import bccstore #binary status rows
+import bcccodec #compressed status rows
+import bccswing #change based logging
+import bccevents #event journal
+import bccnotify #alarm messages
+import bccalarms #alarm rules
+import bccmalfunc #heater/cooler malfunction detector
+import bcccontrol #deadband, PID, cascade and model predictive temperature control
+import bccmodel #chamber model fitted to database.csv
 
 ######### GLOBAL VARIABLES START HERE ##############################
-# Some of the global variables are written to bccconfig.py and imported
+# Some of the global variables are written to bccsettings.json and read back
 # during the main program code at the bottom of this file.
 # There is no need to change any of these global defaults at the start
 # of the program.
 
 # The exception might be the CELL_NUMBER variable - change that to your cell number
-# but you could just as easily change it in bccconfig.py itself once it is created.
+# but you could just as easily change it in bccsettings.json itself once it is created.
 
-#CELL_NUMBER = '5555555555'
+CELL_NUMBER = '' #your cell number - asked for on the first start
 
 #set version number
 #major release . minor release . bugfix
@@ -62,6 +79,8 @@ R_BIAS = 52000 #resistor value used in the thermistor voltage divider
 VDD_ADC = 1.8 #voltage divider input voltage
 AIN_MIN = .3 #minimum voltage used during self test - will adjust as needed
 AIN_MAX = 1.7 #maximum voltage used during self test - will adjust as needed
+ADC_SAMPLES = 16 #number of AIN reads taken every cycle - 1 turns oversampling off
+ADC_FILTER = "median" #how the reads are combined: median, trimmed or decimate (see bcchw.py)
 
 #yeast profile global variables
 Y_PROF_ID = 0 #yeast profile ID
@@ -72,6 +91,7 @@ Y_STYLE = "none" #Beer style
 Y_LOW_TEMP = 0 #recommended yeast low temp
 Y_HIGH_TEMP = 0 #recommended yeast high temp
 Y_DESC = "none"
+YEAST = bccyeast.YeastCatalog("Yeast Strains.csv") #read when the yeast profile is first asked for
 
 #brew info variables
 BREW_CYCLE = "Off  "
@@ -100,11 +120,75 @@ MAX_TEMP = 0
 SMS_ALARM_ON = False
 ALARM_SYS_ON = True
 
+LOOP_INTERVAL = 15 #seconds between temperature reads
+
+TREND_WINDOW = 1 * 60 #seconds of temperatures in the moving average/trend - longer is smoother
+TREND_SLOPE = 0.25 #degrees per hour the temperature has to be moving to show a ^ or v trend
+
+SETTINGS_FILE = "bccsettings.json" #settings file, replaces bccconfig.py (migrated on the first start)
+SETTINGS_DELAY = 2 #seconds to collect setting changes before the settings file is written
+SETTINGS_SAVED = None #settings as last written to the settings file
+SETTINGS_PENDING = False #True while a write of the settings file is waiting
+
 TIME_LAST_COOLER = 0 #variable to track when cooler was last turned off
 COOLER_TIME = 5 * 60 #5 minutes * 60 seconds
 
+#temperature control (see bcccontrol.py) - degrees are Celsius
+CONTROL_MODE = "deadband" #deadband, pid, cascade (needs a wort probe, the 4th entry of CHAMBER_PINS) or mpc
+CONTROL = None #the chamber's bcccontrol.Control
+PID_KP = 0.5 #output (0.0 - 1.0) per degree away from the target
+PID_TI = 30 * 60 #integral time, seconds
+PID_TD = 60 #derivative time, seconds
+CASCADE_KP = 2.0 #degrees the air target moves per degree the wort is away from the desired temperature
+CASCADE_TI = 2 * 60 * 60 #integral time of the wort loop, seconds
+CASCADE_LIMIT = 5.0 #degrees the air target may be away from the desired temperature
+HEATER_WINDOW = 5 * 60 #seconds - pid and cascade turn the output into on time in every window
+COOLER_WINDOW = 20 * 60 #the cooler never gets restarted less than COOLER_TIME after it stopped
+RELAY_MIN_ON = 60 #seconds - shorter on times are skipped
+#mpc chamber model until bccmodel.py has fitted it to the database.csv rows
+MODEL_TAU = 3 * 60 * 60 #seconds for the chamber to get 63% of the way to the room temperature
+MODEL_HEAT_RATE = 14.4 #degrees an hour the heater warms the chamber by
+MODEL_COOL_RATE = 21.6 #degrees an hour the cooler cools the chamber by
+MODEL_LAG = 90 #seconds for a relay to get 63% of the way to full power
+MPC_HORIZON = 90 * 60 #seconds mpc looks ahead
+MPC_START_COST = 0.5 #cost of a cooler start - higher for fewer, longer runs
+MODEL_REFIT = 60 * 60 #seconds between fits of the model to new database.csv rows (DATABASE_MODE change only), 0 never
+MODEL = None #the chamber's bcccontrol.ThermalModel
+MODEL_FIT = None #the chamber's bccmodel.ModelFit, saved as store/chamber-N.model.json
+MODEL_FIT_TIME = 0 #time of the last fit
+MODEL_READ_BYTES = 256 * 1024 #most of database.csv read for one fit
+WORT_AIN = None #AIN of the wort probe
+wort_temperature = None
+
 LAST_TIME_DATABASE = 0 #variable to track last database update was made
-DATABASE_INTERVAL = 15 * 60 #15 minutes * 60 seconds
+DATABASE_INTERVAL = 15 * 60 #15 minutes * 60 seconds - in change mode the longest time without a row
+DATABASE_MODE = "interval" #interval - a row every DATABASE_INTERVAL, change - a row when something changed (see bccswing.py)
+DATABASE_TOLERANCE = 0.1 #change mode: degrees C the temperature may be off when played back
+DOOR = None #the chamber's bccswing.SwingingDoor - picks the rows written in change mode
+
+#start/exit, brew sessions, cycle and setting changes, alarms and SMS go to a journal of their own (see bccevents.py)
+EVENTS_FILE = "events.jsonl"
+JOURNAL = None #the bccevents.Journal
+EVENT_QUIET = ["MIN_TEMP", "MAX_TEMP", "DATA_TO_PLOT"] #saved, but they follow the readings - no setting events
+EVENT_SETTINGS = None #settings when the last setting events were logged
+
+#database.csv lines are kept in memory and written in batches by a background thread (see bccdb.py)
+DATABASE = None #the DatabaseWriter
+DATABASE_FLUSH_INTERVAL = 60 #longest time in seconds a line waits in memory
+DATABASE_FLUSH_SIZE = 100 #write straight away once this many lines are waiting
+DATABASE_FSYNC = True #make sure every batch is on the card before carrying on
+DATABASE_MAX_BYTES = 5 * 1024 * 1024 #database.csv is renamed to database.csv.1 once it is this big
+DATABASE_BACKUPS = 4 #old database.csv files kept - older ones are deleted
+
+#every reading is added to the raw, 1 minute, 15 minute and hourly history of its chamber (see bccrollup.py)
+ROLLUP_DIR = "rollups" #directory of the history files
+ROLLUP = None #the chamber's bccrollup.Rollup
+
+#the database.csv status rows of every chamber are also kept as binary records (see bccstore.py)
+STORE_DIR = "store" #directory of the chamber-N.bcs files
+STORE = None #the chamber's bccstore.Store
+ARCHIVE_ON = False #also keep the rows compressed for months of history in store/chamber-N.bcz - one more write per row
+ARCHIVE = None #the chamber's bcccodec.Encoder, None with ARCHIVE_ON off
 
 LAST_BREW_SESSION_TIME = 0
 CHARTING_ON = False #variable to track whether charting feature is to be used or not
@@ -112,6 +196,12 @@ CHARTING_INTERVAL = 1 * 60 #15 minutes - adjustable in program
 DATA_TO_PLOT = False #boolean to track if 2 or more points of data are available to plot
 NUM_DATA_POINTS = 0 #tracks numer or data points up to two
 PLOT_STARTED = False #tracks whether the plot has been displayed or not
+CHART_BACKEND = "native" #native - PNG/SVG file and a sparkline on the screen (bccchart.py), gnuplot - X11 window (bccgnuplot.py)
+CHART_FORMAT = "png" #file the native chart is written to: png or svg
+CHART_WRITE_INTERVAL = 15 * 60 #seconds between two writes of the chart file - a point only draws its column, the file is the whole image
+CHART_WRITTEN = 0 #time the chart file was last written
+CHART = None #the native chart of the brew session - drawn from the chamber's history when first needed
+GNUPLOT = None #the gnuplot pipe of the brew session
 
 current_temperature = 0
 
@@ -122,12 +212,36 @@ ALARM_HIGH_TEMP = False #boolean to track a hi temp alarm
 ALARM_LOW_TEMP = False #boolean to track a low temp alarm
 ALARM_COOLER_MALFUNC = False #boolean to track a malfunction
 ALARM_HEATER_MALFUNC = False #boolean to track a malfunction
-TIME_LAST_SMS = 0 #used to track sms message interval
-SMS_INTERVAL = 60 * 60 #60minutes * 60 seconds
+#the response of the temperature to each relay is learned and watched (see bccmalfunc.py)
+HEATER_WATCH = None #the chamber's bccmalfunc.RelayWatch of the heater
+COOLER_WATCH = None #and of the cooler
+MALFUNC_LAG = 3 * 60 #seconds after a relay closes before its effect is measured
+MALFUNC_WINDOW = 5 * 60 #seconds of readings before a relay can be flagged
+#alarm messages are sent by a thread of their own (see bccnotify.py)
+NOTIFY = None #the bccnotify.Dispatcher
+NOTIFY_TRANSPORTS = "http" #comma separated: http, email, file, socket
+NOTIFY_RATE_LIMIT = 60 * 60 #seconds between two messages for the same alarm of a chamber
+NOTIFY_URL = "http://textbelt.com/text" #http: form POST with number=CELL_NUMBER and message
+NOTIFY_SMTP_HOST = "localhost" #email: SMTP server, host or host:port
+NOTIFY_EMAIL_FROM = "" #email: sender - the first NOTIFY_EMAIL_TO if empty
+NOTIFY_EMAIL_TO = "" #email: comma separated addresses
+NOTIFY_FILE = "notify.log" #file: alarm messages are appended to it
+NOTIFY_SOCKET = "127.0.0.1:5005" #socket: host:port the messages are sent to as UDP datagrams
 SMS_ALARM_ON = False #boolean to track whether SMS messages are to be sent or not
 
 TIME_BEFORE_ALARM_TRIGGER = 5 * 60 #(5 minutes in seconds)
 
+#alarm rules (see bccalarms.py) - degrees are Celsius, named limits are the chamber's own
+ALARMS = None #the chamber's bccalarms.AlarmEngine
+ALARM_RULES = [
+  {"name": "high", "kind": "above", "series": "avg", "limit": "max_high", "sustain": TIME_BEFORE_ALARM_TRIGGER,
+   "hysteresis": 0.25, "message": "High Temp"},
+  {"name": "low", "kind": "below", "series": "avg", "limit": "min_low", "sustain": TIME_BEFORE_ALARM_TRIGGER,
+   "hysteresis": 0.25, "message": "Low Temp"},
+  {"name": "rate", "kind": "rate", "limit": 10.0, "sustain": 2 * 60, "hysteresis": 1.0, "message": "Temp Changing Fast"},
+  {"name": "stale", "kind": "stale", "limit": 60 * 60, "message": "Sensor Stuck"},
+]
+
 #used to wait for one minute to allow moving average temperature to stabilize
 PROGRAM_START_TIME = time.time()# the date/time the program was started
 
@@ -136,17 +250,46 @@ T_a = 7.602330993E-4
 T_b = 2.313331379E-4
 T_c = 7.172007260E-8
 
-#setup the BBB IO pins
-ADC.setup() #setup ADC pins
-GPIO.setup("P9_15", GPIO.OUT) #setup pin P9_48 as output pin HEATER
-GPIO.setup("P9_23", GPIO.OUT) #setup pin P9_49 as output pin COOLER
+#ADC reading to temperature lookup table - built from the constants above by init_thermistor_table()
+THERM_TABLE = None
+
+#BBB IO pins of the chamber currently loaded (see CHAMBER FUNCTIONS)
+SENSOR_AIN = bcchw.SENSOR_AIN #thermistor voltage divider input
+HEATER_PIN = bcchw.HEATER_PIN #heater relay/RED LED
+COOLER_PIN = bcchw.COOLER_PIN #cooler relay/GREEN LED
+CHAMBER_NAME = "Chamber 1"
+
+#one (sensor AIN, heater pin, cooler pin) entry per brew chamber - change it in bccsettings.json
+#to run more chambers from this one program, for example:
+#CHAMBER_PINS = [("AIN0", "P9_15", "P9_23"), ("AIN1", "P9_12", "P9_14"), ("AIN2", "P8_7", "P8_8")]
+#a 4th entry is the AIN of a probe in the wort: ("AIN0", "P9_15", "P9_23", "AIN3")
+CHAMBER_PINS = [(SENSOR_AIN, HEATER_PIN, COOLER_PIN)]
+CHAMBER_SETTINGS = [] #saved settings of every chamber, written to bccsettings.json
+
+#hardware backend - run "./bcc.py --sim" to use the simulated chamber instead of the BBB pins
+#"--speed=60" runs the simulated chamber 60 times faster than real time
+#"--fail=cooler:120" makes the simulated cooler stop cooling after 120 simulated minutes (heater or cooler, :0 if left out)
+#in the first chamber, "--fail=cooler:120:AIN1" in the chamber with its sensor on AIN1
+HW_BACKEND = "bbio"
+SIM_SPEED = 1.0
+SIM_FAIL = None
+for arg in sys.argv[1:]:
+  if arg == "--sim": HW_BACKEND = "sim"
+  elif arg.startswith("--speed="): SIM_SPEED = float(arg[8:])
+  elif arg.startswith("--fail="): SIM_FAIL = (arg[7:] + "::").split(":")[:3]
+
+try:
+  HW = bcchw.get_backend(HW_BACKEND, R_BIAS, VDD_ADC, T_a, T_b, T_c, SIM_SPEED)
+except ImportError:
+  print "bcc.py needs adafruit bbio library installed (or run it with --sim)"
+  exit(1)
 
 
 ######### FUNCTIONS START HERE #####################################
 
 ######### AUTOMATION FUNCTIONS #####################################
 
-#none yet - getting close
+#deadband, PID, cascade and model predictive control are in bcccontrol.py (CONTROL_MODE)
 
 #propose the use of a cascading PID using three thermowells, one in the wort, 
 #one near the heating device, and one in the freezer nearest the coldest part 
@@ -224,14 +367,305 @@ tank or of just the heater - giving better total response.
 
 """
 
+######### CHAMBER FUNCTIONS #######################################
+
+#Every chamber has its own copy of the variables listed in CHAMBER_VARS.
+#The functions in this program work on the global variables, so before a
+#chamber is serviced its copy is loaded into the globals with switch_chamber().
+#The variables of the chamber that was loaded before are saved back first.
+
+#variables written to bccsettings.json for every chamber
+CHAMBER_SAVED_VARS = ["CHAMBER_NAME","TEMP_SCALE","LAGER_TEMP","WARM_TEMP","NORM_TEMP","CRASH_TEMP","CLEAR_TEMP",
+                      "DESIRED_TEMP","DWELL","MAX_HIGH_TEMP","MIN_LOW_TEMP","MIN_TEMP","MAX_TEMP","BREW_CYCLE",
+                      "Y_PROF_ID","Y_LAB","Y_NUM","Y_NAME","Y_STYLE","Y_DESC","Y_LOW_TEMP","Y_HIGH_TEMP",
+                      "SMS_ALARM_ON","ALARM_SYS_ON","BREW_NAME","BREW_BATCH_NUM","BREW_BATCH_SIZE","BREW_STYLE",
+                      "BREW_METHOD","BREW_SESSION_FILENAME","CHARTING_ON","CHARTING_INTERVAL","DATA_TO_PLOT"]
+
+#variables every chamber has its own copy of
+CHAMBER_VARS = CHAMBER_SAVED_VARS + ["SENSOR_AIN","HEATER_PIN","COOLER_PIN","USE_CELSIUS","HEATER_ON","COOLER_ON",
+                                     "TIME_LAST_COOLER","LAST_TIME_DATABASE","LAST_BREW_SESSION_TIME",
+                                     "NUM_DATA_POINTS","PLOT_STARTED","CHART","CHART_WRITTEN","GNUPLOT","ROLLUP","STORE","ARCHIVE","DOOR","current_temperature","O_trending",
+                                     "ALARMS","HEATER_WATCH","COOLER_WATCH","CONTROL","MODEL","MODEL_FIT","MODEL_FIT_TIME","WORT_AIN","wort_temperature","IS_ALARM","ALARM_HIGH_TEMP","ALARM_LOW_TEMP","ALARM_COOLER_MALFUNC",
+                                     "ALARM_HEATER_MALFUNC"]
+
+CHAMBERS = [] #list of Chamber objects
+LOADED_CHAMBER = None #chamber whose variables are in the globals right now
+DISPLAY_CHAMBER = None #chamber shown on the screen and changed by the menu
+
+class Chamber:
+
+  def __init__(self, number, sensor_ain, heater_pin, cooler_pin, settings, wort_ain=None):
+
+    self.number = number
+
+    #start from the current globals (defaults or bccsettings.json), then the chamber's saved settings
+    self.state = {}
+    for name in CHAMBER_VARS:
+      self.state[name] = globals().get(name)
+
+    self.state["CHAMBER_NAME"] = "Chamber " + str(number)
+    self.state.update(settings)
+
+    self.state["SENSOR_AIN"] = sensor_ain
+    self.state["HEATER_PIN"] = heater_pin
+    self.state["COOLER_PIN"] = cooler_pin
+    self.state["WORT_AIN"] = wort_ain
+    self.state["wort_temperature"] = None
+    self.state["USE_CELSIUS"] = self.state["TEMP_SCALE"] == "Celsius"
+    self.state["HEATER_ON"] = False
+    self.state["COOLER_ON"] = False
+    self.state["O_trending"] = Trend()
+    self.state["ROLLUP"] = bccrollup.Rollup(ROLLUP_DIR, "chamber" + str(number))
+    if not os.path.isdir(STORE_DIR): os.makedirs(STORE_DIR)
+    self.state["STORE"] = bccstore.Store(bccstore.store_filename(STORE_DIR, "Chamber " + str(number)))
+    self.state["ARCHIVE"] = None
+    if ARCHIVE_ON: self.state["ARCHIVE"] = bcccodec.Encoder(self.state["STORE"].filename[:-4] + ".bcz")
+    self.state["DOOR"] = bccswing.SwingingDoor()
+    self.state["ALARMS"] = bccalarms.AlarmEngine(ALARM_RULES)
+    self.state["HEATER_WATCH"] = bccmalfunc.RelayWatch("heater", 1, "Heater Not Heating", MALFUNC_LAG, MALFUNC_WINDOW)
+    self.state["COOLER_WATCH"] = bccmalfunc.RelayWatch("cooler", -1, "Cooler Not Cooling", MALFUNC_LAG, MALFUNC_WINDOW)
+    self.state["MODEL"] = bcccontrol.ThermalModel(MODEL_TAU, MODEL_HEAT_RATE, MODEL_COOL_RATE, MODEL_LAG)
+    self.state["MODEL_FIT"] = bccmodel.ModelFit(bccmodel.model_filename(STORE_DIR, "Chamber " + str(number)), MODEL_TAU)
+    self.state["MODEL_FIT_TIME"] = 0
+    if MODEL_REFIT > 0 and self.state["MODEL_FIT"].fitted is not None: #what was fitted on the last run
+      self.state["MODEL_FIT"].apply(self.state["MODEL"])
+      if HW_BACKEND == "sim": #the simulator runs the fitted chamber
+        HW.add_chamber(sensor_ain, heater_pin, cooler_pin, wort_ain, **self.state["MODEL_FIT"].sim_model())
+    self.state["CONTROL"] = bcccontrol.make_control(CONTROL_MODE, PID_KP, PID_TI, PID_TD, CASCADE_KP, CASCADE_TI,
+                                                    CASCADE_LIMIT, HEATER_WINDOW, COOLER_WINDOW, RELAY_MIN_ON,
+                                                    COOLER_TIME, self.state["MODEL"], MPC_HORIZON, MPC_START_COST)
+
+    return
+
+
+  def saved_settings(self):#settings written to bccsettings.json
+
+    settings = {}
+    for name in CHAMBER_SAVED_VARS:
+      settings[name] = self.state[name]
+
+    return settings
+
+#create the chambers#####################################################
+def init_chambers():
+  global CHAMBERS,DISPLAY_CHAMBER
+
+  CHAMBERS = []
+  for x in xrange(len(CHAMBER_PINS)):
+    sensor_ain, heater_pin, cooler_pin = CHAMBER_PINS[x][:3]
+    wort_ain = (list(CHAMBER_PINS[x]) + [None])[3]
+    if x < len(CHAMBER_SETTINGS): settings = CHAMBER_SETTINGS[x]
+    else: settings = {}
+    CHAMBERS.append(Chamber(x + 1, sensor_ain, heater_pin, cooler_pin, settings, wort_ain))
+
+  DISPLAY_CHAMBER = CHAMBERS[0]
+  switch_chamber(DISPLAY_CHAMBER)
+
+  return
+
+#load a chamber's variables into the globals#############################
+def switch_chamber(chamber):
+  global LOADED_CHAMBER
+
+  if chamber is LOADED_CHAMBER: return
+
+  program_globals = globals()
+
+  if LOADED_CHAMBER is not None: #save the variables of the chamber we were working on
+    for name in CHAMBER_VARS:
+      LOADED_CHAMBER.state[name] = program_globals[name]
+
+  program_globals.update(chamber.state)
+  LOADED_CHAMBER = chamber
+
+  return
+
+#make the chamber's variables up to date without switching##############
+def save_chamber():
+
+  if LOADED_CHAMBER is None: return
+
+  program_globals = globals()
+  for name in CHAMBER_VARS:
+    LOADED_CHAMBER.state[name] = program_globals[name]
+
+  return
+
+#call a function once for every chamber##################################
+def for_each_chamber(function):
+
+  for chamber in CHAMBERS:
+    switch_chamber(chamber)
+    function()
+
+  switch_chamber(DISPLAY_CHAMBER)
+
+  return
+
+#show the next chamber on the screen#####################################
+def next_chamber():
+  global DISPLAY_CHAMBER
+
+  DISPLAY_CHAMBER = CHAMBERS[DISPLAY_CHAMBER.number % len(CHAMBERS)]
+  switch_chamber(DISPLAY_CHAMBER)
+
+  return
+
+#chamber name to add to messages when there is more than one chamber#####
+def chamber_label():
+
+  if len(CHAMBERS) > 1: return " " + CHAMBER_NAME
+
+  return ""
+
+
 ######### USER INPUT FUNCTIONS #####################################
 
+#Menu entries that need answers typed in ask their questions with a Form
+#instead of raw_input() so the temperature control, alarms and logging keep
+#running while somebody is typing (or has walked away from a question).
+#check_input() hands every line typed to the active form, when the last
+#question is answered the form's finish function gets all the answers.
+#Nothing is changed if the form times out before it is finished.
+
+ACTIVE_FORM = None #form waiting for an answer
+FORM_TIMEOUT = 5 * 60 #seconds to wait for an answer before giving up
+
+class Field:
+
+  def __init__(self, name, prompt, kind="text", keep_going=None, check=None):
+
+    self.name = name #key of the answer in the values given to finish
+    self.prompt = prompt
+    self.kind = kind #text, number, integer or yesno
+    self.keep_going = keep_going #function(value) - return False to skip the rest of the questions
+    self.check = check #function(value) - raises ValueError with the error message to ask again
+
+    return
+
+
+  def convert(self, text):#returns the answer or raises ValueError with the error message
+
+    value = self.convert_kind(text)
+    if self.check is not None: self.check(value)
+
+    return value
+
+
+  def convert_kind(self, text):
+
+    if self.kind == "number":
+      try: value = float(text)
+      except ValueError: raise ValueError("Enter a numeric value")
+      if not bccsettings.is_number(value): raise ValueError("Enter a numeric value") #nan, inf
+      return value
+
+    if self.kind == "integer":
+      try: return int(text)
+      except ValueError: raise ValueError("Enter a whole number")
+
+    if self.kind == "yesno":
+      if text.lower() in ("yes", "y"): return True
+      if text.lower() in ("no", "n"): return False
+      raise ValueError("Enter yes or no")
+
+    return text
+
+
+class Form:
+
+  def __init__(self, fields, finish, message=""):
+
+    self.fields = fields
+    self.finish = finish #function(values) - applies the answers
+    self.message = message #shown under the first question
+    self.values = {}
+    self.field = 0 #question being asked
+    self.chamber = DISPLAY_CHAMBER #answers go to the chamber on screen when the form started
+    self.started = bcchw.monotonic()
+
+    return
+
+
+  def start(self):
+    global ACTIVE_FORM
+
+    ACTIVE_FORM = self
+    self.show()
+
+    return
+
+
+  def show(self):#(re)draw the question - called again after every screen update
+
+    sys.stdout.write("\033[17;0H\033[0K" + self.message + "\033[16;0H\033[0K" + self.fields[self.field].prompt)
+    sys.stdout.flush()
+
+    return
+
+
+  def answer(self, text):
+    global ACTIVE_FORM
+
+    field = self.fields[self.field]
+
+    try:
+      value = field.convert(text)
+    except ValueError as error:
+      self.message = str(error)
+      self.show()
+      return
+
+    self.values[field.name] = value
+    self.field += 1
+    self.message = ""
+    self.started = bcchw.monotonic() #every answer restarts the timeout
+
+    if self.field < len(self.fields) and (field.keep_going is None or field.keep_going(value)):
+      self.show()
+      return
+
+    #all done
+    ACTIVE_FORM = None
+    print "\033[16;0H\033[0K"
+    print "\033[17;0H\033[0K"
+
+    switch_chamber(self.chamber)
+    self.finish(self.values)
+    switch_chamber(DISPLAY_CHAMBER)
+
+    return
+
+
+  def timed_out(self):
+
+    return bcchw.monotonic() - self.started > FORM_TIMEOUT
+
+#give up on a form nobody is answering###############################
+def check_form_timeout():
+  global ACTIVE_FORM
+
+  if ACTIVE_FORM is not None and ACTIVE_FORM.timed_out():
+    ACTIVE_FORM = None
+    print "\033[16;0H\033[0K"
+    print "\033[17;0H\033[0KNo answer - nothing was changed"
+
+  return
+
 #check for user input###############################################
 def check_input():
+  #returns False once stdin has been closed
 
   if select.select([sys.stdin],[],[],0.0)[0]:
     key_input = sys.stdin.readline()
 
+    if not key_input: return False #end of file
+
+    if ACTIVE_FORM is not None: #the line is the answer to a prompt
+      ACTIVE_FORM.answer(key_input.strip())
+      if ACTIVE_FORM is not None: return True #more questions to come
+      key_input = 'f' #form is done - update everything below
+
     if key_input[0] == 'a' or key_input[0] == 'A': #was an A typed at the terminal? etc...
       set_alarm_thresholds()
 
@@ -245,13 +679,16 @@ def check_input():
       set_dwell()
 
     if key_input[0] == 'f' or key_input[0] == 'F':
-      pass
+      refresh_screen() #repaint all of it, not just what changed
       #draw_screen() #it will get done below
       #print_output() #it will get done below
 
     if key_input[0] == 'g' or key_input[0] == 'G':
       chart_graphics()
 
+    if key_input[0] == 'k' or key_input[0] == 'K':
+      next_chamber()
+
     if key_input[0] == 'l' or key_input[0] == 'L':
       lager()
 
@@ -265,7 +702,7 @@ def check_input():
       crash_brew()
 
     if key_input[0] == 's' or key_input[0] == 'S':
-      switch_scale()
+      for_each_chamber(switch_scale) #all the chambers use the same scale
 
     if key_input[0] == 't' or key_input[0] == 'T':
       set_desired_temp()
@@ -279,110 +716,80 @@ def check_input():
     if key_input[0] == 'y' or key_input[0] == 'Y':
       yeast_profile()
 
+    if ACTIVE_FORM is not None: return True #a menu entry is asking questions - wait for the answers
+
+    log_setting_changes() #cycle and setting events go before the alarms they may cause
+
     draw_screen()#redraw the screen to clean it up
     print_output()#print data at specific points on the screen
 
     check_alarms()#check to see if we should trigger an alarm or not
 
-    heater_control(O_trending.moving_avg_temp) #check to see if heater needs to be turned on or off
-    cooler_control(O_trending.moving_avg_temp) #check to see if cooler needs to be turned on or off
+    control_relays(O_trending.moving_avg_temp) #check to see if heater or cooler need to be turned on or off
 
     write_settings() #update the settings file
     update_database() #update the database
 
-  return
+  return True
 
 #charting options######################################################################
 def chart_graphics():
 
-  global CHARTING_ON,CHARTING_INTERVAL,PLOT_STARTED
-  from os import system
+  def long_enough(minutes):#the settings file doesn't take less either
+    if minutes * 60 < bccsettings.MINIMUMS["CHARTING_INTERVAL"]: raise ValueError("Enter at least 1 minute")
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      charting_on = raw_input("Turn charting graphics on (yes/no): ")
-      break
-    except:
-      print "Enter yes or no:"
+  Form([Field("charting_on", "Turn charting graphics on (yes/no): ", "yesno", keep_going=lambda on: on),
+        Field("minutes", "Enter charting interval in minutes: ", "number", check=long_enough)],
+       set_charting).start()
 
-  if charting_on.lower() == "yes": #yes we want charts
+  return
+
+
+def set_charting(values):
+  global CHARTING_ON,CHARTING_INTERVAL,PLOT_STARTED,CHART
+
+  if values["charting_on"]: #yes we want charts
     CHARTING_ON = True
-    while True:
-      print "\033[17;0H\033[0K\033[16;0H"
-      try:
-        minutes = input("Enter charting interval in minutes: ")
-        break
-      except:
-        print "Enter a number:"
-    CHARTING_INTERVAL = minutes * 60 #convert to seconds
+    CHARTING_INTERVAL = values["minutes"] * 60 #convert to seconds
   else: 
     CHARTING_ON = False #no... turn charting off
 
   PLOT_STARTED = False #set to False so the chart will be reloaded with new interval timing if it was changed
-  system("pkill -9 gnuplot") #kill gnuplot so it loads again reading the new charting interval
+  kill_gnuplot() #kill gnuplot so it loads again reading the new charting interval
+  CHART = None #native chart - read again with the new interval
 
   return
 
 #get_brew_info#########################################################################
 #get information about brew session from user
 def get_brew_info():
-  global BREW_NAME,BREW_BATCH_NUM,BREW_BATCH_SIZE,BREW_STYLE,BREW_METHOD,Y_PROF_ID,BREW_CYCLE,BREW_SESSION_FILENAME, \
-         PLOT_STARTED,NUM_DATA_POINTS,DATA_TO_PLOT
 
-  from datetime import datetime
-  from os import system
+  Form([Field("name", "Enter brew name: "),
+        Field("batch_num", "Enter brew batch number: "),
+        Field("batch_size", "Enter brew batch size: ", "number"),
+        Field("style", "Enter brew style: "),#ale, lager, stout, etc
+        Field("method", "Enter brew method: ")],#all grain, extract, brew in a bag, etc
+       lambda values: yeast_profile(lambda: new_brew_session(values)),
+       "This will start a new brew session.").start()
 
-  print "\033[16;0H\033[0KThis will start a new brew session."
-
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      BREW_NAME = raw_input("Enter brew name: ")
-      break
-    except:
-      print "Enter brew name"
-
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      BREW_BATCH_NUM = raw_input("Enter brew batch number: ")
-      break
-    except:
-      print "Enter brew batch number"
+  return
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      BREW_BATCH_SIZE = input("Enter brew batch size: ")
-      break
-    except:
-      print "Enter a number"
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      BREW_STYLE = raw_input("Enter brew style: ")#ale, lager, stout, etc
-      break
-    except:
-      print "Enter brew style"
-
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      BREW_METHOD = raw_input("Enter brew method: ")#all grain, extract, brew in a bag, etc
-      break
-    except:
-      print "Enter brew method"
+def new_brew_session(values):
+  global BREW_NAME,BREW_BATCH_NUM,BREW_BATCH_SIZE,BREW_STYLE,BREW_METHOD,Y_PROF_ID,BREW_CYCLE,BREW_SESSION_FILENAME, \
+         PLOT_STARTED,NUM_DATA_POINTS,DATA_TO_PLOT
 
-  yeast_profile()
+  BREW_NAME = values["name"]
+  BREW_BATCH_NUM = values["batch_num"]
+  BREW_BATCH_SIZE = values["batch_size"]
+  BREW_STYLE = values["style"]
+  BREW_METHOD = values["method"]
 
-  database_file = open("database.csv", "a") #open database to append data
 #write new brew data to database
-  database_file.write(str(BREW_NAME)+", "+str(BREW_BATCH_NUM)+", "+str(BREW_BATCH_SIZE)+", "+str(BREW_STYLE)+", "+
-                      str(BREW_METHOD)+", "+str(Y_PROF_ID)+", "+str(Y_NAME)+"\n")
-
-  database_file.close() #close the database file
+  DATABASE.write(str(BREW_NAME)+", "+str(BREW_BATCH_NUM)+", "+str(BREW_BATCH_SIZE)+", "+str(BREW_STYLE)+", "+
+                 str(BREW_METHOD)+", "+str(Y_PROF_ID)+", "+str(Y_NAME)+", "+str(CHAMBER_NAME)+"\n")
+  log_event("brew", name=BREW_NAME, batch=BREW_BATCH_NUM, size=BREW_BATCH_SIZE, style=BREW_STYLE, method=BREW_METHOD,
+            yeast=Y_PROF_ID)
 
   BREW_CYCLE = "Off  " #brew cycle gets turned off... must start it with Normal or Warm menu options
 
@@ -391,58 +798,71 @@ def get_brew_info():
   NUM_DATA_POINTS = 0 #reset the data points
   PLOT_STARTED = False #resetthe plot started variable
 
+  kill_gnuplot()#kill the old brew session chart
+
 #reset the brew session name
   BREW_SESSION_FILENAME = './data/'+BREW_NAME + '-' + BREW_BATCH_NUM + '-' + str(BREW_BATCH_SIZE) + '-' + BREW_STYLE + '-' + BREW_METHOD
 
-  system("pkill -9 gnuplot")#kill any gnuplot charts
-
-  init_gnuplot_script()#rewrite the gnuplot script with the new brew session data
+  init_chart_data()#start the data file of the new brew session
 
   return
 
 #yeast_profile#########################################################################
 #open the yeast strains csv file and store it in a tuple
-def yeast_profile():
-  global Y_PROF_ID,Y_LAB,Y_NUM,Y_NAME,Y_STYLE,Y_DESC,Y_LOW_TEMP,Y_HIGH_TEMP #yeast
-  global LAGER_TEMP,WARM_TEMP,NORM_TEMP,CRASH_TEMP,CLEAR_TEMP,DESIRED_TEMP,DWELL,MAX_HIGH_TEMP,MIN_LOW_TEMP #temps
-
-  Y_ID = 0
+#then is called once the profile is picked (or wasn't) - used by get_brew_info
+def yeast_profile(then=None):
 
-  print "\033[16;0HReading yeast strains file..."
-
-  #read in the yeast csv file and store it in a tuple (array of arrays)
+  #the catalog is only read again when the file has changed
   try:
-    with open('Yeast Strains.csv') as f: #open yeast strain file
-      ytuple=[tuple(line) for line in csv.reader(f)]#for every line in file store each csv in an array cell in the tuple
-  except:
+    YEAST.refresh()
+  except (IOError, OSError, csv.Error):
     print "\033[17;0HError reading Yeast Strain file"
+    if then is not None: then()
     return
 
-  while True:
-    print "\033[16;0H"
-    try:
-      Y_ID = input("Enter desired yeast profile ID: ")
-      break
-    except:
-      print "Enter a numeric value"
+  def known(strain_id):
+    if YEAST.get(strain_id) is None: raise ValueError("No yeast profile with ID " + str(strain_id))
+
+  def picked(values):
+    set_yeast_profile(YEAST.get(values["id"]))
+    if then is not None: then()
+
+  Form([Field("id", "Enter desired yeast profile ID: ", "integer", check=known)], picked, yeast_hint()).start()
+
+  return
 
-  #check to see if ID number is within range
-  if Y_ID < 1: return
-  if Y_ID > len(ytuple) - 1: return
+
+def yeast_hint():#IDs of the strains that suit the desired temperature
+
+  temp = DESIRED_TEMP
+  if USE_CELSIUS: temp = temp * 9.0 / 5.0 + 32 #the catalog is in Fahrenheit
+
+  ids = [str(strain.id) for strain in YEAST.covering(temp)]
+  hint = "Strains for " + str(round(DESIRED_TEMP, 1)) + TEMP_SCALE[0] + ": " + ", ".join(ids)
+  if len(hint) > 100: hint = hint[:hint.rfind(",", 0, 96)] + ", ..."
+
+  return hint
+
+
+def set_yeast_profile(strain):
+  global Y_PROF_ID,Y_LAB,Y_NUM,Y_NAME,Y_STYLE,Y_DESC,Y_LOW_TEMP,Y_HIGH_TEMP #yeast
+  global LAGER_TEMP,WARM_TEMP,NORM_TEMP,CRASH_TEMP,CLEAR_TEMP,DESIRED_TEMP,DWELL,MAX_HIGH_TEMP,MIN_LOW_TEMP #temps
+
+  if strain is None: return
 
   #switch to Fahrenheit to store the variables
   if USE_CELSIUS:
     switch_scale()
 
-    #store the tuple info in the global yeast variables
-    Y_PROF_ID = int(Y_ID)
-    Y_LAB = ytuple[Y_PROF_ID][1]
-    Y_NUM = ytuple[Y_PROF_ID][2]
-    Y_NAME = ytuple[Y_PROF_ID][3]
-    Y_STYLE = ytuple[Y_PROF_ID][4]
-    Y_DESC = ytuple[Y_PROF_ID][5]
-    Y_LOW_TEMP = int(ytuple[Y_PROF_ID][6])
-    Y_HIGH_TEMP = int(ytuple[Y_PROF_ID][7])
+    #store the strain info in the global yeast variables
+    Y_PROF_ID = strain.id
+    Y_LAB = strain.lab
+    Y_NUM = strain.number
+    Y_NAME = strain.name
+    Y_STYLE = strain.style
+    Y_DESC = strain.description
+    Y_LOW_TEMP = strain.low_temp
+    Y_HIGH_TEMP = strain.high_temp
 
     #set the program variables based on the yeast profile selected
     #norm temp is 1/4 of the difference warmer than the low yeast temp
@@ -454,15 +874,15 @@ def yeast_profile():
     switch_scale()
 
   else:
-    #store the tuple info in the global yeast variables
-    Y_PROF_ID = int(Y_ID)
-    Y_LAB = ytuple[Y_PROF_ID][1]
-    Y_NUM = ytuple[Y_PROF_ID][2]
-    Y_NAME = ytuple[Y_PROF_ID][3]
-    Y_STYLE = ytuple[Y_PROF_ID][4]
-    Y_DESC = ytuple[Y_PROF_ID][5]
-    Y_LOW_TEMP = int(ytuple[Y_PROF_ID][6])
-    Y_HIGH_TEMP = int(ytuple[Y_PROF_ID][7])
+    #store the strain info in the global yeast variables
+    Y_PROF_ID = strain.id
+    Y_LAB = strain.lab
+    Y_NUM = strain.number
+    Y_NAME = strain.name
+    Y_STYLE = strain.style
+    Y_DESC = strain.description
+    Y_LOW_TEMP = strain.low_temp
+    Y_HIGH_TEMP = strain.high_temp
 
     #set the program variables based on the yeast profile selected
     #norm temp is 1/4 of the difference warmer than the low yeast temp
@@ -477,10 +897,6 @@ def yeast_profile():
   MAX_HIGH_TEMP = WARM_TEMP + DWELL
   MIN_LOW_TEMP = NORM_TEMP - DWELL
 
-  print "\033[16;0H\033[0K"
-  print "\033[17;0H\033[0K"
-  print "\033[18;0H\033[0K"
-
   return
 
 
@@ -493,22 +909,14 @@ def switch_scale():
     TEMP_SCALE = "Fahrenheit"
     MAX_TEMP = (MAX_TEMP * 9.0/5.0) + 32
     MIN_TEMP = (MIN_TEMP * 9.0/5.0) + 32
-    O_trending.temp1 = (O_trending.temp1 * 9.0/5.0) + 32
-    O_trending.temp2 = (O_trending.temp2 * 9.0/5.0) + 32
-    O_trending.temp3 = (O_trending.temp3 * 9.0/5.0) + 32
-    O_trending.temp4 = (O_trending.temp4 * 9.0/5.0) + 32
-    O_trending.moving_avg_temp = (O_trending.moving_avg_temp * 9.0/5.0) + 32
+    O_trending.convert(9.0/5.0, 32)
     current_temperature = (current_temperature * 9.0/5.0) + 32
   else: 
     USE_CELSIUS = True #else switch to Celsius
     TEMP_SCALE = "Celsius"
     MAX_TEMP = (MAX_TEMP -32) * 5.0 / 9.0
     MIN_TEMP = (MIN_TEMP -32) * 5.0 / 9.0
-    O_trending.temp1 = (O_trending.temp1 -32) * 5.0 / 9.0
-    O_trending.temp2 = (O_trending.temp2 -32) * 5.0 / 9.0
-    O_trending.temp3 = (O_trending.temp3 -32) * 5.0 / 9.0
-    O_trending.temp4 = (O_trending.temp4 -32) * 5.0 / 9.0
-    O_trending.moving_avg_temp = (O_trending.moving_avg_temp -32) * 5.0 / 9.0
+    O_trending.convert(5.0 / 9.0, -32 * 5.0 / 9.0)
     current_temperature = (current_temperature -32) * 5.0 / 9.0
 
 
@@ -551,7 +959,7 @@ def brew_off():
     BREW_CYCLE = "Off  " #else turn brew session off
     if COOLER_ON:
       COOLER_ON = False
-      GPIO.output("P9_23",GPIO.LOW)
+      HW.output(COOLER_PIN, False)
       print "\033[25;0H\033[93m Cooler: OFF\033[0m"
       TIME_LAST_COOLER = time.time()#reset cooler timer
 
@@ -655,68 +1063,40 @@ def lager():
 
 #set alarm thresholds##############################################
 def set_alarm_thresholds():
-  global MAX_HIGH_TEMP,MIN_LOW_TEMP,ALARM_SYS_ON,SMS_ALARM_ON
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      user_input = raw_input("Alarm on (yes/no): ")
-      if (user_input.lower() == "yes"):
-        ALARM_SYS_ON = True
-      else: 
-        ALARM_SYS_ON = False
-        return
-      break
-    except:
-      print "Enter yes or no"
+  Form([Field("alarm_on", "Alarm on (yes/no): ", "yesno", keep_going=lambda on: on),
+        Field("sms_on", "SMS text messages on (yes/no): ", "yesno"),
+        Field("max_high", "Enter max temp for alarm: ", "number"),
+        Field("min_low", "Enter min temp for alarm: ", "number")],
+       set_alarms).start()
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      user_input = raw_input("SMS text messages on (yes/no): ")
-      if (user_input == "yes"):
-        SMS_ALARM_ON = True
-      else: 
-        SMS_ALARM_ON = False
-      break
-    except:
-      print "Enter yes or no"
-
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      MAX_HIGH_TEMP = input("Enter max temp for alarm: ")
-      break
-    except:
-      print "Enter a numeric value"
+  return
 
-  while True:
-    print "\033[17;0H\033[0K\033[16;0H"
-    try:
-      MIN_LOW_TEMP = input("Enter min temp for alarm: ")
-      break
-    except:
-      print "Enter a numeric value"
 
-  print "\033[17;0H\033[0K"
-  print "\033[18;0H\033[0K"
+def set_alarms(values):
+  global MAX_HIGH_TEMP,MIN_LOW_TEMP,ALARM_SYS_ON,SMS_ALARM_ON
+
+  ALARM_SYS_ON = values["alarm_on"]
+  if not ALARM_SYS_ON: return
+
+  SMS_ALARM_ON = values["sms_on"]
+  MAX_HIGH_TEMP = values["max_high"]
+  MIN_LOW_TEMP = values["min_low"]
+
   return
 
 #set dwell#################################@##############################
 def set_dwell():
-  global DWELL,MAX_HIGH_TEMP,MIN_LOW_TEMP,WARM_TEMP,NORM_TEMP
 
-  while True:
-    print "\033[16;0H"
-    try:
-      DWELL = input("Enter deadband: ")
-      break
-    except:
-      print "Enter a numerical value"
-      print "\033[16;0H\033[0K"
+  Form([Field("dwell", "Enter deadband: ", "number")], set_dwell_value).start()
+
+  return
+
+
+def set_dwell_value(values):
+  global DWELL,MAX_HIGH_TEMP,MIN_LOW_TEMP,WARM_TEMP,NORM_TEMP
 
-  print "\033[17;0H\033[0K"
-  print "\033[18;0H\033[0K"
+  DWELL = values["dwell"]
 
   MAX_HIGH_TEMP = WARM_TEMP + DWELL
   MIN_LOW_TEMP = NORM_TEMP - DWELL
@@ -725,19 +1105,16 @@ def set_dwell():
 
 #set desired temperature#################################################
 def set_desired_temp():
-  global DESIRED_TEMP
 
+  Form([Field("desired", "Enter desired temperature: ", "number")], set_desired_value).start()
 
-  while True:
-    print "\033[16;0H"
-    try:
-      DESIRED_TEMP = input("Enter desired temperature: ")
-      break
-    except:
-      print "Enter a numerical value"
+  return
 
-  print "\033[17;0H\033[0K"
-  print "\033[18;0H\033[0K"
+
+def set_desired_value(values):
+  global DESIRED_TEMP
+
+  DESIRED_TEMP = values["desired"]
 
   return
 
@@ -745,24 +1122,26 @@ def set_desired_temp():
 def exit_program():
 
   from datetime import datetime
-  from os import system
 
   print "\033[15;0H"
 
   #do some shutdown stuff here if desired
   print "Writing files..."
-  write_settings()
-
-  database_file = open("database.csv", "a")
+  save_settings()
 
-  database_file.write("bcc.py exiting normally: " + str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "\n")
+  for_each_chamber(finish_status_log)
+  DATABASE.write("bcc.py exiting normally: " + str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "\n")
+  DATABASE.close() #write out everything still in memory
+  NOTIFY.close(2) #alarm messages due now
+  JOURNAL.log("exit", how="menu")
+  JOURNAL.close()
 
-  database_file.close()
-
-  print "Killing gnuplot script..."
-  system("pkill -9 gnuplot")
+  if CHART_BACKEND == "gnuplot":
+    print "Closing gnuplot..."
+    for_each_chamber(kill_gnuplot)
 
   print "Exiting program..."
+  sys.stdout.flush()
   time.sleep(2)
   exit(0)
 
@@ -770,8 +1149,9 @@ def exit_program():
 ######### ALARM FUNCTIONS ##############################################
 
 #check alarms###########################################################
+#the rules of ALARM_RULES are evaluated against the live values of the reading just taken
 def check_alarms():
-  global IS_ALARM,ALARM_HIGH_TEMP,ALARM_LOW_TEMP,ALARM_COOLER_MALFUNC,ALARM_HEATER_MALFUNC, MAX_HIGH_TEMP,MIN_LOW_TEMP,TIME_BEFORE_ALARM_TRIGGER,BREW_CYCLE,ALARM_SYS_ON
+  global IS_ALARM,ALARM_HIGH_TEMP,ALARM_LOW_TEMP,ALARM_HEATER_MALFUNC,ALARM_COOLER_MALFUNC
 
 #exit function if program has just started - need to wait 60 seconds
   if time.time() - PROGRAM_START_TIME < 60:
@@ -786,34 +1166,31 @@ def check_alarms():
     return
 
   if BREW_CYCLE == "Off  ": #if brew cycle is off don't display alarms on screen
-    IS_ALARM = False
-    ALARM_LOW_TEMP = False
-    ALARM_HIGH_TEMP = False
-    display_alarm()
-    return
-
-#check for over or under temperature condition
-  if O_trending.moving_avg_temp > MAX_HIGH_TEMP:
-    ALARM_HIGH_TEMP = True
+    for rule in ALARMS.reset():
+      alarm_event(rule, False)
+    malfunctions = []
   else:
-    ALARM_HIGH_TEMP = False
-
-  if O_trending.moving_avg_temp < MIN_LOW_TEMP:
-    ALARM_LOW_TEMP = True
-  else:
-    ALARM_LOW_TEMP = False
-
-  if ALARM_LOW_TEMP or ALARM_HIGH_TEMP:
-    IS_ALARM = True
-  else:
-    ALARM_LOW_TEMP = False
-    ALARM_HIGH_TEMP = False
-    IS_ALARM = False
-
-#alarm function should check if cooler or heater is running and if temp is adjusting over time accordingly
+    live = {"avg": O_trending.moving_avg_temp, "reading": current_temperature, "ewma": O_trending.ewma_temp,
+            "slope": O_trending.slope, "max_high": MAX_HIGH_TEMP, "min_low": MIN_LOW_TEMP, "desired": DESIRED_TEMP}
+    if USE_CELSIUS: scale = 1.0
+    else: scale = 9.0 / 5.0
+    for rule, raised in ALARMS.evaluate(time.time(), live, scale):
+      alarm_event(rule, raised)
+    malfunctions = [watch for watch in (HEATER_WATCH, COOLER_WATCH) if watch.active]
+
+  if (HEATER_WATCH in malfunctions) != ALARM_HEATER_MALFUNC: alarm_event(HEATER_WATCH, not ALARM_HEATER_MALFUNC)
+  if (COOLER_WATCH in malfunctions) != ALARM_COOLER_MALFUNC: alarm_event(COOLER_WATCH, not ALARM_COOLER_MALFUNC)
+
+  ALARM_HIGH_TEMP = ALARMS.active("high")
+  ALARM_LOW_TEMP = ALARMS.active("low")
+  ALARM_HEATER_MALFUNC = HEATER_WATCH in malfunctions
+  ALARM_COOLER_MALFUNC = COOLER_WATCH in malfunctions
+  IS_ALARM = len(active_alarms()) > 0
 
   display_alarm()
 
+  if BREW_CYCLE == "Off  ": return
+
   print "\033[25;20H|  H",round(MAX_HIGH_TEMP,0),"| L",round(MIN_LOW_TEMP,0) 
 
   if IS_ALARM:
@@ -821,22 +1198,75 @@ def check_alarms():
 
   return
 
+#heater and cooler malfunctions###########################################
+#the relays are watched on every reading, alarms on or off, so the response is learned from every cycle
+#check_alarms() raises the alarms
+def watch_relays():
+
+  #keep the batch away from the ends of the yeast's range when a yeast profile is set
+  if Y_HIGH_TEMP > Y_LOW_TEMP: high, low = to_celsius(Y_HIGH_TEMP), to_celsius(Y_LOW_TEMP)
+  else: high = low = None
+
+  #HEATER_ON/COOLER_ON are still what the relays were since the reading before
+  now = time.time()
+  HEATER_WATCH.update(now, to_celsius(current_temperature), HEATER_ON, low)
+  COOLER_WATCH.update(now, to_celsius(current_temperature), COOLER_ON, high)
+
+  return
+
+#alarms that are on - rules and relay malfunctions########################
+def active_alarms():
+
+  alarms = ALARMS.active()
+  if ALARM_HEATER_MALFUNC: alarms.append(HEATER_WATCH)
+  if ALARM_COOLER_MALFUNC: alarms.append(COOLER_WATCH)
+
+  return alarms
+
+#alarm raised and cleared events###########################################
+def alarm_event(rule, raised):
+
+  if raised: log_event("alarm", alarm=rule.name, value=round(rule.value, 2), message=rule.message)
+  else: log_event("alarm_cleared", alarm=rule.name, value=round(rule.value or 0, 2))
+
+  return
+
 #sms_alarm################################################################
+#queues the message and returns - NOTIFY sends it, at most one every NOTIFY_RATE_LIMIT seconds per alarm
 def sms_alarm():
-  global TIME_LAST_SMS,SMS_INTERVAL
 
-  if SMS_ALARM_ON:
-    if (time.time() - TIME_LAST_SMS > SMS_INTERVAL):#check to make sure it's been over an hour
-      if ALARM_HIGH_TEMP:
-        os.system('curl http://textbelt.com/text -d number='+CELL_NUMBER+' -d "message=bcc alarm - High Temp"')
-        TIME_LAST_SMS = time.time()#update time last sent SMS
-      elif ALARM_LOW_TEMP:
-        os.system('curl http://textbelt.com/text -d number='+CELL_NUMBER+' -d "message=bcc alarm - Low Temp"')
-        TIME_LAST_SMS = time.time()#update time last sent SMS
+  if not SMS_ALARM_ON: return
+
+  for rule in active_alarms():
+    NOTIFY.notify(CHAMBER_NAME + " " + rule.name, 'bcc alarm -'+chamber_label()+' '+rule.message, CHAMBER_NAME,
+                  NOTIFY_RATE_LIMIT)
+
+  return
+
+#open the alarm message dispatcher##########################################
+def open_notifier():
+  global NOTIFY
+
+  transports, problems = bccnotify.make_transports(NOTIFY_TRANSPORTS, NOTIFY_URL, CELL_NUMBER, NOTIFY_SMTP_HOST,
+                                                   NOTIFY_EMAIL_FROM, NOTIFY_EMAIL_TO, NOTIFY_FILE, NOTIFY_SOCKET)
+  for problem in problems:
+    DATABASE.write("Notify: " + problem + "\n")
 
-      draw_screen()
-      print_output()
-      display_alarm()
+  NOTIFY = bccnotify.Dispatcher(transports, rate_limit=NOTIFY_RATE_LIMIT, on_result=notify_result)
+
+  import atexit
+  atexit.register(NOTIFY.close) #runs before the journal is closed
+
+  return
+
+#result of sending an alarm message - called by the NOTIFY thread########
+def notify_result(notification, transport, ok, error):
+
+  try:
+    JOURNAL.log("sms", notification.chamber, message=notification.message, transport=transport, ok=ok, error=error,
+                tries=notification.attempts[transport])
+  except ValueError:
+    pass #journal already closed
 
   return
 
@@ -864,33 +1294,177 @@ def display_alarm():
   else:
     print "\033[27;35HOFF"
 
+  #heater/cooler malfunctions and the other rules (rate, stale sensor...)
+  if [rule for rule in active_alarms() if rule.name not in ("high", "low")]:
+    print "\033[28;35H\033[31mON \033[39m"
+  else:
+    print "\033[28;35HOFF"
+
   if BREW_CYCLE == "Off  ":   
     print "\033[24;26HOFF" 
     print "\033[24;36HOFF"
     print "\033[26;35HOFF"
     print "\033[27;35HOFF"
+    print "\033[28;35HOFF"
   
   return
 
 
 ######### PROGRAM OPERATION FUNCTIONS ###########################
 
-#delay_loop function#############################################
-def delay_loop():
-  #delay for 15 seconds/check user input every second/display running indicator
-    
-  for x in xrange(15):
-    if x % 5 == 0: print "\033[15;21H[    =    ]"
-    if x % 5 == 1: print "\033[15;21H[   =-=   ]"
-    if x % 5 == 2: print "\033[15;21H[  =-=-=  ]"
-    if x % 5 == 3: print "\033[15;21H[ =-=-=-= ]"
-    if x % 5 == 4: print "\033[15;21H[=-=-=-=-=]"
+#service_chamber function########################################
+def service_chamber():
+  #read, control, alarm and log the loaded chamber - called every 15 seconds for every chamber
+  global current_temperature,wort_temperature
+
+  #call the calculate temperature function and assign the results to current temperature
+  current_temperature = calculate_temperature()
+  if WORT_AIN is not None: wort_temperature = calculate_temperature(WORT_AIN)
+
+  #what the reading says about the relays before they are switched
+  watch_relays()
+
+  #call the control function and pass the moving average temperature - it turns the heater and cooler on or off
+  control_relays(O_trending.moving_avg_temp)
+
+  #move the trend average
+  O_trending.move_average(current_temperature)
+
+  #set the min and max temperatures
+  min_max()
+
+  #check alarms
+  check_alarms()
+
+  #add the reading to the history
+  add_rollup()
+
+  #update the screen
+  print_output()
+
+  #write to database file
+  write_database()
+
+  #fit the chamber model to the new database rows
+  refit_model()
+
+  #write the brew session data to the data file
+  write_chart_data()
+
+  #update the chart axis range and title
+  update_chart()
+
+  return
+
+#scheduler################################################################
+#runs functions on a fixed schedule and handles keyboard input the moment it
+#arrives - between the two it sleeps in select() so the program only wakes up
+#when there is something to do. Times come from the monotonic clock and every
+#timer is due a whole number of intervals after it started, so the time the
+#functions take never makes the schedule drift.
+
+class Scheduler:
+
+  def __init__(self, screen=None):
+
+    self.screen = screen #screen to update after every event
+    self.timers = [] #heap of [due time, number, interval, function]
+    self.number = 0 #keeps timers due at the same time in the order they were added
+    self.watch_input = True #stop watching stdin once it is closed
+
+    return
+
+
+  def every(self, interval, function, delay=0):#call function every interval seconds
+
+    self.number += 1
+    heapq.heappush(self.timers, [bcchw.monotonic() + delay, self.number, interval, function])
+
+    return
+
+
+  def after(self, delay, function):#call function once, delay seconds from now
+
+    self.every(None, function, delay)
+
+    return
+
+
+  def run_once(self):#wait for the next timer or a keypress and handle it
+
+    due = self.timers[0][0]
+    if self.screen is not None and self.screen.due() is not None: #screen update held back by the rate cap
+      due = min(due, bcchw.monotonic() + max(self.screen.due() - time.time(), 0))
+    wait = max(due - bcchw.monotonic(), 0)
+
+    if self.watch_input:
+      ready = select.select([sys.stdin],[],[],wait)[0]
+    else:
+      time.sleep(wait)
+      ready = []
+
+    if ready:
+      if self.screen is not None: self.screen.input_echoed()
+      if not check_input(): #stdin was closed - keep controlling without it
+        self.watch_input = False
+
+    now = bcchw.monotonic()
+    while self.timers[0][0] <= now:
+      timer = heapq.heappop(self.timers)
+      timer[3]()
+      if timer[2] is None: continue #one shot
+      #next due time on the original grid - skip any intervals we were too busy to run
+      timer[0] += timer[2] * max(1, math.ceil((bcchw.monotonic() - timer[0]) / timer[2]))
+      heapq.heappush(self.timers, timer)
 
-    print "\033[16;0H\033[0K\033[15;0H"
+    if self.screen is not None: self.screen.render()
 
-    check_input()
+    return
+
+
+  def run(self):
+
+    while True:
+      self.run_once()
+
+SCHEDULER = None #created when the main program loop starts
+
+#running indicator###############################################
+RUNNING_FRAMES = ["[    =    ]", "[   =-=   ]", "[  =-=-=  ]", "[ =-=-=-= ]", "[=-=-=-=-=]"]
+RUNNING_FRAME = 0
+
+def show_running():
+  #move the running indicator one step - once a cycle
+  global RUNNING_FRAME
+
+  print "\033[15;21H" + RUNNING_FRAMES[RUNNING_FRAME]
+
+  check_form_timeout()
+
+  if ACTIVE_FORM is not None: ACTIVE_FORM.show() #put the question and the cursor back
+  else: print "\033[16;0H\033[0K\033[15;0H"
+
+  RUNNING_FRAME = (RUNNING_FRAME + 1) % len(RUNNING_FRAMES)
+
+  return
+
+#control_cycle function##########################################
+def control_cycle():
+  #service every chamber - called every LOOP_INTERVAL seconds by the scheduler
+
+  for chamber in CHAMBERS:
+    switch_chamber(chamber)
 
-    time.sleep(1) #sleep for 1 second and repeat while True loop
+    if chamber is not DISPLAY_CHAMBER: sys.stdout = QUIET_OUTPUT
+
+    try:
+      service_chamber()
+    finally:
+      sys.stdout = SCREEN_OUTPUT
+
+  switch_chamber(DISPLAY_CHAMBER)
+
+  show_running()
 
   return
 
@@ -904,29 +1478,34 @@ def self_test():
   print "\033[3;0H~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
   print "\033[4;0HBy: My BBB Projects"
 
-  print "\033[6;0H\033[0KPerforming self test..."
-  time.sleep(1) #sleep for 1 second to slow down test sequence - change/remove if desired
-  #turn on heater LED
-  print "\033[7;0H\033[0KTurning on RED LED"
-  GPIO.output("P9_15",GPIO.HIGH)
-  time.sleep(0.1)
-  print "\033[8;0H\033[0KTurning off RED LED"
-  GPIO.output("P9_15",GPIO.LOW)
-  time.sleep(0.1)
-  print "\033[9;0H\033[0KTurning on GREEN LED"
-  GPIO.output("P9_23",GPIO.HIGH)
-  time.sleep(0.1)
-  print "\033[10;0H\033[0KTurning off GREEN LED"
-  GPIO.output("P9_23",GPIO.LOW)
-  time.sleep(0.1)
-
-  adcValue = ADC.read("AIN0") * VDD_ADC
-
-  if adcValue > AIN_MIN and adcValue < AIN_MAX: 
-    print "\033[11;0H\033[0KadcValue OK:", adcValue
-  else: 
-    print "\033[11;0H\033[0K\033[31madcValue Out Of Bounds:",adcValue,"\033[39m"
-    exit(0)
+  for chamber in CHAMBERS: #test the pins of every chamber
+    switch_chamber(chamber)
+
+    print "\033[6;0H\033[0KPerforming self test..."+chamber_label()
+    time.sleep(1) #sleep for 1 second to slow down test sequence - change/remove if desired
+    #turn on heater LED
+    print "\033[7;0H\033[0KTurning on RED LED"
+    HW.output(HEATER_PIN, True)
+    time.sleep(0.1)
+    print "\033[8;0H\033[0KTurning off RED LED"
+    HW.output(HEATER_PIN, False)
+    time.sleep(0.1)
+    print "\033[9;0H\033[0KTurning on GREEN LED"
+    HW.output(COOLER_PIN, True)
+    time.sleep(0.1)
+    print "\033[10;0H\033[0KTurning off GREEN LED"
+    HW.output(COOLER_PIN, False)
+    time.sleep(0.1)
+
+    adcValue = HW.read_adc(SENSOR_AIN) * VDD_ADC
+
+    if adcValue > AIN_MIN and adcValue < AIN_MAX: 
+      print "\033[11;0H\033[0KadcValue OK:", adcValue
+    else: 
+      print "\033[11;0H\033[0K\033[31madcValue Out Of Bounds:",adcValue,SENSOR_AIN,"\033[39m"
+      exit(0)
+
+  switch_chamber(DISPLAY_CHAMBER)
 
   #time.sleep(1)
   print "\033[12;0H\033[0KTest complete"
@@ -938,52 +1517,108 @@ def self_test():
   print "\033[2J" #clear screen
   return
 
+#build the thermistor lookup table##############################
+#call again whenever R_BIAS, VDD_ADC or the thermistor constants are changed
+def init_thermistor_table():
+  global THERM_TABLE
+
+  THERM_TABLE = bcctemp.ThermistorTable(R_BIAS, VDD_ADC, T_a, T_b, T_c)
+
+  return
+
 #calculate temperature function################################
-def calculate_temperature():
+def calculate_temperature(ain=None):
     #define global variables
-    global VDD_ADC, R_BIAS, c2kelvin, T_a, T_b, T_c, USE_CELSIUS
-
-    #read AIN0 pin and calculate voltage 
-    Vout = ADC.read("AIN0") * VDD_ADC
+    global USE_CELSIUS, SENSOR_AIN, ADC_SAMPLES, ADC_FILTER
 
-    #calculate thermistor resistance R1
-    res_therm = R_BIAS * (VDD_ADC - Vout) / Vout
+    if ain is None: ain = SENSOR_AIN #the chamber probe, or the wort probe when WORT_AIN is passed
 
-    #calculate temperature in kelvin
-    temp_kelvin = 1.0/(T_a + T_b * math.log(res_therm) + T_c * pow(math.log(res_therm),3.0))
-    temp_celsius = temp_kelvin - c2kelvin
+    #read AIN0 pin ADC_SAMPLES times, filter the reads and look up the temperature - the table
+    #interpolates the Steinhart-Hart equation to within THERM_TABLE.max_error degrees C
+    temp_celsius = THERM_TABLE.temperature(bcchw.read_filtered(HW, ain, ADC_SAMPLES, ADC_FILTER))
     temp_fahren = (temp_celsius * 9.0/5.0) + 32
 
     if USE_CELSIUS: return temp_celsius
     else: return temp_fahren
 
+#temperature in Celsius#######################################
+def to_celsius(temp):
+
+  if USE_CELSIUS: return temp
+
+  return (temp - 32) * 5.0 / 9.0
+
+#chamber model##############################################
+#MODEL_FIT adds the chamber's database.csv rows written since the last fit and MODEL (mpc) gets what was fitted -
+#a long file is read MODEL_READ_BYTES at a time, one piece every reading, so it never holds up the control
+def refit_model():
+  global MODEL_FIT_TIME
+
+  if MODEL_REFIT <= 0 or DATABASE_MODE != "change": return #interval rows don't show when the relays switched
+  if SIM_SPEED != 1.0: return #the rows of a sped up simulator have the wrong times
+  if time.time() - MODEL_FIT_TIME < MODEL_REFIT and not MODEL_FIT.behind: return
+  MODEL_FIT_TIME = time.time()
+
+  try:
+    MODEL_FIT.read("database.csv", CHAMBER_NAME, MODEL_READ_BYTES)
+    MODEL_FIT.save()
+  except (IOError, OSError):
+    return #try again next time
+
+  MODEL_FIT.apply(MODEL)
+
+  return
+
+#control function#############################################
+#CONTROL decides (deadband, pid, cascade or mpc - see bcccontrol.py), the heater and cooler functions switch the relays
+def control_relays(MAvg_temp):
+
+  if time.time() - PROGRAM_START_TIME < 60 or BREW_CYCLE == "Off  ":
+    CONTROL.reset()
+    heater_control(False)
+    cooler_control(False)
+    return
+
+  if wort_temperature is None: wort = None
+  else: wort = to_celsius(wort_temperature)
+
+  dwell = DWELL
+  if not USE_CELSIUS: dwell = DWELL * 5.0 / 9.0
+
+  heater_wanted, cooler_wanted = CONTROL.relays(time.time(), to_celsius(MAvg_temp), to_celsius(DESIRED_TEMP), dwell, wort)
+
+  heater_control(heater_wanted)
+  cooler_control(cooler_wanted)
+
+  return
+
 #cooler control function######################################
-def cooler_control(MAvg_temp):
-    global COOLER_ON, DESIRED_TEMP, DWELL, TIME_LAST_COOLER, COOLER_TIME
+def cooler_control(wanted):
+    global COOLER_ON, TIME_LAST_COOLER, COOLER_TIME
 
     if time.time() - PROGRAM_START_TIME < 60:
       COOLER_ON = False
-      GPIO.output("P9_23",GPIO.LOW)
+      HW.output(COOLER_PIN, False)
       print "\033[25;0H\033[93m Cooler: OFF\033[0m"
       return
     
     if BREW_CYCLE == "Off  ":
       COOLER_ON = False
       print "\033[25;0H Cooler: OFF      "
-      GPIO.output("P9_23",GPIO.LOW)
+      HW.output(COOLER_PIN, False)
       return
       
-    if MAvg_temp > DESIRED_TEMP + DWELL/2.0:
+    if wanted:
       if time.time() - TIME_LAST_COOLER > COOLER_TIME: #has it been more than 5 minutes?
         if not COOLER_ON:
           COOLER_ON = True
-          GPIO.output("P9_23",GPIO.HIGH)
+          HW.output(COOLER_PIN, True)
       else:
-        print "\033[25;0H\033[93m Cooler: OFF", round(300-(time.time()-TIME_LAST_COOLER),0),"\033[39m"
+        print "\033[25;0H\033[93m Cooler: OFF", round(COOLER_TIME-(time.time()-TIME_LAST_COOLER),0),"\033[39m"
         return
     elif COOLER_ON:
       COOLER_ON = False
-      GPIO.output("P9_23",GPIO.LOW)
+      HW.output(COOLER_PIN, False)
       TIME_LAST_COOLER = time.time()#reset cooler timer
 
     if COOLER_ON: 
@@ -994,8 +1629,8 @@ def cooler_control(MAvg_temp):
     return
 
 #heater control function#######################################
-def heater_control(MAvg_temp):
-    global HEATER_ON, DESIRED_TEMP, DWELL
+def heater_control(wanted):
+    global HEATER_ON
 
     if time.time() - PROGRAM_START_TIME < 60:
       print "\033[26;0H\033[93m Heater: OFF\033[0m"
@@ -1004,16 +1639,16 @@ def heater_control(MAvg_temp):
     if BREW_CYCLE == "Off  ":
       HEATER_ON = False
       print "\033[26;0H Heater: OFF      "
-      GPIO.output("P9_15",GPIO.LOW)
+      HW.output(HEATER_PIN, False)
       return
 
-    if MAvg_temp < DESIRED_TEMP - DWELL/2.0:
+    if wanted:
       if not HEATER_ON:
           HEATER_ON = True
-          GPIO.output("P9_15",GPIO.HIGH)
+          HW.output(HEATER_PIN, True)
     elif HEATER_ON:
       HEATER_ON = False
-      GPIO.output("P9_15",GPIO.LOW)
+      HW.output(HEATER_PIN, False)
 
     if HEATER_ON: 
       print "\033[26;0H Heater: \033[91mON \033[0m"
@@ -1023,42 +1658,160 @@ def heater_control(MAvg_temp):
     return
 
 #Trend Class##############################################
-#calculates whether temp went up or down or stayed the same since last checked
+#keeps the last TREND_WINDOW seconds of temperatures in a fixed size ring buffer
+#and updates the moving average, standard deviation, min/max, EWMA and the
+#least squares slope in O(1) for every new temperature
 
 class Trend:
 
-  def __init__(self):#######################
+  def __init__(self, window=None, interval=None):#######################
+
+    if window is None: window = TREND_WINDOW
+    if interval is None: interval = LOOP_INTERVAL
 
-    #initialize static variables
+    self.capacity = max(2, int(round(window / float(interval)))) #number of temperatures in the window
+    self.values = array('d', [0.0] * self.capacity) #ring buffer of temperatures
+    self.times = array('d', [0.0] * self.capacity) #and the time each was read
+    self.count = 0 #number of temperatures in the buffer
+    self.index = 0 #where the next temperature goes
+    self.seq = 0 #number of temperatures added so far
+
+    #temperatures are stored in the scale they were read in, the shown value is
+    #stored * factor + offset so switching C/F never has to touch the buffer
+    self.factor = 1.0
+    self.offset = 0.0
+
+    #running sums for the average, variance and slope - times are relative to time_base
+    self.time_base = 0.0
+    self.sum_y = self.sum_yy = self.sum_t = self.sum_tt = self.sum_ty = 0.0
+
+    #monotonic queues of (seq, value) for the window min and max
+    self.min_queue = deque()
+    self.max_queue = deque()
+
+    self.ewma = None #exponentially weighted moving average (stored scale)
+    self.alpha = 2.0 / (self.capacity + 1) #same "age" as the moving average
+
+    #shown values
     self.trend ="-"
     self.moving_avg_temp = 0
-    self.temp1 = 0
-    self.temp2 = 0
-    self.temp3 = 0
-    self.temp4 = 0
+    self.std_dev = 0
+    self.min_temp = 0
+    self.max_temp = 0
+    self.ewma_temp = 0
+    self.slope = 0 #degrees per hour
 
     return
 
 
-  def move_average(self):#Called every 15 seconds from main program loop#
+  def move_average(self, temperature, now=None):#Called every LOOP_INTERVAL seconds from main program loop#
+
+    if now is None: now = time.time()
+
+    value = (temperature - self.offset) / self.factor
+
+    if self.count == 0: self.time_base = now
 
-    #move the temperatures through the 4 variables
-    #since this is updated every 15 seconds there is one minute of data stored here
-    self.temp4 = self.temp3
-    self.temp3 = self.temp2
-    self.temp2 = self.temp1
-    self.temp1 = current_temperature
+    if self.count == self.capacity: #window is full - take the oldest temperature out of the sums
+      old_y = self.values[self.index]
+      old_t = self.times[self.index] - self.time_base
+      self.sum_y -= old_y
+      self.sum_yy -= old_y * old_y
+      self.sum_t -= old_t
+      self.sum_tt -= old_t * old_t
+      self.sum_ty -= old_t * old_y
+    else:
+      self.count += 1
+
+    self.values[self.index] = value
+    self.times[self.index] = now
+
+    t = now - self.time_base
+    self.sum_y += value
+    self.sum_yy += value * value
+    self.sum_t += t
+    self.sum_tt += t * t
+    self.sum_ty += t * value
+
+    self.seq += 1
+    while self.min_queue and self.min_queue[-1][1] >= value: self.min_queue.pop()
+    self.min_queue.append((self.seq, value))
+    while self.max_queue and self.max_queue[-1][1] <= value: self.max_queue.pop()
+    self.max_queue.append((self.seq, value))
+    while self.min_queue[0][0] <= self.seq - self.capacity: self.min_queue.popleft()
+    while self.max_queue[0][0] <= self.seq - self.capacity: self.max_queue.popleft()
 
-    self.set_average() #average the 4 values
-    self.set_trend() #set the trend indicator
+    if self.ewma is None: self.ewma = value
+    else: self.ewma += self.alpha * (value - self.ewma)
+
+    self.index += 1
+    if self.index == self.capacity:
+      self.index = 0
+      self.rebase() #once per trip around the buffer - stops rounding errors building up in the sums
+
+    self.set_average() #average, spread and min/max of the window
+    self.set_trend() #set the slope and the trend indicator
+
+    return
+
+
+  def rebase(self):#recalculate the running sums from the buffer with the oldest time as the base
+
+    self.time_base = self.oldest_time()
+    self.sum_y = self.sum_yy = self.sum_t = self.sum_tt = self.sum_ty = 0.0
+
+    for x in xrange(self.count):
+      y = self.values[x]
+      t = self.times[x] - self.time_base
+      self.sum_y += y
+      self.sum_yy += y * y
+      self.sum_t += t
+      self.sum_tt += t * t
+      self.sum_ty += t * y
+
+    return
+
+
+  def oldest_time(self):
+
+    if self.count < self.capacity: return self.times[0]
+
+    return self.times[self.index]
+
+
+  def recent(self, number):#the last number temperatures, newest first, in the shown scale
+
+    temps = []
+    for x in xrange(min(number, self.count)):
+      temps.append(self.values[(self.index - 1 - x) % self.capacity] * self.factor + self.offset)
+
+    return temps
+
+
+  def convert(self, factor, offset):#change scale: new temperature = temperature * factor + offset
+
+    self.offset = self.offset * factor + offset
+    self.factor = self.factor * factor
+
+    if self.count:
+      self.set_average()
+      self.set_trend()
 
     return
 
 
   def set_trend(self):######################
 
-    if current_temperature > self.moving_avg_temp+.02: self.trend = "^" #upward trend
-    elif current_temperature < self.moving_avg_temp-.02: self.trend = "v" #downward trend
+    n = self.count
+    denom = n * self.sum_tt - self.sum_t * self.sum_t
+
+    if n > 1 and denom > 0:
+      self.slope = (n * self.sum_ty - self.sum_t * self.sum_y) / denom * 3600.0 * self.factor
+    else:
+      self.slope = 0
+
+    if self.slope > TREND_SLOPE: self.trend = "^" #upward trend
+    elif self.slope < -TREND_SLOPE: self.trend = "v" #downward trend
     else: self.trend = "-"
     
     return
@@ -1066,7 +1819,18 @@ class Trend:
 
   def set_average(self):###################
 
-    self.moving_avg_temp = (self.temp1 + self.temp2 + self.temp3 + self.temp4) / 4.0
+    n = float(self.count)
+    mean = self.sum_y / n
+    variance = max(self.sum_yy / n - mean * mean, 0.0)
+
+    self.moving_avg_temp = mean * self.factor + self.offset
+    self.std_dev = math.sqrt(variance) * abs(self.factor)
+    self.ewma_temp = self.ewma * self.factor + self.offset
+
+    low = self.min_queue[0][1] * self.factor + self.offset
+    high = self.max_queue[0][1] * self.factor + self.offset
+    self.min_temp = min(low, high) #a negative factor would swap them
+    self.max_temp = max(low, high)
 
     return
 
@@ -1097,6 +1861,19 @@ def reset_min_max():
 
 ######### DISPLAY FUNCTIONS ##############################################
 
+#Once the program is running everything printed goes to SCREEN (see bccscreen.py),
+#which only sends the characters that changed to the terminal.
+SCREEN = None
+SCREEN_MIN_INTERVAL = 0.25 #seconds between screen updates
+
+#paint the whole screen on the next update################################
+#for when something else (gnuplot, curl) wrote on the terminal
+def refresh_screen():
+
+  if SCREEN is not None: SCREEN.invalidate()
+
+  return
+
 #draw screen##############################################################
 def draw_screen():
 
@@ -1107,7 +1884,7 @@ def draw_screen():
   print "\033[3;0H~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~"
   print "\033[4;0HBy: My BBB Projects"
 
-  print "\033[5;0H"
+  print "\033[5;0H\033[0K",CHAMBER_NAME,"("+str(DISPLAY_CHAMBER.number),"of",str(len(CHAMBERS))+")"
   print "\033[6;0H-----------------------=MENU=---------------------"
   print "\033[7;0H| S - Scale(C/F) | A - Alarms    | C - Clear     |"     
   print "\033[8;0H| T - Set Temp   | B - New Brew  | L - Lager     |"
@@ -1115,7 +1892,7 @@ def draw_screen():
   print "\033[10;0H| Y - Yeast Prof | G - Graphics  | O - Off       |"
   print "\033[11;0H|                |               | R - Crash     |"
   print "\033[12;0H|                |               | W - Warm      |"
-  print "\033[13;0H|                |               |               |"
+  print "\033[13;0H| K - Chamber    |               |               |"
   print "\033[14;0H|                | X - Exit      |               |"
   print "\033[15;0H====================[         ]==================="
 
@@ -1140,10 +1917,10 @@ def draw_screen():
   print "\033[27;39H\033[0K |  Min:              "
   print "\033[28;39H\033[0K |  Max:              "
 
-  print "\033[24;61H\033[0K |  T1:       "
-  print "\033[25;61H\033[0K |  T2:       "
-  print "\033[26;61H\033[0K |  T3:       "
-  print "\033[27;61H\033[0K |  T4:       "
+  print "\033[24;61H\033[0K |  Slp/h:    "
+  print "\033[25;61H\033[0K |  SDev:     "
+  print "\033[26;61H\033[0K |  EWMA:     "
+  print "\033[27;61H\033[0K |  Range:    "
   print "\033[28;61H\033[0K |  MAvg:     "
 
   print "\033[24;77H\033[0K |  Deadband: "
@@ -1177,11 +1954,11 @@ def print_output():
   print "\033[27;55H",round(MIN_TEMP,1)
   print "\033[28;55H",round(MAX_TEMP,1)
 
-  print "\033[24;71H",round(O_trending.temp1,1)
-  print "\033[25;71H",round(O_trending.temp2,1)
-  print "\033[26;71H",round(O_trending.temp3,1)
-  print "\033[27;71H",round(O_trending.temp4,1)
-  print "\033[28;71H",round(O_trending.moving_avg_temp,1)
+  print "\033[24;71H",round(O_trending.slope,2),"  "
+  print "\033[25;71H",round(O_trending.std_dev,2),"  "
+  print "\033[26;71H",round(O_trending.ewma_temp,1),"  "
+  print "\033[27;71H",round(O_trending.max_temp - O_trending.min_temp,2),"  "
+  print "\033[28;71H",round(O_trending.moving_avg_temp,1),"  "
 
   print "\033[26;77H\033[0K |  "+str(datetime.now().strftime("%Y-%m-%d %H:%M"))
 
@@ -1189,9 +1966,12 @@ def print_output():
     print "\033[27;77H\033[0K |  Charts: ON - "+str(CHARTING_INTERVAL/60)
   else: print "\033[27;77H\033[0K |  Charts: OFF"
 
-  print "\033[28;77H\033[0K |"#  "+str(PLOT_STARTED)+" "+str(DATA_TO_PLOT)
+  print "\033[28;77H\033[0K |  "+chart_sparkline()#  "+str(PLOT_STARTED)+" "+str(DATA_TO_PLOT)
 
-  print "\033[24;90H\033[0K",round(DWELL,1)
+  if CONTROL_MODE == "deadband": print "\033[24;90H\033[0K",round(DWELL,1)
+  else: print "\033[24;90H\033[0K",round(DWELL,1),CONTROL_MODE,str(int(round(CONTROL.output * 100)))+"%"
+
+  if wort_temperature is not None: print "\033[28;0H\033[0K Wort:",round(wort_temperature,1)
 
 
   print "\033[30;0H\033[0K",Y_PROF_ID,"|",Y_LAB,"|",Y_NUM,"|",Y_NAME,"|",Y_STYLE,"|",round(Y_LOW_TEMP,1),"|",round(Y_HIGH_TEMP,1)
@@ -1200,114 +1980,75 @@ def print_output():
   print "\033[33;0H\033[0K BREW INFO"
   print "\033[34;0H\033[0K",BREW_NAME,"|",BREW_BATCH_NUM,"|",BREW_BATCH_SIZE,"|",BREW_STYLE,"|",BREW_METHOD
 
+  if len(CHAMBERS) > 1:
+    print_chamber_summary()
+
+  return
+
+#print one line per chamber#########################################
+def print_chamber_summary():
+
+  save_chamber() #make sure the loaded chamber's line is up to date
+
+  print "\033[36;0H\033[0K CHAMBERS"
+  row = 37
+  for chamber in CHAMBERS:
+    state = chamber.state
+    if state["HEATER_ON"]: heater = "ON "
+    else: heater = "OFF"
+    if state["COOLER_ON"]: cooler = "ON "
+    else: cooler = "OFF"
+    if state["IS_ALARM"]: alarm = "\033[31mALARM\033[39m"
+    else: alarm = "     "
+    if chamber is DISPLAY_CHAMBER: marker = ">"
+    else: marker = " "
+    print "\033["+str(row)+";0H\033[0K"+marker,state["CHAMBER_NAME"],"|",state["BREW_CYCLE"],"| Dsrd",round(state["DESIRED_TEMP"],1), \
+          "| MAvg",round(state["O_trending"].moving_avg_temp,1),"| Heater",heater,"| Cooler",cooler,"|",alarm
+    row += 1
 
   return
 
 
 ######### DATABASE FUNCTIONS ###################################################
 
-#init gnuplot script ####################################################
-def init_gnuplot_script():
-  global Y_LOW_TEMP,Y_HIGH_TEMP,LOW_TEMP,HIGH_TEMP,BREW_SESSION_FILENAME,LAST_BREW_SESSION_TIME,CHARTING_ON
+#init chart data ####################################################
+def init_chart_data():
+  global LAST_BREW_SESSION_TIME,CHART
 
   if not CHARTING_ON:
     return
 
   LAST_BREW_SESSION_TIME = 0
 
-  #decide what range to use for the y axis - use the lower temperature
-  if Y_LOW_TEMP < MIN_TEMP: low_scale_temp = round(Y_LOW_TEMP,2)
-  else: low_scale_temp = round(MIN_TEMP,2)
-  #decide what range to use for the y axis - use the higher temperature
-  if Y_HIGH_TEMP > MAX_TEMP: high_scale_temp = round(Y_HIGH_TEMP,2)
-  else: high_scale_temp = round(MAX_TEMP,2)
-
-  gnuplot_script_file = open(BREW_SESSION_FILENAME+".gp", "w")#create the brew session gnuplot script
-
-  gnuplot_script_file.write("#!/usr/bin/gnuplot\n")
-  gnuplot_script_file.write("# bcc.py created gnuplot file\n")
-  gnuplot_script_file.write("#\n\n")
-  gnuplot_script_file.write("reset\n")
-  gnuplot_script_file.write("set xdata time\n")
-  gnuplot_script_file.write("set xrange[*:*]\n")
-  gnuplot_script_file.write("set timefmt \"%Y-%m-%d %H:%M:%S\"\n")
-  gnuplot_script_file.write("set yrange["+str(low_scale_temp-5)+":"+str(high_scale_temp+5)+"]\n")
-  gnuplot_script_file.write("set mytics 5\n")
-  gnuplot_script_file.write("set xtics 1\n")
-  gnuplot_script_file.write("set datafile separator \",\"\n")
-  gnuplot_script_file.write("set title \""+BREW_SESSION_FILENAME+"\"\n")
-  gnuplot_script_file.write("set xlabel \"Time\"\n")
-  gnuplot_script_file.write("set ylabel \"Temperature\"\n")
-  gnuplot_script_file.write("set grid\n")
-  gnuplot_script_file.write("plot \'"+BREW_SESSION_FILENAME+".dat\' using 1:2 title \"Avg Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:2 title \"Smoothed\" smooth bezier with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:3 title \"Min Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:4 title \"Max Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:5 title \"Des Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:6 title \"Hi Alarm\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:7 title \"Lo Alarm\" with lines\n")
-  gnuplot_script_file.write("pause "+str(CHARTING_INTERVAL)+"\n")
-  gnuplot_script_file.write("reread\n")
-
-#  gnuplot_script_file.write("pause 1\n")
-
-
-  gnuplot_script_file.close()
-
-  gnuplot_script_data_file = open(BREW_SESSION_FILENAME+".dat", "w")#create the brew session gnuplot script
-  gnuplot_script_data_file.close()
-
-  return
-
-#update gnuplot script ####################################################
-def update_gnuplot_script():
-  global Y_LOW_TEMP,Y_HIGH_TEMP,MIN_TEMP,MAX_TEMP,BREW_SESSION_FILENAME,CHARTING_ON
+  open(BREW_SESSION_FILENAME+".dat", "w").close()#new brew session - start an empty data file
+  CHART = None
+
+  return
+
+#update chart settings ####################################################
+#called every cycle - the chart is only redrawn when the range or title changed
+def update_chart():
 
   if not CHARTING_ON:
     return
 
-  #decide what range to use for the y axis - use the larger value
-  if Y_LOW_TEMP < MIN_TEMP: low_scale_temp = round(Y_LOW_TEMP,2)
-  else: low_scale_temp = round(MIN_TEMP,2)
-
-  if Y_HIGH_TEMP > MAX_TEMP: high_scale_temp = round(Y_HIGH_TEMP,2)
-  else: high_scale_temp = round(MAX_TEMP,2)
-
-  gnuplot_script_file = open(BREW_SESSION_FILENAME+".gp", "w")#create the brew session gnuplot script
-
-  gnuplot_script_file.write("#!/usr/bin/gnuplot\n")
-  gnuplot_script_file.write("# bcc.py created gnuplot file\n")
-  gnuplot_script_file.write("#\n\n")
-  gnuplot_script_file.write("reset\n")
-  gnuplot_script_file.write("set xdata time\n")
-  gnuplot_script_file.write("set format x \"%H:%M\"\n")
-  gnuplot_script_file.write("set xrange[*:*]\n")
-  gnuplot_script_file.write("set timefmt \"%Y-%m-%d %H:%M:%S\"\n")
-  gnuplot_script_file.write("set yrange["+str(low_scale_temp-5)+":"+str(high_scale_temp+5)+"]\n")
-  gnuplot_script_file.write("set mytics 5\n")
-  gnuplot_script_file.write("set datafile separator \",\"\n")
-  gnuplot_script_file.write("set title \""+BREW_SESSION_FILENAME+"\\n"+Y_NAME+"\"\n")
-  gnuplot_script_file.write("set xlabel \"Time\"\n")
-  gnuplot_script_file.write("set ylabel \"Temperature\"\n")
-  gnuplot_script_file.write("set grid\n")
-  gnuplot_script_file.write("plot \'"+BREW_SESSION_FILENAME+".dat\' using 1:2 title \"Avg Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:2 title \"Smoothed\" smooth bezier with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:3 title \"Min Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:4 title \"Max Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:5 title \"Des Temp\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:6 title \"Hi Alarm\" with lines\n")
-  gnuplot_script_file.write("replot \'"+BREW_SESSION_FILENAME+".dat\' using 1:7 title \"Lo Alarm\" with lines\n")
-  gnuplot_script_file.write("pause "+str(CHARTING_INTERVAL)+"\n")
-  gnuplot_script_file.write("reread\n")
-
-#  gnuplot_script_file.write("pause 1\n")
-
-  gnuplot_script_file.close()
+  #decide what range to use for the y axis - the wider of the yeast range and the min/max temps
+  low_scale_temp = round(min(Y_LOW_TEMP, MIN_TEMP), 2)
+  high_scale_temp = round(max(Y_HIGH_TEMP, MAX_TEMP), 2)
+  title = BREW_SESSION_FILENAME + " - " + Y_NAME
+
+  if CHART_BACKEND == "native" and CHART is not None:
+    CHART.set_range(low_scale_temp - 5, high_scale_temp + 5)
+    CHART.set_title(title)
+
+  elif CHART_BACKEND == "gnuplot" and GNUPLOT is not None:
+    GNUPLOT.set("yrange", "set yrange["+str(low_scale_temp-5)+":"+str(high_scale_temp+5)+"]")
+    GNUPLOT.set("title", "set title " + bccgnuplot.quote(title))
 
   return
 
 #write brew session data to file ####################################################
-def write_gnuplot_data():
+def write_chart_data():
   global LAST_BREW_SESSION_TIME,DATA_TO_PLOT,NUM_DATA_POINTS,PLOT_STARTED
 
 
@@ -1316,16 +2057,6 @@ def write_gnuplot_data():
 
   from datetime import datetime
 
-  if not PLOT_STARTED and DATA_TO_PLOT: #if the plot hasn't been started and there is data to plot
-    from threading import Thread
-    t = Thread(target=gnuplot_thread,args=())#create a thread
-    t.start()#start a thread
-    draw_screen()#redraw the screen to get rid of the gnuplot error 
-    print_output()#reprint data
-    display_alarm()
-    cooler_control(O_trending.moving_avg_temp)
-    heater_control(O_trending.moving_avg_temp)
-      
   if time.time() - PROGRAM_START_TIME < 60: #wait for avg temp to stabilize
     return
 
@@ -1338,15 +2069,21 @@ def write_gnuplot_data():
   gnuplot_script_data_file = open(BREW_SESSION_FILENAME+".dat", "a")#open the brew session gnuplot data file
 
 #log timestamp, current avg temp, min temp, and max temp to data file
-  gnuplot_script_data_file.write(str(datetime.now().strftime("%Y-%m-%d %H:%M")) + "," + 
-                                 str(round(O_trending.moving_avg_temp,4)) + "," + str(round(MIN_TEMP,4)) + "," +
-                                 str(round(MAX_TEMP,4)) + "," + str(round(DESIRED_TEMP,4))+ "," +
-                                 str(round(MAX_HIGH_TEMP,4)) + "," + str(round(MIN_LOW_TEMP,4)) +"\n")
+  data_line = (str(datetime.now().strftime("%Y-%m-%d %H:%M")) + "," +
+               str(round(O_trending.moving_avg_temp,4)) + "," + str(round(MIN_TEMP,4)) + "," +
+               str(round(MAX_TEMP,4)) + "," + str(round(DESIRED_TEMP,4))+ "," +
+               str(round(MAX_HIGH_TEMP,4)) + "," + str(round(MIN_LOW_TEMP,4)) +"\n")
+  gnuplot_script_data_file.write(data_line)
 
   gnuplot_script_data_file.close()#close the data file
 
   LAST_BREW_SESSION_TIME = time.time()#log time brew session data file was updated
 
+  if CHART_BACKEND == "native":
+    add_chart_point()
+  else:
+    add_gnuplot_point(data_line)
+
   if NUM_DATA_POINTS < 2:
     NUM_DATA_POINTS += 1
     if NUM_DATA_POINTS > 1:
@@ -1354,64 +2091,370 @@ def write_gnuplot_data():
       
   return
 
+#session history ####################################################
+#a chart of a session that is already running (bcc.py started again, chamber switched, interval
+#changed) starts from the chamber's history (bccrollup.py) - at most max_points rows of the
+#coarsest resolution needed, however long the session is. The .dat file is only read through
+#when the history doesn't go back to the start of the session.
+
+def session_start():#time of the first point in the .dat file, None for an empty session
+
+  try:
+    dat_file = open(BREW_SESSION_FILENAME+".dat")
+    try:
+      line = dat_file.readline()
+    finally:
+      dat_file.close()
+    return time.mktime(time.strptime(line.split(",")[0], bccchart.DAT_TIME_FORMAT))
+  except (IOError, OSError, ValueError):
+    return None
+
+
+def session_history(max_points=800):#[(time, {chart line: temperature})] of the session so far, None without history
+
+  start = session_start()
+  if start is None: return []
+  first = ROLLUP.first_time()
+  if first is None or first > start + 60: return None #the session started before the history
+
+  seconds, rows = ROLLUP.query(start, time.time(), max_points)
+  points = []
+  low = high = None #the min and max lines are the lowest and highest temperatures of the session so far
+  for row in rows:
+    if seconds == 0: temp, row_low, row_high, setpoints = row[1], row[1], row[1], row[5:8]
+    else: temp, row_low, row_high, setpoints = row[2], row[3], row[4], row[8:11]
+    if None in setpoints: return None #written before the setpoints were kept
+    if low is None or row_low < low: low = row_low
+    if high is None or row_high > high: high = row_high
+    temps = [temp, low, high] + list(setpoints)
+    if not USE_CELSIUS: temps = [value * 9.0 / 5.0 + 32 for value in temps]
+    points.append((row[0], dict(zip(["avg", "min", "max", "desired", "low", "high"], temps))))
+
+  return points
+
+#native chart ####################################################
+#the chart of the loaded chamber's brew session is kept in memory (bccchart.py),
+#every new point only draws its own column before the file is written again
+
+def load_chart():#chart of the session so far - built once, when the chart is first needed
+  global CHART,CHART_WRITTEN
+
+  CHART = bccchart.Chart(bucket=CHARTING_INTERVAL)
+  CHART_WRITTEN = 0 #write the file with the first point
+  points = session_history(CHART.width)
+  if points is not None:
+    for when, values in points:
+      CHART.add(when, values)
+  elif os.path.exists(BREW_SESSION_FILENAME+".dat"):
+    CHART.load_dat(BREW_SESSION_FILENAME+".dat")
+  update_chart()
+
+  return CHART
+
+
+def add_chart_point():
+
+  chart = CHART
+  if chart is None: chart = load_chart()
+  chart.add(time.time(), {"avg": O_trending.moving_avg_temp, "min": MIN_TEMP, "max": MAX_TEMP,
+                          "desired": DESIRED_TEMP, "high": MAX_HIGH_TEMP, "low": MIN_LOW_TEMP})
+
+  if time.time() - CHART_WRITTEN >= CHART_WRITE_INTERVAL: write_chart()
+
+  return
+
+
+def write_chart():#the chart file - every CHART_WRITE_INTERVAL and on exit
+  global CHART_WRITTEN
+
+  if CHART is None: return
+
+  try:
+    if CHART_FORMAT == "svg": CHART.write_svg(BREW_SESSION_FILENAME+".svg")
+    else: CHART.write_png(BREW_SESSION_FILENAME+".png")
+  except (IOError, OSError):
+    print "\033[17;0H\033[0KError writing the chart file"
+
+  CHART_WRITTEN = time.time()
+
+  return
+
+
+#gnuplot chart ####################################################
+#one gnuplot per chamber, started with the session so far and then sent one line per point
+
+def add_gnuplot_point(data_line):
+  global GNUPLOT,PLOT_STARTED
+
+  if GNUPLOT is not None and GNUPLOT.alive():
+    GNUPLOT.append(data_line)
+    GNUPLOT.plot()
+    return
+
+  if PLOT_STARTED: return #the window was closed - G opens it again
+
+  PLOT_STARTED = True
+  GNUPLOT = bccgnuplot.GnuplotPipe()
+  try:
+    points = session_history()
+    if points is None:
+      data_file = open(BREW_SESSION_FILENAME+".dat")#the session so far, read once
+      try:
+        lines = data_file.readlines()
+      finally:
+        data_file.close()
+    else:
+      lines = [dat_line(when, values) for when, values in points] + [data_line]
+    GNUPLOT.start(lines)
+  except (IOError, OSError):
+    GNUPLOT = None
+    print "\033[17;0H\033[0KError starting gnuplot"
+    return
+
+  update_chart()
+  GNUPLOT.plot()
+
+  return
+
+
+def dat_line(when, values):#a history point as a line of the .dat file
+
+  return (time.strftime(bccchart.DAT_TIME_FORMAT, time.localtime(when)) + "," +
+          ",".join([str(round(values[line], 4)) for line in bccchart.LINES]) + "\n")
+
+
+def chart_sparkline(width=40):#the session's avg temp as one line of text for the screen
+
+  if CHART_BACKEND != "native" or not CHARTING_ON or CHART is None: return ""
+
+  return CHART.sparkline(width, chars=bccchart.SPARK_ASCII)
+
 #write settings to file ########################################################
+#called after every change - the write is put off SETTINGS_DELAY seconds so a
+#burst of menu activity ends up as one write of bccsettings.json
 def write_settings():
+  global SETTINGS_PENDING
+
+  if SCHEDULER is None: #not running yet - write now
+    save_settings()
+    return
 
-  settings_file = open("bccconfig.py", "w") #overwrite existing settings file
-
-  settings_file.write("TEMP_SCALE = '" + TEMP_SCALE + "'\n")
-  settings_file.write("LAGER_TEMP = " + str(LAGER_TEMP) + "\n")
-  settings_file.write("WARM_TEMP = " + str(WARM_TEMP) + "\n")
-  settings_file.write("NORM_TEMP = " + str(NORM_TEMP) + "\n")
-  settings_file.write("CRASH_TEMP =" + str(CRASH_TEMP) + "\n")
-  settings_file.write("CLEAR_TEMP =" + str(CLEAR_TEMP) + "\n")
-  settings_file.write("DESIRED_TEMP = " + str(DESIRED_TEMP) + "\n")
-  settings_file.write("DWELL = " + str(DWELL) + "\n")
-  settings_file.write("MAX_HIGH_TEMP = " + str(MAX_HIGH_TEMP) + "\n")
-  settings_file.write("MIN_LOW_TEMP = " + str(MIN_LOW_TEMP) + "\n")
-  settings_file.write("MIN_TEMP = " + str(MIN_TEMP) + "\n")
-  settings_file.write("MAX_TEMP = " + str(MAX_TEMP) + "\n")
-  settings_file.write("BREW_CYCLE = '" + str(BREW_CYCLE) + "'\n")
-  settings_file.write("Y_PROF_ID = " + str(Y_PROF_ID) + "\n")
-  settings_file.write("Y_LAB = '" + str(Y_LAB) + "'\n")
-  settings_file.write("Y_NUM = '" + str(Y_NUM) + "'\n")
-  settings_file.write("Y_NAME = '" + str(Y_NAME) + "'\n")
-  settings_file.write("Y_STYLE = '" + str(Y_STYLE) + "'\n")
-  settings_file.write("Y_DESC = '" + str(Y_DESC) + "'\n")
-  settings_file.write("Y_LOW_TEMP = " + str(Y_LOW_TEMP) + "\n")
-  settings_file.write("Y_HIGH_TEMP = " + str(Y_HIGH_TEMP) + "\n")
-  settings_file.write("SMS_ALARM_ON = " + str(SMS_ALARM_ON) + "\n")
-  settings_file.write("ALARM_SYS_ON = " + str(ALARM_SYS_ON) + "\n")
-  settings_file.write("CELL_NUMBER = '" + str(CELL_NUMBER) + "'\n")
-  settings_file.write("BREW_NAME = '" + str(BREW_NAME) + "'\n")
-  settings_file.write("BREW_BATCH_NUM = '" + str(BREW_BATCH_NUM) + "'\n")
-  settings_file.write("BREW_BATCH_SIZE = " + str(BREW_BATCH_SIZE) + "\n")
-  settings_file.write("BREW_STYLE = '" + str(BREW_STYLE) + "'\n")
-  settings_file.write("BREW_METHOD = '" + str(BREW_METHOD) + "'\n")
-  settings_file.write("BREW_SESSION_FILENAME = '" + str(BREW_SESSION_FILENAME) + "'\n")
-  settings_file.write("CHARTING_ON = " + str(CHARTING_ON) + "\n")
-  settings_file.write("CHARTING_INTERVAL = " + str(CHARTING_INTERVAL) + "\n")
-  settings_file.write("DATA_TO_PLOT = " + str(DATA_TO_PLOT) + "\n")
-
-  settings_file.close()
+  if not SETTINGS_PENDING:
+    SETTINGS_PENDING = True
+    SCHEDULER.after(SETTINGS_DELAY, save_settings)
 
   return
 
+#save settings now if they changed###############################################
+#returns the names of the settings that changed
+def save_settings():
+  global SETTINGS_SAVED,SETTINGS_PENDING
+
+  SETTINGS_PENDING = False
+
+  settings = current_settings()
+  if settings == SETTINGS_SAVED: return [] #nothing changed - leave the file alone
+
+  changed = [name for name in sorted(settings) if SETTINGS_SAVED is None or settings[name] != SETTINGS_SAVED.get(name)]
+
+  #written beside the old file and renamed over it so a crash can't leave half a file
+  bccsettings.save(SETTINGS_FILE, settings)
+
+  SETTINGS_SAVED = settings
+
+  return changed
+
+#setting and cycle change events###############################################
+#called once a menu entry is done, before the alarms are checked
+def log_setting_changes():
+  global EVENT_SETTINGS
+
+  new = current_settings()
+  old = EVENT_SETTINGS
+  EVENT_SETTINGS = new
+  if old is None or new == old: return
+
+  for name in sorted(new):
+    if new[name] == old.get(name): continue
+    if name == "CHAMBER_SETTINGS":
+      old_chambers = old.get(name) or []
+      for number, new_chamber in enumerate(new[name]):
+        if number < len(old_chambers): old_chamber = old_chambers[number]
+        else: old_chamber = dict([(field, old.get(field)) for field in bccsettings.CHAMBER_FIELDS]) #settings from before chambers
+        for field in sorted(new_chamber):
+          if field in EVENT_QUIET or new_chamber[field] == old_chamber.get(field): continue
+          if field == "BREW_CYCLE":
+            JOURNAL.log("cycle", new_chamber["CHAMBER_NAME"], **{"from": old_chamber.get(field), "to": new_chamber[field]})
+          else:
+            JOURNAL.log("setting", new_chamber["CHAMBER_NAME"], name=field, **{"from": old_chamber.get(field), "to": new_chamber[field]})
+    elif name not in bccsettings.CHAMBER_FIELDS and name not in EVENT_QUIET: #chamber settings are logged above
+      JOURNAL.log("setting", name=name, **{"from": old.get(name), "to": new[name]})
+
+  return
+
+#settings to save################################################################
+def current_settings():
+
+  save_chamber() #CHAMBER_SETTINGS is written from the saved copies
+
+  settings = {}
+  for name in bccsettings.SCHEMA:
+    settings[name] = globals()[name]
+
+  settings["CHAMBER_PINS"] = [tuple(pins) for pins in CHAMBER_PINS]
+  settings["CHAMBER_SETTINGS"] = [chamber.saved_settings() for chamber in CHAMBERS]
+
+  return settings
+
+#open the database writer###################################################
+def open_database():
+  global DATABASE,JOURNAL
+
+  DATABASE = bccdb.DatabaseWriter("database.csv", DATABASE_FLUSH_INTERVAL, DATABASE_FLUSH_SIZE, DATABASE_FSYNC,
+                                  DATABASE_MAX_BYTES, DATABASE_BACKUPS)
+  JOURNAL = bccevents.Journal(EVENTS_FILE, DATABASE_FLUSH_INTERVAL, DATABASE_FLUSH_SIZE, DATABASE_FSYNC,
+                              DATABASE_MAX_BYTES, DATABASE_BACKUPS)
+
+  #write out what is still in memory however the program ends
+  import atexit
+  import signal
+  atexit.register(JOURNAL.close)
+  atexit.register(DATABASE.close)
+  atexit.register(close_history)
+  atexit.register(for_each_chamber, write_chart)
+  atexit.register(for_each_chamber, finish_status_log)
+  atexit.register(save_settings) #runs first - a change still waiting for SETTINGS_DELAY
+  signal.signal(signal.SIGTERM, exit_on_signal)
+  signal.signal(signal.SIGHUP, exit_on_signal)
+
+  return
+
+
+def exit_on_signal(signum, frame):
+
+  JOURNAL.log("exit", how="signal " + str(signum))
+  sys.exit(0) #runs the atexit functions
+
 #write program start info to database##########################################
 def init_database():
 
   from datetime import datetime
 
-  database_file = open("database.csv", "a") #open database to append info
+  DATABASE.write("bcc.py " + str(VERSION) + " started: " + str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "\n")
+  JOURNAL.log("start", version=VERSION, chambers=[chamber.state["CHAMBER_NAME"] for chamber in CHAMBERS])
+
+  for chamber in CHAMBERS: #one brew info line per chamber
+    switch_chamber(chamber)
+    DATABASE.write(str(BREW_NAME)+", "+str(BREW_BATCH_NUM)+", "+str(BREW_BATCH_SIZE)+", "+str(BREW_STYLE)+", "+
+                   str(BREW_METHOD)+", "+str(Y_PROF_ID)+", "+str(Y_NAME)+", "+str(CHAMBER_NAME)+"\n")
+
+  switch_chamber(DISPLAY_CHAMBER)
+
+  return
+
+
+#add the reading to the chamber's history#######################################
+def add_rollup():
+
+  if time.time() - PROGRAM_START_TIME < 60: #wait for avg temp to stabilize
+    return
+
+  temps = [O_trending.moving_avg_temp, DESIRED_TEMP, MIN_LOW_TEMP, MAX_HIGH_TEMP]
+  if not USE_CELSIUS: temps = [(temp - 32) * 5.0 / 9.0 for temp in temps] #history is kept in Celsius
+
+  ROLLUP.add(time.time(), temps[0], HEATER_ON, COOLER_ON, IS_ALARM, temps[1:])
+
+  return
+
+
+def close_history():#on exit - the open history buckets are written too
+
+  for chamber in CHAMBERS:
+    try:
+      chamber.state["ROLLUP"].close()
+    except (IOError, OSError):
+      pass
+  flush_history()
+
+  return
+
+
+def flush_history():#write the history rows and binary records waiting in memory
+
+  for chamber in CHAMBERS:
+    try:
+      chamber.state["ROLLUP"].flush()
+      chamber.state["STORE"].flush()
+      if chamber.state["ARCHIVE"] is not None: chamber.state["ARCHIVE"].flush()
+    except (IOError, OSError):
+      pass #try again next time
+
+  return
+
+#event of the loaded chamber###################################################
+def log_event(event_type, **data):
+
+  JOURNAL.log(event_type, CHAMBER_NAME, **data)
+
+  return
+
+#status row for database.csv and the chamber's binary store#####################
+def log_status():
+  #in change mode the row is only written if the temperature moved out of the tolerance or the state changed,
+  #otherwise it is held back and may be written later
+
+  from datetime import datetime
+
+  now = time.time()
+
+  line = (str(datetime.fromtimestamp(now).strftime("%y-%m-%d %H:%M:%S")) + "," + str(BREW_CYCLE) + "," + 
+          str(round(O_trending.moving_avg_temp,4)) + "," + 
+          str(round(MIN_TEMP,4)) + "," + str(round(MAX_TEMP,4)) + "," + 
+          str(round(MIN_LOW_TEMP)) + "," + str(round(MAX_HIGH_TEMP)) + "," + str(Y_PROF_ID) + "," + 
+          str(HEATER_ON) + "," + str(COOLER_ON) + "," + str(ALARM_SYS_ON) + "," + 
+          str(IS_ALARM) + "," + str(ALARM_HIGH_TEMP) + "," + str(ALARM_LOW_TEMP) + "," + 
+          str(ALARM_COOLER_MALFUNC) + "," + str(ALARM_HEATER_MALFUNC) + "," + 
+          str(SMS_ALARM_ON) + "," + str(TEMP_SCALE) + "," + str(CHAMBER_NAME) + "\n")
+
+  values = {"cycle": BREW_CYCLE, "avg": O_trending.moving_avg_temp, "min": MIN_TEMP, "max": MAX_TEMP,
+            "desired": DESIRED_TEMP, "min_low": MIN_LOW_TEMP, "max_high": MAX_HIGH_TEMP, "yeast": Y_PROF_ID,
+            "heater": HEATER_ON, "cooler": COOLER_ON, "alarm_sys": ALARM_SYS_ON, "is_alarm": IS_ALARM,
+            "high_alarm": ALARM_HIGH_TEMP, "low_alarm": ALARM_LOW_TEMP,
+            "cooler_malfunc": ALARM_COOLER_MALFUNC, "heater_malfunc": ALARM_HEATER_MALFUNC,
+            "sms": SMS_ALARM_ON, "celsius": USE_CELSIUS}
+
+  if DATABASE_MODE == "change":
+    if USE_CELSIUS: tolerance = DATABASE_TOLERANCE
+    else: tolerance = DATABASE_TOLERANCE * 9.0 / 5.0
+    #min and max follow the average, everything else is state
+    state = tuple(sorted([(name, value) for name, value in values.items() if name not in ("avg", "min", "max")]))
+    rows = DOOR.offer(now, values["avg"], state, (now, line, values), tolerance, DATABASE_INTERVAL)
+  else:
+    rows = [(now, line, values)]
+
+  for row in rows:
+    write_status(row)
+
+  return
+
+#write a status row###########################################################
+def write_status(row):
 
-  database_file.write("bcc.py " + str(VERSION) + " started: " + str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "\n")
-  database_file.write(str(BREW_NAME)+", "+str(BREW_BATCH_NUM)+", "+str(BREW_BATCH_SIZE)+", "+str(BREW_STYLE)+", "+
-                      str(BREW_METHOD)+", "+str(Y_PROF_ID)+", "+str(Y_NAME)+"\n")
+  when, line, values = row
 
-  database_file.close()
+  DATABASE.write(line)
+  STORE.append(when, values)
+  if ARCHIVE is not None: ARCHIVE.append(when, values)
 
   return
 
+#write the status row held back by change mode - on exit######################
+def finish_status_log():
+
+  row = DOOR.finish()
+  if row is not None: write_status(row)
+
+  return
 
 #write current status to database###############################################
 def write_database():
@@ -1423,45 +2466,36 @@ def write_database():
   if BREW_CYCLE == "Off  ":#No need to update database if crew cycle is off
     return
 
-  if time.time() - LAST_TIME_DATABASE < DATABASE_INTERVAL: #wait for database interval time to expire
+  if DATABASE_MODE != "change" and time.time() - LAST_TIME_DATABASE < DATABASE_INTERVAL: #wait for database interval time to expire
     return
 
   from datetime import datetime
 
-  database_file = open("database.csv", "a") #open database file to append info
-
   """
 Line format:
 column 01: date/time
-column 02: current avg_temp
-column 03: min temp
-column 04: max temp
-column 05: alarm max high
+column 02: brew cycle
+column 03: current avg_temp
+column 04: min temp
+column 05: max temp
 column 06: alarm min low
-column 07: yeast ID
-column 08: heater on
-column 09: cooler on
-column 10: alarm sys on
-column 11: is alarm
-column 12: high temp alarm
-column 13: low temp alarm
-column 14: cooling malfunction
-column 15: heating malfunction
-column 16: send sms texts
-column 17: temperature scale
+column 07: alarm max high
+column 08: yeast ID
+column 09: heater on
+column 10: cooler on
+column 11: alarm sys on
+column 12: is alarm
+column 13: high temp alarm
+column 14: low temp alarm
+column 15: cooling malfunction
+column 16: heating malfunction
+column 17: send sms texts
+column 18: temperature scale
+column 19: chamber name
 
   """
 
-  database_file.write(str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "," + str(BREW_CYCLE) + "," + 
-                      str(round(O_trending.moving_avg_temp,4)) + "," + 
-                      str(round(MIN_TEMP,4)) + "," + str(round(MAX_TEMP,4)) + "," + 
-                      str(round(MIN_LOW_TEMP)) + "," + str(round(MAX_HIGH_TEMP)) + "," + str(Y_PROF_ID) + "," + 
-                      str(HEATER_ON) + "," + str(COOLER_ON) + "," + str(ALARM_SYS_ON) + "," + 
-                      str(IS_ALARM) + "," + str(ALARM_HIGH_TEMP) + "," + str(ALARM_LOW_TEMP) + "," + 
-                      str(ALARM_COOLER_MALFUNC) + "," + str(ALARM_HEATER_MALFUNC) + "," + 
-                      str(SMS_ALARM_ON) + "," + str(TEMP_SCALE) + "\n")
-
-  database_file.close()
+  log_status()
 
   LAST_TIME_DATABASE = time.time()
 
@@ -1480,69 +2514,64 @@ def update_database():
     return
 
 
-  database_file = open("database.csv", "a") #open database file to append info
-
   """
 Line format:
 column 01: date/time
-column 02: current avg_temp
-column 03: min temp
-column 04: max temp
-column 05: alarm max high
+column 02: brew cycle
+column 03: current avg_temp
+column 04: min temp
+column 05: max temp
 column 06: alarm min low
-column 07: yeast ID
-column 08: heater on
-column 09: cooler on
-column 10: alarm sys on
-column 11: is alarm
-column 12: high temp alarm
-column 13: low temp alarm
-column 14: cooling malfunction
-column 15: heating malfunction
-column 16: send sms texts
-column 17: temperature scale
+column 07: alarm max high
+column 08: yeast ID
+column 09: heater on
+column 10: cooler on
+column 11: alarm sys on
+column 12: is alarm
+column 13: high temp alarm
+column 14: low temp alarm
+column 15: cooling malfunction
+column 16: heating malfunction
+column 17: send sms texts
+column 18: temperature scale
+column 19: chamber name
 
   """
 
-  database_file.write(str(datetime.now().strftime("%y-%m-%d %H:%M:%S")) + "," + str(BREW_CYCLE) + "," + 
-                      str(round(O_trending.moving_avg_temp,4)) + "," + 
-                      str(round(MIN_TEMP,4)) + "," + str(round(MAX_TEMP,4)) + "," + 
-                      str(round(MIN_LOW_TEMP)) + "," + str(round(MAX_HIGH_TEMP)) + "," + str(Y_PROF_ID) + "," + 
-                      str(HEATER_ON) + "," + str(COOLER_ON) + "," + str(ALARM_SYS_ON) + "," + 
-                      str(IS_ALARM) + "," + str(ALARM_HIGH_TEMP) + "," + str(ALARM_LOW_TEMP) + "," + 
-                      str(ALARM_COOLER_MALFUNC) + "," + str(ALARM_HEATER_MALFUNC) + "," + 
-                      str(SMS_ALARM_ON) + "," + str(TEMP_SCALE) + "\n")
-
-  database_file.close()
+  log_status()
 
   return
 
 
-# gnuplot_thread() #######################################################
-def gnuplot_thread():
-  global DATA_TO_PLOT,PLOT_STARTED
-
-  from os import system
+# kill_gnuplot() #########################################################
+def kill_gnuplot():
+  #close the chart of the loaded chamber only - the other chambers keep theirs
+  global GNUPLOT
 
-  while not DATA_TO_PLOT: #wait for at least 2 data points
-    time.sleep(60)
-
-  PLOT_STARTED = True
-  print_output()
-  system( '/usr/bin/gnuplot \''+BREW_SESSION_FILENAME+'.gp\'') #call gnupot and pass it the file name
+  if GNUPLOT is not None:
+    GNUPLOT.close()
+    GNUPLOT = None
 
   return
 
 ########### MAIN PROGRAM STARTS HERE #####################################
 TEMP_SCALE = "Fahrenheit"
-#read in the settings file
-try:
-  from bccconfig import *
-except ImportError:
-  CELL_NUMBER = str(input("Enter your cell phone number:"))
+#read in the settings file - nothing in it is run, bad values fall back to the defaults above
+SETTINGS, SETTINGS_PROBLEMS, SETTINGS_SOURCE = bccsettings.load(SETTINGS_FILE, dict([(name, globals()[name]) for name in bccsettings.SCHEMA]),
+                                                                 "bccconfig.py")
+globals().update(SETTINGS)
+
+for problem in SETTINGS_PROBLEMS:
+  print "Settings: " + problem
+if SETTINGS_PROBLEMS: time.sleep(3)
+
+if SETTINGS_SOURCE is None: #first start
+  CELL_NUMBER = str(raw_input("Enter your cell phone number:"))
   write_settings()
+else:
+  SETTINGS_SAVED = SETTINGS #so it is only written again once something changes
 
-if TEMP_SCALE == "Celsius": #from import bccconfig above
+if TEMP_SCALE == "Celsius": #from the settings file above
   USE_CELSIUS = True
 
 else:
@@ -1550,55 +2579,42 @@ else:
   USE_CELSIUS = False
 
 
+#build the ADC to temperature table
+init_thermistor_table()
+
+#create the chambers and setup their pins
+init_chambers()
+HW.setup(CHAMBER_PINS)
+if SIM_FAIL is not None and HW_BACKEND == "sim": #one chamber only, so the others show what normal looks like
+  HW.fail(SIM_FAIL[0], float(SIM_FAIL[1] or 0) * 60, SIM_FAIL[2] or CHAMBER_PINS[0][0])
+EVENT_SETTINGS = current_settings() #setting events are logged from here on, first start or not
+
 self_test()
 
-draw_screen()
+#from here on the screen is only updated where it changed
+SCREEN = bccscreen.Screen(sys.stdout, min_interval=SCREEN_MIN_INTERVAL)
+sys.stdout = SCREEN
 
-O_trending = Trend()
-move_average = O_trending.move_average
+draw_screen()
 
 #write program start info to database
+open_database()
 init_database()
+open_notifier()
 
-#main program loop##########################################
-
-_input = 1
-while _input > 0:
-
-    #call the calculate temperature function and assign the results to current temperature
-    current_temperature = calculate_temperature()
-
-    #call the heater function and pass the current temperature
-    heater_control(O_trending.moving_avg_temp)
-
-    #call the cooler function and pass the current temperature
-    cooler_control(O_trending.moving_avg_temp)
-
-    #move the trend average
-    move_average()
+SCREEN_OUTPUT = sys.stdout
+QUIET_OUTPUT = open(os.devnull, "w") #chambers not on the screen print here
 
-    #set the min and max temperatures
-    min_max()
-
-    #check alarms
-    check_alarms()
-
-    #update the screen
-    print_output()
-
-    #write to database file
-    write_database()
-
-    #write the brew session data to the data file
-    write_gnuplot_data()
-
-    #update brew session gnuplot script
-    update_gnuplot_script()
+#main program loop##########################################
 
-    #15 second delay/indicate the program is running/check for user input
-    delay_loop()
+#read/control/log every LOOP_INTERVAL seconds and handle user input as it is typed
+SCHEDULER = Scheduler(SCREEN)
+SCHEDULER.every(LOOP_INTERVAL, control_cycle)
+SCHEDULER.every(DATABASE_FLUSH_INTERVAL, flush_history) #history rows are written in batches too
+SCHEDULER.run()
 
 exit(0) #should never get here but just in case exit
 
 
 
+
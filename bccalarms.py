@@ -0,0 +1,207 @@
+"""
+    bccalarms.py - alarm rules for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Alarms are declared as rules (ALARM_RULES in bccsettings.json), one dict each:
+
+  {"name": "high", "kind": "above", "series": "avg", "limit": "max_high",
+   "sustain": 300, "hysteresis": 0.25, "message": "High Temp"}
+
+  kind     above  - series goes over limit
+           below  - series goes under limit
+           rate   - the slope of the trend (degrees an hour) is steeper than
+                    limit, up or down
+           stale  - the reading hasn't changed for limit seconds (a sensor
+                    that is stuck or came off)
+  series   live value the rule looks at: avg (moving average), reading (last
+           reading) or ewma - above/below only
+  limit    a number, or the name of a live value: max_high, min_low, desired
+  sustain  seconds the condition has to hold before the alarm is raised -
+           one noisy reading can't raise it
+  hysteresis  degrees past the limit (back inside) before the alarm clears
+  message  text of the alarm message
+
+Numbers in degrees (limit, hysteresis, rate) are Celsius and are converted
+for chambers shown in Fahrenheit. Named limits are the chamber's own.
+
+AlarmEngine.evaluate() is called with the live values of every new reading
+and only looks at those and the state each rule keeps (since when its
+condition holds, when the reading last changed) - nothing is read back from
+the history. It returns the alarms raised and cleared by that reading.
+"""
+
+KINDS = ["above", "below", "rate", "stale"]
+SERIES = ["avg", "reading", "ewma"]
+LIMITS = ["max_high", "min_low", "desired"]
+
+try:
+  basestring_type = basestring #python 2
+except NameError:
+  basestring_type = str
+
+class Rule:
+
+  def __init__(self, spec):
+
+    spec = check_rule(spec)
+    self.name = spec["name"]
+    self.kind = spec["kind"]
+    self.series = spec.get("series", "avg")
+    self.limit = spec["limit"]
+    self.sustain = spec.get("sustain", 0)
+    self.hysteresis = spec.get("hysteresis", 0.0)
+    self.message = spec.get("message", self.name)
+
+    self.active = False
+    self.since = None #time the condition started to hold, None while it doesn't
+    self.value = None #value that raised or cleared the alarm last
+    self.last_reading = None #stale: reading and the time it last changed
+    self.changed = None
+
+    return
+
+
+  def limit_value(self, live, scale):
+
+    if isinstance(self.limit, str): return live[self.limit]
+
+    if self.kind == "stale": return self.limit
+
+    return self.limit * scale
+
+
+  def condition(self, now, live, scale):#(condition holds, still inside the hysteresis band, value)
+
+    limit = self.limit_value(live, scale)
+    band = self.hysteresis * scale
+
+    if self.kind == "above":
+      value = live[self.series]
+      return value > limit, value > limit - band, value
+
+    if self.kind == "below":
+      value = live[self.series]
+      return value < limit, value < limit + band, value
+
+    if self.kind == "rate":
+      value = abs(live["slope"])
+      return value > limit, value > limit - band, value
+
+    #stale
+    if live["reading"] != self.last_reading:
+      self.last_reading = live["reading"]
+      self.changed = now
+    value = now - self.changed
+    return value >= limit, value >= limit, value
+
+
+  def evaluate(self, now, live, scale):#returns True if raised, False if cleared, None if nothing changed
+
+    holds, inside, value = self.condition(now, live, scale)
+
+    if self.active:
+      if inside: return None
+      self.active = False
+      self.since = None
+      self.value = value
+      return False
+
+    if not holds:
+      self.since = None
+      return None
+
+    if self.since is None: self.since = now
+    if now - self.since < self.sustain: return None
+
+    self.active = True
+    self.value = value
+    return True
+
+
+  def reset(self):#returns True if the alarm was on
+
+    was_active = self.active
+    self.active = False
+    self.since = None
+
+    return was_active
+
+
+class AlarmEngine:
+
+  def __init__(self, specs):
+
+    self.rules = [Rule(spec) for spec in specs]
+    self.names = dict([(rule.name, rule) for rule in self.rules])
+
+    return
+
+
+  def evaluate(self, now, live, scale=1.0):
+    #live: avg, reading, ewma, slope, max_high, min_low, desired - scale: 1.0 for Celsius, 1.8 for Fahrenheit
+    #returns [(rule, True if raised/False if cleared)]
+
+    changes = []
+    for rule in self.rules:
+      change = rule.evaluate(now, live, scale)
+      if change is not None: changes.append((rule, change))
+
+    return changes
+
+
+  def reset(self):#clear every alarm (brew cycle off) - returns the rules that were on
+
+    return [rule for rule in self.rules if rule.reset()]
+
+
+  def active(self, name=None):#is the named alarm on - any alarm if no name
+
+    if name is None: return [rule for rule in self.rules if rule.active]
+
+    return name in self.names and self.names[name].active
+
+
+def check_rule(spec):#the rule with its values checked - raises ValueError
+
+  if not isinstance(spec, dict): raise ValueError("not a rule: " + repr(spec))
+
+  rule = {}
+  for name, value in spec.items():
+    rule[str(name)] = value
+
+  for name in ("name", "kind", "limit"):
+    if name not in rule: raise ValueError("rule without " + name + ": " + repr(spec))
+
+  for name in ("name", "message"):
+    if name in rule:
+      if not isinstance(rule[name], basestring_type): raise ValueError(name + " is not text: " + repr(spec))
+      if not isinstance(rule[name], str): rule[name] = rule[name].encode("utf-8") #python 2 unicode from json
+
+  if rule["kind"] not in KINDS: raise ValueError("kind must be one of " + ", ".join(KINDS) + ": " + repr(spec))
+  if rule.get("series", "avg") not in SERIES: raise ValueError("series must be one of " + ", ".join(SERIES) + ": " + repr(spec))
+
+  limit = rule["limit"]
+  if isinstance(limit, basestring_type):
+    if str(limit) not in LIMITS: raise ValueError("limit must be a number or one of " + ", ".join(LIMITS) + ": " + repr(spec))
+    rule["limit"] = str(limit)
+  elif isinstance(limit, bool) or not isinstance(limit, (int, float)):
+    raise ValueError("limit must be a number or one of " + ", ".join(LIMITS) + ": " + repr(spec))
+
+  for name in ("sustain", "hysteresis"):
+    if name in rule and (isinstance(rule[name], bool) or not isinstance(rule[name], (int, float)) or rule[name] < 0):
+      raise ValueError(name + " must be a number of 0 or more: " + repr(spec))
+
+  return rule
+
@@ -0,0 +1,399 @@
+"""
+    bccchart.py - brew session charts for bcc.py without gnuplot
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Chart keeps the brew session in memory and draws it as a PNG or SVG file or
+as a one line sparkline for the terminal - no gnuplot, X server or other
+program is needed.
+
+Every pixel column of the chart stands for bucket seconds of the session and
+keeps the min, max and last value of every line in it. A new point only
+updates (and redraws) its own column, so adding a point costs the same on
+the first day and the last day of a session. When the session outgrows the
+chart, neighbouring columns are merged and bucket doubles.
+
+PNG files are written with zlib and struct only (8 bit palette image).
+
+The columns of a session are the columns of the brew session .dat file:
+time, avg temp, min temp, max temp, desired temp, high alarm, low alarm.
+"""
+
+import math
+import struct
+import time
+import zlib
+
+from array import array
+
+import bccdb
+
+#lines of a chart - the columns of the .dat file after the time
+LINES = ["avg", "min", "max", "desired", "high", "low"]
+TITLES = {"avg": "Avg Temp", "min": "Min Temp", "max": "Max Temp", "desired": "Des Temp",
+          "high": "Hi Alarm", "low": "Lo Alarm"}
+
+DAT_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+#palette index: (red, green, blue)
+PALETTE = [(255, 255, 255), (220, 220, 220), (0, 0, 0), (200, 0, 0), (0, 0, 200), (0, 150, 0),
+           (180, 0, 180), (230, 120, 0), (0, 160, 160)]
+BACKGROUND = 0
+GRID = 1
+BORDER = 2
+COLOURS = {"avg": 3, "min": 4, "max": 5, "desired": 6, "high": 7, "low": 8}
+
+SPARK_BLOCKS = u"\u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588" #unicode block characters
+SPARK_ASCII = "_.-~^" #for screens that count bytes as columns
+
+#x axis tick spacings in seconds, the first one giving at least 40 pixels is used
+TICKS = [15 * 60, 30 * 60, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 86400, 2 * 86400, 7 * 86400]
+
+class Chart:
+
+  def __init__(self, width=800, height=400, bucket=15, title="", low=30.0, high=80.0):
+
+    self.width = width #pixels
+    self.height = height
+    self.bucket = float(bucket) #seconds of the session per pixel column
+    self.title = title
+    self.low = low #y axis range
+    self.high = high
+
+    self.start = None #time of the first point - left edge of the chart
+    self.points = 0
+
+    #per line and column: min, max and last value (nan where there is no point yet)
+    self.mins = dict([(line, array("d", [float("nan")] * width)) for line in LINES])
+    self.maxs = dict([(line, array("d", [float("nan")] * width)) for line in LINES])
+    self.lasts = dict([(line, array("d", [float("nan")] * width)) for line in LINES])
+    self.used = 0 #columns that have points
+
+    self.canvas = None #PNG pixels, None means draw everything again
+    self.dirty_from = 0 #first column changed since the canvas was drawn
+
+    return
+
+#adding points###########################################################
+  def add(self, when, values):#values: {line: temperature} - missing lines are skipped
+
+    if self.start is None:
+      self.start = when
+      self.canvas = None #the time grid starts here
+
+    column = int((when - self.start) / self.bucket)
+    if column < 0: column = 0 #clock went back - put it on the left edge
+
+    while column >= self.width: #session outgrew the chart - halve the resolution
+      self.merge()
+      column = int((when - self.start) / self.bucket)
+
+    for line in LINES:
+      value = values.get(line)
+      if value is None: continue
+      value = float(value)
+      if math.isnan(self.mins[line][column]):
+        self.mins[line][column] = value
+        self.maxs[line][column] = value
+      else:
+        self.mins[line][column] = min(self.mins[line][column], value)
+        self.maxs[line][column] = max(self.maxs[line][column], value)
+      self.lasts[line][column] = value
+
+    self.used = max(self.used, column + 1)
+    self.dirty_from = min(self.dirty_from, column)
+    self.points += 1
+
+    return
+
+
+  def merge(self):#join every two columns into one
+
+    half = self.width // 2
+
+    for line in LINES:
+      mins = self.mins[line]
+      maxs = self.maxs[line]
+      lasts = self.lasts[line]
+      for x in range(self.width):
+        if x < half:
+          a = 2 * x
+          b = 2 * x + 1
+          mins[x] = nan_min(mins[a], mins[b])
+          maxs[x] = nan_max(maxs[a], maxs[b])
+          if math.isnan(lasts[b]): lasts[x] = lasts[a]
+          else: lasts[x] = lasts[b]
+        else:
+          mins[x] = maxs[x] = lasts[x] = float("nan")
+
+    self.bucket *= 2
+    self.used = (self.used + 1) // 2
+    self.canvas = None
+
+    return
+
+
+  def set_range(self, low, high):#y axis - only redraws when it actually changed
+
+    if high <= low: high = low + 1.0
+    if (low, high) == (self.low, self.high): return
+
+    self.low = low
+    self.high = high
+    self.canvas = None
+
+    return
+
+
+  def set_title(self, title):
+
+    self.title = title
+
+    return
+
+
+  def load_dat(self, filename):#read a brew session .dat file - used when bcc.py starts again
+
+    dat_file = open(filename)
+    try:
+      for line in dat_file:
+        fields = line.strip().split(",")
+        if len(fields) < 1 + len(LINES): continue
+        try:
+          when = time.mktime(time.strptime(fields[0], DAT_TIME_FORMAT))
+          values = dict(zip(LINES, [float(field) for field in fields[1:1 + len(LINES)]]))
+        except ValueError:
+          continue
+        self.add(when, values)
+    finally:
+      dat_file.close()
+
+    return
+
+#PNG#####################################################################
+  def y_pixel(self, value):
+
+    y = int(round((self.high - value) / (self.high - self.low) * (self.height - 1)))
+
+    return min(max(y, 0), self.height - 1)
+
+
+  def grid_rows(self):#pixel rows of the horizontal grid lines - every 5 degrees
+
+    step = 5.0
+    while (self.high - self.low) / step > 20: step *= 2
+
+    rows = []
+    value = math.ceil(self.low / step) * step
+    while value <= self.high:
+      rows.append((value, self.y_pixel(value)))
+      value += step
+
+    return rows
+
+
+  def tick_spacing(self):
+
+    for tick in TICKS:
+      if tick / self.bucket >= 40: return tick
+
+    return TICKS[-1]
+
+
+  def grid_columns(self):#(time, pixel column) of the vertical grid lines
+
+    if self.start is None: return []
+
+    tick = self.tick_spacing()
+    offset = -time.timezone #ticks on local hours
+    first = math.ceil((self.start + offset) / tick) * tick - offset
+
+    columns = []
+    when = first
+    while when < self.start + self.width * self.bucket:
+      columns.append((when, int((when - self.start) / self.bucket)))
+      when += tick
+
+    return columns
+
+
+  def draw(self):#bring the canvas up to date - only the columns that changed
+
+    if self.canvas is None:
+      #background, grid and border once (the grid covers the whole width), then every column
+      self.background = bytearray([BACKGROUND]) * (self.width * self.height)
+      for value, y in self.grid_rows():
+        self.background[y * self.width:(y + 1) * self.width] = bytearray([GRID]) * self.width
+      self.grid_x = set()
+      for when, x in self.grid_columns():
+        self.grid_x.add(x)
+        for y in range(self.height):
+          self.background[y * self.width + x] = GRID
+      self.background[0:self.width] = bytearray([BORDER]) * self.width
+      self.background[(self.height - 1) * self.width:] = bytearray([BORDER]) * self.width
+      for y in range(self.height):
+        self.background[y * self.width] = BORDER
+        self.background[y * self.width + self.width - 1] = BORDER
+      self.canvas = bytearray(self.background)
+      self.dirty_from = 0
+
+    for x in range(self.dirty_from, self.used):
+      self.draw_column(x)
+
+    self.dirty_from = self.used
+
+    return
+
+
+  def draw_column(self, x):
+
+    width = self.width
+    canvas = self.canvas
+    background = self.background
+
+    for y in range(self.height): #clear the column
+      canvas[y * width + x] = background[y * width + x]
+
+    for line in LINES:
+      low = self.mins[line][x]
+      if math.isnan(low): continue
+      high = self.maxs[line][x]
+      if x > 0 and not math.isnan(self.lasts[line][x - 1]): #join up with the column before
+        low = min(low, self.lasts[line][x - 1])
+        high = max(high, self.lasts[line][x - 1])
+      colour = COLOURS[line]
+      for y in range(self.y_pixel(high), self.y_pixel(low) + 1):
+        canvas[y * width + x] = colour
+
+    return
+
+
+  def png(self):#the chart as PNG file contents
+
+    self.draw()
+
+    raw = bytearray()
+    for y in range(self.height):
+      raw.append(0) #filter type none
+      raw.extend(self.canvas[y * self.width:(y + 1) * self.width])
+
+    palette = bytearray()
+    for red, green, blue in PALETTE:
+      palette.extend([red, green, blue])
+
+    header = struct.pack(">IIBBBBB", self.width, self.height, 8, 3, 0, 0, 0) #8 bit palette
+
+    return (b"\x89PNG\r\n\x1a\n" + png_chunk(b"IHDR", header) + png_chunk(b"PLTE", bytes(palette)) +
+            png_chunk(b"IDAT", zlib.compress(bytes(raw), 6)) + png_chunk(b"IEND", b""))
+
+
+  def write_png(self, filename):
+
+    bccdb.atomic_write(filename, self.png(), fsync=False, binary=True)
+
+    return
+
+#SVG#####################################################################
+  def svg(self):#the chart as SVG file contents - one point per column, with labels
+
+    left = 50 #room for the labels
+    top = 30
+    bottom = 40
+    right = 110
+    total_width = left + self.width + right
+    total_height = top + self.height + bottom
+
+    out = []
+    out.append('<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" font-family="sans-serif" font-size="11">'
+               % (total_width, total_height))
+    out.append('<rect width="100%" height="100%" fill="white"/>')
+    out.append('<text x="%d" y="18" text-anchor="middle" font-size="14">%s</text>'
+               % (left + self.width // 2, escape(self.title)))
+
+    for value, y in self.grid_rows():
+      out.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="#dcdcdc"/>' % (left, top + y, left + self.width, top + y))
+      out.append('<text x="%d" y="%d" text-anchor="end">%g</text>' % (left - 4, top + y + 4, value))
+
+    for when, x in self.grid_columns():
+      out.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="#dcdcdc"/>' % (left + x, top, left + x, top + self.height))
+      out.append('<text x="%d" y="%d" text-anchor="middle">%s</text>'
+                 % (left + x, top + self.height + 14, time.strftime("%H:%M", time.localtime(when))))
+
+    out.append('<rect x="%d" y="%d" width="%d" height="%d" fill="none" stroke="black"/>'
+               % (left, top, self.width, self.height))
+
+    for number, line in enumerate(LINES):
+      points = []
+      for x in range(self.used):
+        value = self.lasts[line][x]
+        if not math.isnan(value): points.append("%d,%d" % (left + x, top + self.y_pixel(value)))
+      colour = "#%02x%02x%02x" % PALETTE[COLOURS[line]]
+      if points:
+        out.append('<polyline fill="none" stroke="%s" points="%s"/>' % (colour, " ".join(points)))
+      legend_y = top + 10 + number * 16
+      out.append('<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="%s" stroke-width="2"/>'
+                 % (left + self.width + 10, legend_y, left + self.width + 30, legend_y, colour))
+      out.append('<text x="%d" y="%d">%s</text>' % (left + self.width + 35, legend_y + 4, TITLES[line]))
+
+    out.append('<text x="%d" y="%d" text-anchor="middle">Time</text>' % (left + self.width // 2, total_height - 6))
+    out.append('</svg>\n')
+
+    return "\n".join(out)
+
+
+  def write_svg(self, filename):
+
+    bccdb.atomic_write(filename, self.svg(), fsync=False)
+
+    return
+
+#terminal################################################################
+  def sparkline(self, width=40, line="avg", chars=SPARK_BLOCKS):#last width columns of a line as characters
+
+    values = [value for value in self.lasts[line][:self.used] if not math.isnan(value)][-width:]
+    if not values: return ""
+
+    low = min(values)
+    high = max(values)
+    levels = len(chars) - 1
+
+    if high - low < 1e-9: return chars[levels // 2] * len(values)
+
+    return "".join([chars[int(round((value - low) / (high - low) * levels))] for value in values])
+
+
+def png_chunk(kind, data):
+
+  return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def nan_min(a, b):
+
+  if math.isnan(a): return b
+  if math.isnan(b): return a
+
+  return min(a, b)
+
+
+def nan_max(a, b):
+
+  if math.isnan(a): return b
+  if math.isnan(b): return a
+
+  return max(a, b)
+
+
+def escape(text):
+
+  return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
@@ -0,0 +1,546 @@
+"""
+    bcccodec.py - compressed status log for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Encoder writes the status rows of one chamber (the same values as a
+bccstore record) as a bit stream, most rows take 3 or 4 bytes instead of the
+150 or so of a database.csv line:
+
+  time          - milliseconds, delta of delta: a row logged on the same
+                  interval as the one before takes 1 bit
+  temperatures  - avg, min, max, desired, min low, max high in 1/10000 of a
+                  degree (what database.csv keeps), delta to the row before:
+                  1 bit if unchanged, 10 to 36 bits if not
+  yeast ID, brew cycle, flags - 1 bit if unchanged, the flags are the
+                  bccstore FLAGS packed in 10 bits
+
+The file is a header followed by blocks of at most BLOCK_RECORDS rows:
+
+  block header  - time of the first row (ms), rows, bytes
+  bits          - first row in full, the rest as changes
+
+Every block starts over from a full row, so a block can be decoded without
+the ones before it and decode(start) skips the blocks before start. flush()
+writes the open block again with the rows added since the last flush - the
+bits go first and the header after, so a power cut in between leaves the
+header of the last flush pointing at bits that didn't change.
+
+bcc.py only writes the .bcz file as it goes with ARCHIVE_ON set - otherwise
+compress turns a chamber's .bcs store into one when months of history are
+to be kept in little space.
+
+  python bcccodec.py bench [database.csv] - size and speed against database.csv and bccstore
+  python bcccodec.py compress <store file> - chamber-N.bcs to chamber-N.bcz
+  python bcccodec.py export <bcz file> <hours> - database.csv rows
+"""
+
+import os
+import struct
+import sys
+import time
+
+import bccstore
+
+MAGIC = b"BCCZ"
+VERSION = 1
+HEADER = struct.Struct("<4sH10x") #magic, version
+BLOCK = struct.Struct("<qHI") #first time in ms, rows, bytes
+BLOCK_RECORDS = 1024
+
+TEMPS = ["avg", "min", "max", "desired", "min_low", "max_high"]
+SCALE = 10000 #temperatures are kept in 1/SCALE degree
+
+TIME_WIDTHS = [7, 10, 14, 48] #bits of a delta of delta after its prefix 10, 110, 1110, 1111
+TEMP_WIDTHS = [8, 14, 20, 32] #bits of a temperature change after its prefix
+
+#bits#######################################################################
+class BitWriter:
+
+  def __init__(self):
+
+    self.data = bytearray()
+    self.bits = 0 #bits in acc not in data yet
+    self.acc = 0
+
+    return
+
+
+  def write(self, value, width):
+
+    self.acc = (self.acc << width) | value
+    self.bits += width
+    while self.bits >= 8:
+      self.bits -= 8
+      self.data.append((self.acc >> self.bits) & 0xff)
+    self.acc &= (1 << self.bits) - 1
+
+    return
+
+
+  def getvalue(self):#the bytes so far, the last one padded with 0s
+
+    if self.bits: return bytes(self.data) + struct.pack("B", self.acc << (8 - self.bits))
+
+    return bytes(self.data)
+
+
+class BitReader:
+
+  def __init__(self, data):
+
+    self.data = bytearray(data)
+    self.position = 0
+    self.bits = 0
+    self.acc = 0
+
+    return
+
+
+  def read(self, width):
+
+    while self.bits < width:
+      self.acc = (self.acc << 8) | self.data[self.position]
+      self.position += 1
+      self.bits += 8
+    self.bits -= width
+    value = self.acc >> self.bits
+    self.acc &= (1 << self.bits) - 1
+
+    return value
+
+
+def write_change(writer, value, widths):#0 is 1 bit, the rest a prefix of 1s and a signed value
+
+  if value == 0:
+    writer.write(0, 1)
+    return
+
+  last = len(widths) - 1
+  for index, width in enumerate(widths):
+    limit = 1 << (width - 1)
+    if -limit <= value < limit or index == last: break
+
+  value = max(-limit, min(limit - 1, value))
+  if index < last: writer.write(((1 << (index + 1)) - 1) << 1, index + 2)
+  else: writer.write((1 << len(widths)) - 1, len(widths))
+  writer.write(value & ((1 << width) - 1), width)
+
+  return
+
+
+def read_change(reader, widths):
+
+  if not reader.read(1): return 0
+
+  index = 0
+  while index < len(widths) - 1 and reader.read(1):
+    index += 1
+
+  width = widths[index]
+  value = reader.read(width)
+  if value >= 1 << (width - 1): value -= 1 << width
+
+  return value
+
+#rows#######################################################################
+def quantize(values):#the row as whole numbers: time ms, temperatures, yeast, cycle, flags
+
+  flags = 0
+  for bit, name in enumerate(bccstore.FLAGS):
+    if values.get(name): flags |= 1 << bit
+
+  cycle = values.get("cycle", "Off  ")
+  if cycle in bccstore.CYCLES: cycle = bccstore.CYCLES.index(cycle)
+  else: cycle = 0
+
+  return ([int(round(values.get(name, 0.0) * SCALE)) for name in TEMPS] +
+          [int(values.get("yeast", 0)) & 0xffff, cycle, flags])
+
+
+def record(when, row):#a row as a bccstore record dict
+
+  result = {"time": when / 1000.0, "yeast": row[6], "cycle": bccstore.CYCLES[row[7]] if row[7] < len(bccstore.CYCLES) else "Off  "}
+  for index, name in enumerate(TEMPS):
+    result[name] = row[index] / float(SCALE)
+  for bit, name in enumerate(bccstore.FLAGS):
+    result[name] = bool(row[8] & (1 << bit))
+
+  return result
+
+
+class Encoder:
+
+  def __init__(self, filename):
+
+    self.filename = filename
+    self.block_offset = None #where the open block starts in the file
+    self.writer = None #bits of the open block
+    self.count = 0 #rows in the open block
+    self.written = 0 #rows of the open block on file
+    self.first_time = 0
+    self.last_time = None
+    self.last_delta = 0
+    self.last_row = None
+
+    if not os.path.exists(filename) or os.path.getsize(filename) < HEADER.size:
+      codec_file = open(filename, "wb")
+      try:
+        codec_file.write(HEADER.pack(MAGIC, VERSION))
+      finally:
+        codec_file.close()
+
+    check_header(filename)
+
+    end, self.last_time = scan(filename) #new rows go in a new block after the last whole one
+    self.block_offset = end
+
+    return
+
+
+  def append(self, when, values):
+
+    when = int(round(when * 1000))
+    if self.last_time is not None and when < self.last_time: when = self.last_time #times never go back
+    row = quantize(values)
+
+    if self.count == BLOCK_RECORDS: self.new_block()
+
+    if self.writer is None: #first row of a block in full
+      self.writer = BitWriter()
+      self.writer.write(when & 0xffffffffffffffff, 64)
+      for value in row[:6]:
+        self.writer.write(value & 0xffffffff, 32)
+      self.writer.write(row[6], 16)
+      self.writer.write(row[7], 3)
+      self.writer.write(row[8], 10)
+      self.first_time = when
+      self.last_delta = 0
+    else:
+      delta = when - self.last_time
+      write_change(self.writer, delta - self.last_delta, TIME_WIDTHS)
+      self.last_delta = delta
+      for value, last in zip(row[:6], self.last_row[:6]):
+        write_change(self.writer, value - last, TEMP_WIDTHS)
+      for value, last, width in zip(row[6:], self.last_row[6:], [16, 3, 10]):
+        if value == last:
+          self.writer.write(0, 1)
+        else:
+          self.writer.write(1, 1)
+          self.writer.write(value, width)
+
+    self.count += 1
+    self.last_time = when
+    self.last_row = row
+
+    return
+
+
+  def new_block(self):
+
+    self.flush()
+    self.block_offset += BLOCK.size + len(self.writer.getvalue())
+    self.writer = None
+    self.count = 0
+    self.written = 0
+
+    return
+
+
+  def flush(self):
+
+    if self.count == self.written: return
+
+    data = self.writer.getvalue()
+    codec_file = open(self.filename, "r+b")
+    try:
+      codec_file.seek(self.block_offset + BLOCK.size)
+      codec_file.write(data)
+      codec_file.truncate()
+      codec_file.flush()
+      codec_file.seek(self.block_offset)
+      codec_file.write(BLOCK.pack(self.first_time, self.count, len(data)))
+    finally:
+      codec_file.close()
+
+    self.written = self.count
+
+    return
+
+
+def check_header(filename):
+
+  codec_file = open(filename, "rb")
+  try:
+    magic, version = HEADER.unpack(codec_file.read(HEADER.size))
+  finally:
+    codec_file.close()
+
+  if magic != MAGIC or version != VERSION:
+    raise ValueError(filename + " is not a version " + str(VERSION) + " compressed log")
+
+  return
+
+
+def blocks(codec_file, start_ms=None):#(first time, rows, bits) of every whole block - skips blocks before start_ms
+
+  codec_file.seek(HEADER.size)
+  size = os.fstat(codec_file.fileno()).st_size
+  offset = HEADER.size
+  last = None #block that may hold start_ms, kept until the next one shows it does
+
+  while offset + BLOCK.size <= size:
+    codec_file.seek(offset)
+    first_time, count, length = BLOCK.unpack(codec_file.read(BLOCK.size))
+    if count == 0 or offset + BLOCK.size + length > size: break #cut short
+    if start_ms is not None and first_time <= start_ms:
+      last = (offset, first_time, count, length)
+    else:
+      if last is not None:
+        yield read_block(codec_file, last)
+        last = None
+      yield read_block(codec_file, (offset, first_time, count, length))
+    offset += BLOCK.size + length
+
+  if last is not None: yield read_block(codec_file, last)
+
+  return
+
+
+def read_block(codec_file, block):
+
+  offset, first_time, count, length = block
+  codec_file.seek(offset + BLOCK.size)
+
+  return first_time, count, codec_file.read(length)
+
+
+def scan(filename):#(end of the last whole block, its last time in ms)
+
+  codec_file = open(filename, "rb")
+  try:
+    end = HEADER.size
+    last_time = None
+    last = None
+    size = os.path.getsize(filename)
+    while end + BLOCK.size <= size:
+      codec_file.seek(end)
+      first_time, count, length = BLOCK.unpack(codec_file.read(BLOCK.size))
+      if count == 0 or end + BLOCK.size + length > size: break
+      last = (end, first_time, count, length)
+      end += BLOCK.size + length
+    if last is not None:
+      for last_time, row in decode_block(*read_block(codec_file, last)):
+        pass
+  finally:
+    codec_file.close()
+
+  return end, last_time
+
+
+def decode_block(first_time, count, data):#(time ms, row) of every row in a block
+
+  reader = BitReader(data)
+  read = reader.read
+
+  when = read(64)
+  if when >= 1 << 63: when -= 1 << 64
+  row = []
+  for x in range(6):
+    value = read(32)
+    if value >= 1 << 31: value -= 1 << 32
+    row.append(value)
+  row += [read(16), read(3), read(10)]
+  yield when, row
+
+  delta = 0
+  for x in range(count - 1):
+    delta += read_change(reader, TIME_WIDTHS)
+    when += delta
+    row = [temp + read_change(reader, TEMP_WIDTHS) for temp in row[:6]] + [
+           read(width) if read(1) else value for value, width in zip(row[6:], [16, 3, 10])]
+    yield when, row
+
+
+def decode(filename, start=None, end=None):#bccstore record dicts in time order
+
+  check_header(filename)
+
+  if start is not None: start_ms = int(start * 1000)
+  else: start_ms = None
+  if end is not None: end_ms = int(end * 1000)
+  else: end_ms = None
+
+  codec_file = open(filename, "rb")
+  try:
+    for block in blocks(codec_file, start_ms):
+      if end_ms is not None and block[0] > end_ms: break
+      for when, row in decode_block(*block):
+        if start_ms is not None and when < start_ms: continue
+        if end_ms is not None and when > end_ms: return
+        yield record(when, row)
+  finally:
+    codec_file.close()
+
+#benchmark##################################################################
+def sample_rows(days=30, interval=15):#a lager: slow heater/cooler swings around 50F
+
+  import math
+  import random
+
+  random.seed(1)
+  when = time.mktime((2014, 11, 1, 0, 0, 0, 0, 0, -1))
+  temp = 50.0
+  heater = cooler = False
+  low = high = temp
+  rows = []
+  for x in range(int(days * 86400 / interval)):
+    temp += random.gauss(0, 0.01) + 0.002 * math.sin(x / 200.0)
+    if temp < 49.5: heater = True
+    if temp > 50.0: heater = False
+    if temp > 50.5: cooler = True
+    if temp < 50.0: cooler = False
+    low = min(low, temp)
+    high = max(high, temp)
+    rows.append((when + x * interval, {"cycle": "Lager", "avg": round(temp, 4), "min": round(low, 4), "max": round(high, 4),
+                                       "desired": 50.0, "min_low": 44.0, "max_high": 56.0, "yeast": 30,
+                                       "heater": heater, "cooler": cooler, "alarm_sys": True, "sms": True}))
+
+  return rows
+
+
+def bench(csv_filename=None):
+
+  import tempfile
+
+  if csv_filename is None:
+    rows = sample_rows()
+    name = "Chamber 1"
+    source = "30 days of 15 second samples"
+  else:
+    rows = []
+    csv_file = open(csv_filename)
+    try:
+      for line in csv_file:
+        row = bccstore.parse_database_row(line.rstrip("\r\n").split(","))
+        if row is None: continue
+        if not rows: name = row[2]
+        if row[2] == name: rows.append(row[:2])
+    finally:
+      csv_file.close()
+    if not rows:
+      print("no status rows in " + csv_filename)
+      return
+    source = csv_filename + " (" + name + ")"
+
+  directory = tempfile.mkdtemp()
+  try:
+    csv_path = os.path.join(directory, "database.csv")
+    store_path = os.path.join(directory, "chamber.bcs")
+    codec_path = os.path.join(directory, "chamber.bcz")
+
+    lines = []
+    for when, values in rows:
+      full = dict([(flag, False) for flag in bccstore.FLAGS])
+      full.update(values)
+      full["time"] = when
+      lines.append(bccstore.database_row(full, name))
+
+    started = time.time()
+    csv_file = open(csv_path, "w")
+    try:
+      csv_file.write("".join(lines))
+    finally:
+      csv_file.close()
+    csv_write = time.time() - started
+
+    started = time.time()
+    store = bccstore.Store(store_path)
+    for when, values in rows:
+      store.append(when, values)
+    store.flush()
+    store_write = time.time() - started
+
+    started = time.time()
+    encoder = Encoder(codec_path)
+    for when, values in rows:
+      encoder.append(when, values)
+    encoder.flush()
+    codec_write = time.time() - started
+
+    started = time.time()
+    csv_file = open(csv_path)
+    try:
+      parsed = [bccstore.parse_database_row(line.rstrip("\r\n").split(",")) for line in csv_file]
+    finally:
+      csv_file.close()
+    csv_read = time.time() - started
+
+    started = time.time()
+    stored = list(store.records())
+    store_read = time.time() - started
+    store.close()
+
+    started = time.time()
+    decoded = list(decode(codec_path))
+    codec_read = time.time() - started
+
+    same = [bccstore.database_row(one, name) for one in decoded] == lines
+    counts = (len(parsed), len(stored), len(decoded)) #every reader must give back every row
+
+    csv_size = os.path.getsize(csv_path)
+    print(source + ": " + str(len(rows)) + " rows")
+    print("%-13s %10s %8s %12s %12s" % ("", "bytes", "smaller", "write rows/s", "read rows/s"))
+    for label, size, write_time, read_time in [("database.csv", csv_size, csv_write, csv_read),
+                                               ("bccstore", os.path.getsize(store_path), store_write, store_read),
+                                               ("bcccodec", os.path.getsize(codec_path), codec_write, codec_read)]:
+      print("%-13s %10d %7.1fx %12.0f %12.0f" % (label, size, csv_size / float(size),
+                                                 len(rows) / max(write_time, 1e-9), len(rows) / max(read_time, 1e-9)))
+    print("bytes per row: %.2f, decoded rows match database.csv: %s" % (os.path.getsize(codec_path) / float(len(rows)), same))
+    print("rows read back: database.csv %d, bccstore %d, bcccodec %d of %d" % (counts + (len(rows),)))
+  finally:
+    for filename in os.listdir(directory):
+      os.remove(os.path.join(directory, filename))
+    os.rmdir(directory)
+
+  return
+
+#command line###############################################################
+if __name__ == "__main__":
+
+  if len(sys.argv) in (2, 3) and sys.argv[1] == "bench":
+    bench(*sys.argv[2:])
+
+  elif len(sys.argv) == 3 and sys.argv[1] == "compress":
+    store = bccstore.Store(sys.argv[2])
+    encoder = Encoder(sys.argv[2][:-4] + ".bcz")
+    for one in store.records((encoder.last_time or -1000) / 1000.0 + 0.001):
+      encoder.append(one["time"], one)
+    encoder.flush()
+    print(str(len(store)) + " records, " + str(os.path.getsize(sys.argv[2])) + " bytes to " +
+          str(os.path.getsize(encoder.filename)) + " bytes in " + encoder.filename)
+
+  elif len(sys.argv) == 4 and sys.argv[1] == "export":
+    check_header(sys.argv[2])
+    last_time = scan(sys.argv[2])[1]
+    name = os.path.basename(sys.argv[2])[:-4].replace("-", " ").title()
+    if last_time is not None:
+      for one in decode(sys.argv[2], last_time / 1000.0 - float(sys.argv[3]) * 3600):
+        sys.stdout.write(bccstore.database_row(one, name))
+
+  else:
+    print("usage: python bcccodec.py bench [database.csv]")
+    print("       python bcccodec.py compress <store file>")
+    print("       python bcccodec.py export <bcz file> <hours>")
+    sys.exit(1)
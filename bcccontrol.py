@@ -0,0 +1,504 @@
+"""
+    bcccontrol.py - temperature controllers for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+A controller turns the temperature and the target into an output between
+-1.0 (cool flat out) and 1.0 (heat flat out):
+
+  deadband - heat below target - dwell/2, cool above target + dwell/2, the
+             way bcc.py always worked. The relays follow the output directly.
+  pid      - PID on the chamber temperature. Derivative on the temperature
+             (no kick when the target changes), no integrating while the
+             output is pinned at either end (anti windup).
+  cascade  - two loops for a chamber with a second probe in the wort: the
+             outer PI loop on the wort moves the air target up to limit
+             degrees away from the desired temperature, the inner PID loop
+             holds the air at that target. Without a wort probe it is a pid.
+  mpc      - model predictive: a ThermalModel of the chamber (fitted to
+             the logged rows by bccmodel.py) forecasts the temperature
+             over the next horizon seconds for every plan of the form
+             "relay on from a to b" and the cheapest plan is followed
+             until the next reading. A plan costs the square of
+             every degree outside target +/- dwell/2 (heavily), of every
+             degree away from the target (lightly), start_cost for every
+             cooler start and a little for every hour a relay is on - so
+             the compressor gets few long runs that stop before the
+             chamber overshoots. After the planned run the forecast runs
+             the relay again just as long whenever the temperature
+             leaves the band, so a short run is charged for the starts
+             that follow it. The cooler is never planned to start
+             sooner than min_off after it stopped. The room temperature the
+             chamber leaks to is worked out from the last ambient_window
+             seconds of readings.
+
+Control pairs a controller with a TimeProportioner for each relay: an output
+of 0.3 keeps the relay on for 30% of every window. On times shorter than
+min_on are skipped and off times shorter than min_off are filled in, so the
+cooler is never started again less than min_off (COOLER_TIME) after it
+stopped. The deadband controller switches the relays without windows.
+
+Temperatures are Celsius, times are seconds.
+"""
+
+import math
+
+from collections import deque
+
+MODES = ["deadband", "pid", "cascade", "mpc"]
+
+class DeadbandController:
+
+  name = "deadband"
+
+  def update(self, now, temp, setpoint, dwell, wort=None):
+
+    if temp < setpoint - dwell / 2.0: return 1.0
+    if temp > setpoint + dwell / 2.0: return -1.0
+
+    return 0.0
+
+
+  def reset(self):
+
+    return
+
+
+class PID:
+
+  def __init__(self, kp, ti, td=0.0, low=-1.0, high=1.0, smoothing=4.0):
+
+    self.kp = kp #output per degree off the target
+    self.ti = ti #integral time - seconds for the integral to add kp * error again, 0 for none
+    self.td = td #derivative time
+    self.low = low
+    self.high = high
+    self.smoothing = smoothing #derivative filter time constant is td / smoothing
+    self.reset()
+
+    return
+
+
+  def reset(self):
+
+    self.integral = 0.0
+    self.derivative = 0.0
+    self.last_time = None
+    self.last_value = None
+    self.output = 0.0
+
+    return
+
+
+  def update(self, now, value, setpoint):
+
+    error = setpoint - value
+    dt = 0.0
+    if self.last_time is not None: dt = now - self.last_time
+
+    if dt > 0 and self.td > 0:
+      rate = -(value - self.last_value) / dt #derivative on the measurement
+      filter_time = self.td / self.smoothing
+      self.derivative += (rate - self.derivative) * dt / (filter_time + dt)
+
+    output = self.kp * (error + self.integral + self.td * self.derivative)
+
+    if dt > 0 and self.ti > 0:
+      #only integrate while that doesn't push the output further past its limits
+      if (output < self.high or error < 0) and (output > self.low or error > 0):
+        self.integral += error * dt / self.ti
+        output = self.kp * (error + self.integral + self.td * self.derivative)
+
+    self.last_time = now
+    self.last_value = value
+    self.output = min(max(output, self.low), self.high)
+
+    return self.output
+
+
+class PIDController:
+
+  name = "pid"
+
+  def __init__(self, kp, ti, td):
+
+    self.pid = PID(kp, ti, td)
+
+    return
+
+
+  def update(self, now, temp, setpoint, dwell, wort=None):
+
+    return self.pid.update(now, temp, setpoint)
+
+
+  def reset(self):
+
+    self.pid.reset()
+
+    return
+
+
+class CascadeController:
+
+  name = "cascade"
+
+  def __init__(self, kp, ti, td, outer_kp, outer_ti, limit):
+
+    self.inner = PID(kp, ti, td)
+    self.outer = PID(outer_kp, outer_ti, 0.0, -limit, limit)
+    self.air_target = None #target the outer loop set for the air
+
+    return
+
+
+  def update(self, now, temp, setpoint, dwell, wort=None):
+
+    if wort is None:
+      self.air_target = setpoint
+    else:
+      self.air_target = setpoint + self.outer.update(now, wort, setpoint)
+
+    return self.inner.update(now, temp, self.air_target)
+
+
+  def reset(self):
+
+    self.inner.reset()
+    self.outer.reset()
+    self.air_target = None
+
+    return
+
+
+class ThermalModel:
+  #first order model of the chamber air, the same one the simulator runs (bcchw.SimChamber):
+  #  dT/dt = (ambient - T) / tau + heat_rate * h - cool_rate * c
+  #h and c are the heater and cooler power (0.0 - 1.0) that follow their relay through a lag
+
+  def __init__(self, tau=3.0 * 3600, heat_rate=14.4, cool_rate=21.6, lag=90.0):
+
+    self.tau = tau #ambient leak time constant, seconds
+    self.heat_rate = heat_rate #degrees an hour with the heater fully on
+    self.cool_rate = cool_rate #degrees an hour with the cooler fully on
+    self.lag = lag #relay lag time constant, seconds
+
+    return
+
+
+  def coefficients(self, dt):#constants of a step of dt seconds - worked out once for many steps
+
+    dt = float(dt)
+    e_tau = math.exp(-dt / self.tau)
+    if self.lag <= 0: return e_tau, 0.0, 0.0
+
+    e_lag = math.exp(-dt / self.lag)
+    if abs(self.tau - self.lag) < 1e-9: lag_term = dt * e_tau
+    else: lag_term = (e_lag - e_tau) / (1.0 / self.tau - 1.0 / self.lag)
+
+    return e_tau, e_lag, lag_term
+
+
+  def step(self, state, heater_on, cooler_on, ambient, coefficients):
+    #state is (temperature, heater power, cooler power) - exact solution with the relays held for the step
+
+    temp, heat, cool = state
+    e_tau, e_lag, lag_term = coefficients
+    heat_target = 1.0 if heater_on else 0.0
+    cool_target = 1.0 if cooler_on else 0.0
+
+    q0 = (self.heat_rate * heat - self.cool_rate * cool) / 3600.0
+    q_inf = (self.heat_rate * heat_target - self.cool_rate * cool_target) / 3600.0
+    temp = ambient + (temp - ambient) * e_tau + q_inf * self.tau * (1.0 - e_tau) + (q0 - q_inf) * lag_term
+
+    return temp, heat_target + (heat - heat_target) * e_lag, cool_target + (cool - cool_target) * e_lag
+
+
+class PredictiveController:
+
+  name = "mpc"
+
+  BAND_WEIGHT = 100.0 #a degree outside the band costs as much as 10 degrees away from the target
+  ENERGY_COST = 0.02 #cost of an hour with a relay on
+
+  def __init__(self, model, horizon=90 * 60, step=30, tail_step=2 * 60, start_cost=0.5, min_on=60,
+               cooler_min_off=5 * 60, ambient_window=15 * 60):
+
+    self.model = model
+    self.horizon = horizon
+    self.step = step #resolution of the planned run
+    self.tail_step = tail_step #and of the forecast after it
+    self.start_cost = start_cost #cost of a cooler start
+    self.min_on = min_on
+    self.cooler_min_off = cooler_min_off
+    self.ambient_window = ambient_window
+    self.reset()
+
+    return
+
+
+  def reset(self):
+
+    self.heater_on = False #relays as this controller set them
+    self.cooler_on = False
+    self.on_since = None #time the relay that is on was turned on
+    self.cooler_off_at = None #time the cooler last stopped
+    self.powers = (0.0, 0.0) #heater and cooler power the model expects now
+    self.history = deque() #(time, temperature, heater power, cooler power, heater on, cooler on) of every reading
+    self.ambient = None #estimated room temperature
+    self.last_time = None
+    self.plan = None #(relay, seconds from now it starts, seconds from now it stops) of the last plan chosen
+
+    return
+
+
+  def update(self, now, temp, setpoint, dwell, wort=None):
+
+    #the relay powers the model expects after the time the relays were held
+    if self.last_time is not None and now > self.last_time:
+      state = self.model.step((temp,) + self.powers, self.heater_on, self.cooler_on, temp,
+                              self.model.coefficients(now - self.last_time))
+      self.powers = state[1:]
+    self.estimate_ambient(now, temp)
+    self.last_time = now
+
+    relay, start, stop = self.best_plan(now, temp, setpoint, dwell)
+    self.plan = (relay, start * self.step, stop * self.step)
+    heater_on = relay == "heater" and start == 0 and stop > 0
+    cooler_on = relay == "cooler" and start == 0 and stop > 0
+
+    if self.cooler_on and not cooler_on: self.cooler_off_at = now
+    if (heater_on and not self.heater_on) or (cooler_on and not self.cooler_on): self.on_since = now
+    self.heater_on = heater_on
+    self.cooler_on = cooler_on
+
+    self.history.append((now, temp) + self.powers + (heater_on, cooler_on))
+    while len(self.history) > 2 and now - self.history[1][0] >= self.ambient_window:
+      self.history.popleft()
+
+    if heater_on: return 1.0
+    if cooler_on: return -1.0
+
+    return 0.0
+
+
+  def estimate_ambient(self, now, temp):
+    #the model is linear, so the temperature now is (1 - exp(-span/tau)) * ambient plus what the
+    #relays and the oldest reading make of it with an ambient of 0 - solve that for the ambient
+
+    if not self.history or now - self.history[0][0] < self.ambient_window / 3.0: return
+
+    when, old_temp, heat, cool = self.history[0][:4]
+    state = (old_temp, heat, cool)
+    for index in range(len(self.history)):
+      heater_on, cooler_on = self.history[index][4:]
+      if index + 1 < len(self.history): end = self.history[index + 1][0]
+      else: end = now
+      state = self.model.step(state, heater_on, cooler_on, 0.0, self.model.coefficients(end - self.history[index][0]))
+
+    estimate = (temp - state[0]) / (1.0 - math.exp(-(now - when) / float(self.model.tau)))
+    if self.ambient is None: self.ambient = estimate
+    else: self.ambient += (estimate - self.ambient) * min(1.0, (now - self.history[-1][0]) / self.ambient_window)
+
+    return
+
+
+  def best_plan(self, now, temp, setpoint, dwell):#(relay, start step, stop step) - start == stop for all off
+
+    model = self.model
+    steps = max(1, int(self.horizon / self.step))
+    coefficients = model.coefficients(self.step)
+    ambient = self.ambient
+    if ambient is None: ambient = temp #no leak until it is known
+    high = setpoint + dwell / 2.0
+    low = setpoint - dwell / 2.0
+    hours = self.step / 3600.0
+    tail_ratio = max(1, int(round(self.tail_step / float(self.step)))) #steps in a tail step
+    tail_coefficients = model.coefficients(tail_ratio * self.step)
+    tail_hours = tail_ratio * hours
+    band_weight = self.BAND_WEIGHT
+
+    def tail(state, first, relay, run):
+      #cost from step first to the end - off in steps of tail_step, and the relay runs again for run steps
+      #the same way whenever the temperature leaves the band on its side
+      total = 0.0
+      k = first
+      off_since = first
+      while k < steps:
+        value = state[0]
+        if (relay == "cooler" and value > high and (k - off_since) * self.step >= self.cooler_min_off) or \
+           (relay == "heater" and value < low):
+          if relay == "cooler": total += self.start_cost
+          for j in range(min(run, steps - k)):
+            state = model.step(state, relay == "heater", relay == "cooler", ambient, coefficients)
+            value = state[0]
+            excess = max(value - high, low - value, 0.0)
+            total += (band_weight * excess * excess + (value - setpoint) ** 2 + self.ENERGY_COST) * hours
+          k += run
+          off_since = k
+          continue
+        state = model.step(state, False, False, ambient, tail_coefficients)
+        value = state[0]
+        excess = max(value - high, low - value, 0.0)
+        total += (band_weight * excess * excess + (value - setpoint) ** 2) * tail_hours
+        k += tail_ratio
+      return total
+
+    #all off from now - the plan to beat
+    state = (temp,) + self.powers
+    off_states = [state] #state at the start of every step
+    off_costs = [0.0] #cost up to the start of every step
+    for k in range(steps):
+      state = model.step(state, False, False, ambient, coefficients)
+      value = state[0]
+      excess = max(value - high, low - value, 0.0)
+      off_states.append(state)
+      off_costs.append(off_costs[-1] + (band_weight * excess * excess + (value - setpoint) ** 2) * hours)
+
+    best = (off_costs[-1], None, 0, 0)
+    if (self.heater_on or self.cooler_on) and now - self.on_since < self.min_on:
+      best = (float("inf"), None, 0, 0) #can't stop yet
+    if max([max(s[0] - high, low - s[0]) for s in off_states[1:]]) <= 0 and \
+       not (self.heater_on or self.cooler_on):
+      return best[1:] #stays in the band on its own
+
+    grid = [0, 1, 2, 3, 4, 6, 8, 12, 16, 24, 32, 48, 64, 96, 128] #steps - fine near now, coarse later
+    min_on_steps = int(math.ceil(self.min_on / float(self.step)))
+
+    for relay in ("heater", "cooler"):
+      running = (relay == "heater" and self.heater_on) or (relay == "cooler" and self.cooler_on)
+      ran = 0 #steps the relay has been on - the runs the forecast repeats are as long as this one
+      if self.heater_on or self.cooler_on:
+        if not running: continue #one relay at a time - the other one has to stop first
+        starts = [0]
+        first_stop = max(0, int(math.ceil((self.on_since + self.min_on - now) / float(self.step))))
+        ran = int(round((now - self.on_since) / float(self.step)))
+        if now - self.on_since >= self.min_on: #stop now and run again the same way when it is needed
+          total = tail(off_states[0], 0, relay, max(ran, min_on_steps))
+          if total < best[0]: best = (total, relay, 0, 0)
+      else:
+        starts = [start for start in grid if start < steps]
+        if relay == "cooler" and self.cooler_off_at is not None: #compressor restart lockout
+          wait = self.cooler_off_at + self.cooler_min_off - now
+          starts = [start for start in starts if start * self.step >= wait]
+        first_stop = min_on_steps
+
+      for start in starts:
+        state = off_states[start]
+        cost = off_costs[start]
+        if relay == "cooler" and not running: cost += self.start_cost
+        stops = sorted(set([min(start + max(length, first_stop), steps) for length in grid[1:]] + [steps]))
+        k = start
+        for stop in stops:
+          if stop <= start: continue
+          while k < stop: #run on to this stop
+            state = model.step(state, relay == "heater", relay == "cooler", ambient, coefficients)
+            value = state[0]
+            excess = max(value - high, low - value, 0.0)
+            cost += (band_weight * excess * excess + (value - setpoint) ** 2 + self.ENERGY_COST) * hours
+            k += 1
+          total = cost + tail(state, stop, relay, ran + stop - start)
+          if total < best[0]: best = (total, relay, start, stop)
+          if (relay == "cooler" and state[0] < low) or (relay == "heater" and state[0] > high):
+            break #already past the band - running longer can only cost more
+
+    if best[1] is None: return None, 0, 0
+
+    return best[1:]
+
+
+class TimeProportioner:
+
+  def __init__(self, window, min_on=0.0, min_off=0.0):
+
+    self.window = window
+    self.min_on = min_on
+    self.min_off = min_off
+    self.start = None #start of the current window
+    self.on_time = 0.0 #seconds the relay is on from the start of the window
+
+    return
+
+
+  def update(self, now, duty):#duty 0.0 - 1.0, returns True if the relay should be on
+
+    if self.start is None or now - self.start >= self.window:
+      self.start = now
+      self.on_time = duty * self.window
+      if self.on_time < self.min_on: self.on_time = 0.0
+      elif self.window - self.on_time < self.min_off: self.on_time = self.window
+
+    elapsed = now - self.start
+    if duty <= 0 and elapsed < self.on_time and elapsed >= self.min_on:
+      self.on_time = elapsed #the target was passed - stop now instead of at the planned time
+
+    return elapsed < self.on_time
+
+
+  def reset(self):
+
+    self.start = None
+    self.on_time = 0.0
+
+    return
+
+
+class Control:
+
+  def __init__(self, controller, heater=None, cooler=None):
+
+    self.controller = controller
+    self.heater = heater #TimeProportioner of each relay, None to follow the output directly
+    self.cooler = cooler
+    self.output = 0.0
+
+    return
+
+
+  def relays(self, now, temp, setpoint, dwell, wort=None):#returns (heater on, cooler on)
+
+    self.output = self.controller.update(now, temp, setpoint, dwell, wort)
+
+    if self.heater is None: heat = self.output > 0
+    else: heat = self.heater.update(now, max(self.output, 0.0))
+
+    if self.cooler is None: cool = self.output < 0
+    else: cool = self.cooler.update(now, max(-self.output, 0.0))
+
+    return heat, cool
+
+
+  def reset(self):#brew cycle off - start again without the old integral and windows
+
+    self.controller.reset()
+    self.output = 0.0
+    for relay in (self.heater, self.cooler):
+      if relay is not None: relay.reset()
+
+    return
+
+
+def make_control(mode, kp=0.5, ti=30 * 60, td=60, outer_kp=2.0, outer_ti=2 * 60 * 60, limit=5.0, heater_window=5 * 60,
+                 cooler_window=20 * 60, min_on=60, cooler_min_off=5 * 60, model=None, horizon=90 * 60, start_cost=0.5):
+
+  if mode == "pid": controller = PIDController(kp, ti, td)
+  elif mode == "cascade": controller = CascadeController(kp, ti, td, outer_kp, outer_ti, limit)
+  elif mode == "mpc":
+    if model is None: model = ThermalModel()
+    return Control(PredictiveController(model, horizon, start_cost=start_cost, min_on=min_on,
+                                        cooler_min_off=cooler_min_off)) #switches the relays itself
+  else: return Control(DeadbandController())
+
+  return Control(controller, TimeProportioner(heater_window, min_on, min_on),
+                 TimeProportioner(cooler_window, min_on, cooler_min_off))
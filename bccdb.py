@@ -0,0 +1,217 @@
+"""
+    bccdb.py - buffered database.csv writer for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+DatabaseWriter keeps database.csv open for the whole run and collects the
+lines written to it in memory. A background thread writes them out when
+flush_interval seconds have passed or flush_size lines are waiting, so
+the eMMC/SD card sees one write (and one fsync) per batch instead of an
+open/write/close for every line, and a slow card never holds up a relay.
+
+Durability: lines are on the card once a flush has finished (fsync=True).
+close() flushes whatever is left - bcc.py calls it on exit and on SIGTERM/
+SIGHUP, so at most flush_interval seconds of lines are lost on a power cut.
+
+With max_bytes set the file is rotated once it grows past max_bytes:
+database.csv becomes database.csv.1, .1 becomes .2 and so on, the oldest
+of the backups is deleted - the database never takes more than
+(backups + 1) * max_bytes of the card.
+
+atomic_write() replaces a whole file (bccsettings.json) so that a crash leaves
+either the old or the new file, never a mix of the two.
+"""
+
+import os
+import threading
+import time
+
+class DatabaseWriter:
+
+  def __init__(self, filename, flush_interval=60, flush_size=100, fsync=True, max_bytes=0, backups=4):
+
+    self.filename = filename
+    self.flush_interval = flush_interval #seconds a line may wait in memory
+    self.flush_size = flush_size #lines waiting that start a flush straight away
+    self.fsync = fsync #make sure every flush is on the card, not just in the OS cache
+    self.max_bytes = max_bytes #rotate the file when it gets bigger than this - 0 never rotates
+    self.backups = backups #rotated files kept
+
+    self.lines = [] #lines waiting to be written
+    self.lock = threading.Condition()
+    self.write_lock = threading.Lock() #one write to the file at a time
+    self.closed = False
+    self.error = None #last error the writer thread ran into
+    self.flushes = 0 #number of writes to the file, for measuring
+
+    self.file = open(filename, "a")
+
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True #never keep the program alive - close() does the last flush
+    self.thread.start()
+
+    return
+
+
+  def write(self, line):#queue one line - never touches the disk
+
+    self.lock.acquire()
+    try:
+      if self.closed: raise ValueError("database writer is closed")
+      self.lines.append(line)
+      if len(self.lines) >= self.flush_size: self.lock.notify()
+    finally:
+      self.lock.release()
+
+    return
+
+
+  def flush(self):#write everything waiting now - blocks until it is on the card
+
+    self.write_waiting()
+
+    return
+
+
+  def close(self):#flush and stop the thread - safe to call more than once
+
+    self.lock.acquire()
+    try:
+      if self.closed: return
+      self.closed = True
+      self.lock.notify()
+    finally:
+      self.lock.release()
+
+    self.thread.join()
+    self.flush()
+    self.file.close()
+
+    return
+
+
+  def run(self):#writer thread
+
+    while True:
+      self.lock.acquire()
+      try:
+        deadline = time.time() + self.flush_interval
+        while not self.closed and len(self.lines) < self.flush_size:
+          wait = deadline - time.time()
+          if wait <= 0: break
+          self.lock.wait(wait)
+
+        if self.closed: return
+      finally:
+        self.lock.release()
+
+      self.write_waiting()
+
+    return
+
+
+  def write_waiting(self):#write the lines waiting - the batch is taken with write_lock held so that
+    #batches reach the file in the order they were queued, whether the thread or flush() writes them
+
+    self.write_lock.acquire()
+    try:
+      self.lock.acquire()
+      try:
+        lines = self.lines
+        self.lines = []
+      finally:
+        self.lock.release()
+
+      if lines: self.write_lines(lines)
+    finally:
+      self.write_lock.release()
+
+    return
+
+
+  def write_lines(self, lines):#called with write_lock held
+
+    try:
+      if self.file.closed: self.file = open(self.filename, "a") #a rotate that failed part way through
+      self.file.write("".join(lines))
+      self.file.flush()
+      if self.fsync: os.fsync(self.file.fileno())
+    except (IOError, OSError) as error:
+      #keep the lines and try again next time rather than lose them
+      self.error = error
+      self.lock.acquire()
+      try:
+        self.lines[0:0] = lines
+      finally:
+        self.lock.release()
+      return
+    self.flushes += 1
+
+    if self.max_bytes and self.file.tell() > self.max_bytes:
+      try:
+        self.rotate()
+      except (IOError, OSError) as error: #the lines are written - rotate again after the next write
+        self.error = error
+
+    return
+
+
+  def rotate(self):#called with write_lock held
+
+    self.file.close()
+    try:
+      for number in range(self.backups, 0, -1):
+        older = self.filename + "." + str(number)
+        if number == self.backups:
+          if os.path.exists(older): os.remove(older)
+        elif os.path.exists(older):
+          os.rename(older, self.filename + "." + str(number + 1))
+
+      if self.backups > 0: os.rename(self.filename, self.filename + ".1")
+      else: os.remove(self.filename)
+    finally:
+      self.file = open(self.filename, "a") #the old file again if the renames failed
+
+    return
+
+#atomic file replace######################################################
+#write to a temporary file next to filename and rename it over the old one -
+#a crash part way through leaves the old file, never half of the new one
+
+def atomic_write(filename, text, fsync=True, binary=False):
+
+  temp_filename = filename + ".tmp"
+
+  if binary: temp_file = open(temp_filename, "wb")
+  else: temp_file = open(temp_filename, "w")
+  try:
+    temp_file.write(text)
+    temp_file.flush()
+    if fsync: os.fsync(temp_file.fileno())
+  finally:
+    temp_file.close()
+
+  os.rename(temp_filename, filename) #atomic on the same file system
+
+  if fsync: #make the rename itself safe too
+    try:
+      directory = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+      try:
+        os.fsync(directory)
+      finally:
+        os.close(directory)
+    except OSError:
+      pass
+
+  return
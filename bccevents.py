@@ -0,0 +1,159 @@
+"""
+    bccevents.py - event journal for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Journal keeps what happened (events.jsonl) apart from the temperature
+readings (store/chamber-N.bcs). Every event is one JSON line with its type:
+
+  {"time": 1417176000.25, "type": "alarm", "chamber": "Chamber 1", "alarm": "high", "message": "High Temp", "value": 78.2}
+
+  start          - bcc.py started (version)
+  exit           - bcc.py stopped (how)
+  brew           - brew session created (name, batch, size, style, method, yeast)
+  cycle          - brew cycle changed (from, to)
+  setting        - setting changed (name, from, to)
+  alarm          - alarm rule or heater/cooler malfunction raised (alarm - its name, message, value)
+  alarm_cleared  - alarm cleared (alarm, value)
+  sms            - alarm message sent or failed (message, transport, ok, error, tries)
+
+Times are time.time() like the records of the store, so the two share one
+timestamp index: find(time) of a chamber's Store gives the readings around
+an event, events(start, end) the events around a reading. Lines go through
+a bccdb.DatabaseWriter, so they are written in batches and rotated like
+database.csv.
+
+  python bccevents.py [events.jsonl] [type] [hours] - list events, with the reading of
+                                                     the chamber at each one if store/ is there
+"""
+
+import json
+import os
+import sys
+import time
+
+from collections import OrderedDict
+
+import bccdb
+import bccsettings
+
+TYPES = ["start", "exit", "brew", "cycle", "setting", "alarm", "alarm_cleared", "sms"]
+
+class Journal:
+
+  def __init__(self, filename, flush_interval=60, flush_size=100, fsync=True, max_bytes=0, backups=4):
+
+    self.filename = filename
+    self.writer = bccdb.DatabaseWriter(filename, flush_interval, flush_size, fsync, max_bytes, backups)
+
+    return
+
+
+  def log(self, event_type, chamber=None, **data):#chamber name, None for events of the whole program
+
+    if event_type not in TYPES: raise ValueError("unknown event type " + repr(event_type))
+
+    event = OrderedDict([("time", round(time.time(), 3)), ("type", event_type)])
+    if chamber is not None: event["chamber"] = chamber
+    for name in sorted(data):
+      event[name] = bccsettings.to_json(data[name])
+
+    self.writer.write(json.dumps(event) + "\n")
+
+    return
+
+
+  def flush(self):
+
+    self.writer.flush()
+
+    return
+
+
+  def close(self):
+
+    self.writer.close()
+
+    return
+
+
+def filenames(filename):#the journal and its rotated copies, oldest first
+
+  names = [filename]
+  number = 1
+  while os.path.exists(filename + "." + str(number)):
+    names.insert(0, filename + "." + str(number))
+    number += 1
+
+  return names
+
+
+def events(filename, start=None, end=None, types=None, chamber=None):#events in time order as dicts
+
+  for name in filenames(filename):
+    if not os.path.exists(name): continue
+    journal_file = open(name)
+    try:
+      for line in journal_file:
+        try:
+          event = json.loads(line)
+        except ValueError:
+          continue #half written line after a power cut
+        if start is not None and event["time"] < start: continue
+        if end is not None and event["time"] > end: continue
+        if types is not None and event["type"] not in types: continue
+        if chamber is not None and event.get("chamber") != chamber: continue
+        yield event
+    finally:
+      journal_file.close()
+
+#report#####################################################################
+if __name__ == "__main__":
+
+  filename = "events.jsonl"
+  types = None
+  start = None
+  for argument in sys.argv[1:]:
+    if argument in TYPES: types = [argument]
+    elif os.path.exists(argument): filename = argument
+    else:
+      try:
+        start = time.time() - float(argument) * 3600
+      except ValueError:
+        print("usage: python bccevents.py [events.jsonl] [type] [hours]")
+        print("types: " + ", ".join(TYPES))
+        sys.exit(1)
+
+  import bccstore
+
+  stores = {}
+  directory = os.path.join(os.path.dirname(filename), "store")
+  for event in events(filename, start, types=types):
+    details = ", ".join([name + "=" + json.dumps(value) for name, value in event.items()
+                         if name not in ("time", "type", "chamber")])
+    line = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(event["time"])) + " " + event["type"]
+    if "chamber" in event: line += " [" + event["chamber"] + "]"
+    if details: line += " " + details
+
+    store_filename = bccstore.store_filename(directory, event.get("chamber", ""))
+    if "chamber" in event and os.path.exists(store_filename):
+      if store_filename not in stores: stores[store_filename] = bccstore.Store(store_filename)
+      store = stores[store_filename]
+      index = store.find(event["time"]) #first reading at or after the event - show the one before
+      if index > 0:
+        reading = bccstore.unpack(store.view(store.time(index - 1), store.time(index - 1)))
+        line += " | avg " + str(round(reading["avg"], 2)) + " heater " + str(reading["heater"]) + \
+                " cooler " + str(reading["cooler"])
+
+    print(line)
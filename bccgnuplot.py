@@ -0,0 +1,177 @@
+"""
+    bccgnuplot.py - long running gnuplot chart for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+GnuplotPipe starts gnuplot once per brew session and keeps talking to it
+over a pipe instead of writing a .gp script that pauses and rereads the
+whole .dat file:
+
+  - the session is kept in a gnuplot datablock ($session), every new point
+    is appended to it with print - nothing is read from the card
+  - settings (y range, title) are only sent when they changed
+  - replot draws the window again
+
+What bcc.py sends for every point is one short line, however long the
+session has been running. Datablocks need gnuplot 5.0 or newer.
+"""
+
+import os
+import subprocess
+import time
+
+PLOT = ("plot $session using 1:2 title \"Avg Temp\" with lines, "
+        "'' using 1:2 title \"Smoothed\" smooth bezier with lines, "
+        "'' using 1:3 title \"Min Temp\" with lines, "
+        "'' using 1:4 title \"Max Temp\" with lines, "
+        "'' using 1:5 title \"Des Temp\" with lines, "
+        "'' using 1:6 title \"Hi Alarm\" with lines, "
+        "'' using 1:7 title \"Lo Alarm\" with lines")
+
+SETUP = ["set xdata time",
+         "set timefmt \"%Y-%m-%d %H:%M\"",
+         "set format x \"%H:%M\"",
+         "set xrange[*:*]",
+         "set mytics 5",
+         "set datafile separator \",\"",
+         "set xlabel \"Time\"",
+         "set ylabel \"Temperature\"",
+         "set grid",
+         "$session << EOD", "EOD", #empty datablock
+         "set print $session append"]
+
+class GnuplotPipe:
+
+  def __init__(self, command="gnuplot"):
+
+    self.command = command
+    self.process = None
+    self.sent = {} #setting: command last sent
+    self.points = 0 #points in the datablock
+    self.plotted = False
+
+    return
+
+
+  def alive(self):
+
+    return self.process is not None and self.process.poll() is None
+
+
+  def start(self, lines=()):#start gnuplot with the session so far (lines of the .dat file)
+
+    self.close()
+
+    devnull = open(os.devnull, "w")
+    try:
+      #gnuplot messages would land on the bcc.py screen
+      self.process = subprocess.Popen([self.command], stdin=subprocess.PIPE, stdout=devnull, stderr=devnull,
+                                      close_fds=True)
+    finally:
+      devnull.close()
+
+    self.sent = {}
+    self.points = 0
+    self.plotted = False
+    self.send(SETUP)
+
+    for line in lines:
+      self.append(line)
+
+    return
+
+
+  def send(self, commands):#returns False if gnuplot has gone away
+
+    if not self.alive(): return False
+
+    try:
+      self.process.stdin.write(to_bytes("\n".join(commands) + "\n"))
+      self.process.stdin.flush()
+    except (IOError, OSError): #broken pipe - the window was closed
+      self.close()
+      return False
+
+    return True
+
+
+  def set(self, name, command):#send a setting only when it changed - returns True if it was sent
+
+    if self.sent.get(name) == command: return False
+    if not self.send([command]): return False
+
+    self.sent[name] = command
+    if self.plotted: self.send(["replot"])
+
+    return True
+
+
+  def append(self, line):#one line of the .dat file
+
+    line = line.strip()
+    if not line: return
+
+    self.send(["print " + quote(line)])
+    self.points += 1
+
+    return
+
+
+  def plot(self):#draw the window - once there are two points to draw a line between
+
+    if self.points < 2: return
+
+    if self.plotted: self.send(["replot"])
+    else: self.plotted = self.send([PLOT])
+
+    return
+
+
+  def close(self):
+
+    if self.process is None: return
+
+    try:
+      if self.process.poll() is None:
+        self.process.stdin.write(b"exit\n")
+        self.process.stdin.close()
+    except (IOError, OSError):
+      pass
+
+    #gnuplot exits when its stdin closes - kill it if it is stuck
+    for x in range(20):
+      if self.process.poll() is not None: break
+      time.sleep(0.05)
+    else:
+      try:
+        self.process.kill()
+        self.process.wait()
+      except OSError:
+        pass
+
+    self.process = None
+
+    return
+
+
+def to_bytes(text):
+
+  if isinstance(text, bytes): return text
+
+  return text.encode("utf-8")
+
+
+def quote(text):#gnuplot string
+
+  return "\"" + text.replace("\\", "\\\\").replace("\"", "\\\"") + "\""
@@ -0,0 +1,354 @@
+"""
+    bcchw.py - hardware backends for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+bcc.py talks to the sensor and the relays only through one of these backends:
+
+  BBIOBackend - the real Beaglebone Black pins via the Adafruit BBIO library
+  SimBackend  - a simulated brew chamber so bcc.py can run on any computer
+
+Both have the same methods:
+
+  setup(wiring)            - get the ADC and the relay output pins ready, wiring is a
+                             list of (sensor AIN, heater pin, cooler pin[, wort AIN]), one per chamber
+  read_adc(channel)        - return the ADC reading (0.0 - 1.0) of an AIN channel
+  output(pin, on)          - turn a relay pin on (True) or off (False)
+
+read_filtered() takes a burst of ADC reads and combines them into one
+cleaner reading with a median, trimmed mean or decimation (plain average)
+filter before it is turned into a temperature.
+"""
+
+import ctypes
+import ctypes.util
+import math
+import random
+import time
+
+#default pins for a single chamber
+SENSOR_AIN = "AIN0" #thermistor voltage divider
+HEATER_PIN = "P9_15" #heater relay/RED LED
+COOLER_PIN = "P9_23" #cooler relay/GREEN LED
+
+c2kelvin = 273.15
+
+#Beaglebone Black backend#################################################
+class BBIOBackend:
+
+  name = "bbio"
+
+  def __init__(self):
+    #import here so the simulator works on computers without the library
+    import Adafruit_BBIO.ADC as ADC
+    import Adafruit_BBIO.GPIO as GPIO
+
+    self.ADC = ADC
+    self.GPIO = GPIO
+
+    return
+
+
+  def setup(self, wiring):
+
+    self.ADC.setup()
+
+    for pins in wiring: #(sensor AIN, heater pin, cooler pin[, wort AIN])
+      self.GPIO.setup(pins[1], self.GPIO.OUT)
+      self.GPIO.setup(pins[2], self.GPIO.OUT)
+
+    return
+
+
+  def read_adc(self, channel):
+
+    return self.ADC.read(channel)
+
+
+  def output(self, pin, on):
+
+    if on: self.GPIO.output(pin, self.GPIO.HIGH)
+    else: self.GPIO.output(pin, self.GPIO.LOW)
+
+    return
+
+#simulated chamber#######################################################
+#first order thermal model of a chamber with a heater and a cooler:
+#
+#  dT/dt = (ambient - T) / tau + heat_rate * h - cool_rate * c
+#
+#h and c are the heater and cooler power (0.0 - 1.0). They follow the relay
+#state through a first order lag (element warm up, compressor spin up) so
+#the chamber keeps heating/cooling for a while after the relay drops.
+#The wort follows the chamber air with a time constant of its own (wort_tau)
+#for a chamber with a second probe in the wort.
+#Temperatures are Celsius, rates are degrees C per second, times are seconds.
+
+class SimChamber:
+
+  def __init__(self, temp=20.0, ambient=21.0, tau=3.0*3600, heat_rate=0.004, cool_rate=0.006,
+               lag=90.0, noise=0.0005, wort_tau=2.0*3600):
+
+    self.temp = temp #chamber air temperature
+    self.ambient = ambient #room temperature outside the chamber
+    self.tau = tau #ambient leak time constant
+    self.heat_rate = heat_rate #heating rate with the heater fully on
+    self.cool_rate = cool_rate #cooling rate with the cooler fully on
+    self.lag = lag #relay lag time constant
+    self.noise = noise #standard deviation of the ADC noise (0.0 - 1.0 scale)
+    self.wort = temp #wort temperature
+    self.wort_tau = wort_tau #air to wort time constant
+
+    self.heater_relay = False
+    self.cooler_relay = False
+    self.heater_power = 0.0
+    self.cooler_power = 0.0
+
+    return
+
+
+  def step(self, dt):
+    #advance the model dt seconds with the relays held in their current state
+    #uses the exact solution of the linear model so any dt is fine
+
+    if dt <= 0: return
+
+    air_before = self.temp
+    heat_target = 1.0 if self.heater_relay else 0.0
+    cool_target = 1.0 if self.cooler_relay else 0.0
+
+    #net heating now and once the relay lag has settled
+    q0 = self.heat_rate * self.heater_power - self.cool_rate * self.cooler_power
+    q_inf = self.heat_rate * heat_target - self.cool_rate * cool_target
+
+    e_tau = math.exp(-dt / self.tau)
+
+    if self.lag > 0:
+      e_lag = math.exp(-dt / self.lag)
+      if abs(self.tau - self.lag) < 1e-9:
+        lag_term = dt * e_tau
+      else:
+        lag_term = (e_lag - e_tau) / (1.0 / self.tau - 1.0 / self.lag)
+    else:
+      e_lag = 0.0
+      lag_term = 0.0
+
+    self.temp = (self.ambient + (self.temp - self.ambient) * e_tau + q_inf * self.tau * (1.0 - e_tau) +
+                 (q0 - q_inf) * lag_term)
+
+    #the wort follows the average air temperature of the step
+    self.wort += ((air_before + self.temp) / 2.0 - self.wort) * (1.0 - math.exp(-dt / self.wort_tau))
+
+    self.heater_power = heat_target + (self.heater_power - heat_target) * e_lag
+    self.cooler_power = cool_target + (self.cooler_power - cool_target) * e_lag
+
+    return
+
+
+class SimBackend:
+
+  name = "sim"
+
+  def __init__(self, r_bias, vdd_adc, t_a, t_b, t_c, speed=1.0, seed=None):
+
+    self.r_bias = r_bias #same voltage divider as the real board
+    self.vdd_adc = vdd_adc
+    self.t_a = t_a #thermistor constants
+    self.t_b = t_b
+    self.t_c = t_c
+    self.speed = speed #simulated seconds per real second
+    self.random = random.Random(seed)
+
+    self.chambers = {} #AIN channel: SimChamber
+    self.worts = {} #AIN channel of a wort probe: AIN channel of its chamber
+    self.pins = {} #relay pin: (AIN channel, "heat" or "cool")
+    self.last_time = time.time()
+    self.sim_time = 0.0 #simulated seconds since the start
+    self.failures = [] #(simulated time, "heater" or "cooler", AIN channel of the chamber) still to come
+
+    return
+
+
+  def add_chamber(self, channel=SENSOR_AIN, heater_pin=HEATER_PIN, cooler_pin=COOLER_PIN, wort_channel=None, **model):
+
+    chamber = SimChamber(**model)
+    self.chambers[channel] = chamber
+    if wort_channel is not None: self.worts[wort_channel] = channel
+    self.pins[heater_pin] = (channel, "heat")
+    self.pins[cooler_pin] = (channel, "cool")
+
+    return chamber
+
+
+  def setup(self, wiring):
+
+    #give every chamber a slightly different starting point so they don't move in lock step
+    for pins in wiring:
+      sensor_ain, heater_pin, cooler_pin = pins[:3]
+      if sensor_ain not in self.chambers:
+        self.add_chamber(sensor_ain, heater_pin, cooler_pin, (list(pins) + [None])[3],
+                         temp=self.random.uniform(17.0, 23.0), ambient=self.random.uniform(19.0, 23.0))
+
+    self.last_time = time.time()
+
+    return
+
+
+  def advance(self):
+    #move every simulated chamber forward to the current time
+
+    now = time.time()
+    dt = (now - self.last_time) * self.speed
+    self.last_time = now
+    self.sim_time += dt
+
+    for chamber in self.chambers.values():
+      chamber.step(dt)
+
+    for failure in [failure for failure in self.failures if failure[0] <= self.sim_time]:
+      self.failures.remove(failure)
+      chamber = self.chambers.get(failure[2])
+      if chamber is None: continue #no chamber on that channel
+      if failure[1] == "heater": chamber.heat_rate = 0.0
+      else: chamber.cool_rate = 0.0
+
+    return
+
+
+  def fail(self, relay, after=0.0, channel=SENSOR_AIN):
+    #the heater or cooler of the chamber on channel stops working after that many simulated seconds - relay still clicks
+
+    self.failures.append((self.sim_time + after, relay, channel))
+
+    return
+
+
+  def read_adc(self, channel):
+
+    self.advance()
+    if channel in self.worts:
+      chamber = self.chambers[self.worts[channel]]
+      temp = chamber.wort
+    else:
+      chamber = self.chambers[channel]
+      temp = chamber.temp
+
+    ratio = self.temperature_to_adc(temp) + self.random.gauss(0.0, chamber.noise)
+    ratio = min(max(ratio, 0.0), 1.0)
+
+    return round(ratio * 4095) / 4095.0 #12 bit ADC
+
+
+  def output(self, pin, on):
+
+    if pin not in self.pins: return
+
+    self.advance() #settle the model with the old relay state first
+    channel, relay = self.pins[pin]
+
+    if relay == "heat": self.chambers[channel].heater_relay = bool(on)
+    else: self.chambers[channel].cooler_relay = bool(on)
+
+    return
+
+
+  def temperature_to_adc(self, temp_celsius):
+    #inverse Steinhart-Hart: solve T_c*x^3 + T_b*x + (T_a - 1/T) = 0 for x = ln(R)
+    #then run the thermistor resistance through the R_BIAS voltage divider
+
+    alpha = (self.t_a - 1.0 / (temp_celsius + c2kelvin)) / (2.0 * self.t_c)
+    beta = math.sqrt((self.t_b / (3.0 * self.t_c)) ** 3 + alpha * alpha)
+    x = cube_root(beta - alpha) - cube_root(beta + alpha)
+    res_therm = math.exp(x)
+
+    return self.r_bias / (self.r_bias + res_therm) #Vout / VDD_ADC
+
+
+def cube_root(x):
+
+  if x < 0: return -((-x) ** (1.0 / 3.0))
+
+  return x ** (1.0 / 3.0)
+
+#monotonic clock#########################################################
+#time.time() jumps when the BBB sets its clock from NTP, schedules use this instead
+
+class timespec(ctypes.Structure):
+  _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+CLOCK_MONOTONIC = 1 #from linux/time.h
+
+def _clock_gettime_monotonic():
+
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    clock_gettime = libc.clock_gettime
+  except (OSError, AttributeError):
+    return None
+
+  clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+
+  def monotonic():
+    now = timespec()
+    if clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)) != 0:
+      return time.time()
+    return now.tv_sec + now.tv_nsec * 1e-9
+
+  return monotonic
+
+monotonic = getattr(time, "monotonic", None) or _clock_gettime_monotonic() or time.time
+
+#oversampling############################################################
+#ADC_FILTERS are the ways a burst of reads can be combined into one reading:
+#  median   - middle value, ignores single spikes completely
+#  trimmed  - average after dropping the highest and lowest trim fraction
+#  decimate - average of all the reads, best for plain gaussian noise
+ADC_FILTERS = ["median", "trimmed", "decimate"]
+
+def read_filtered(backend, channel, samples=1, method="median", trim=0.25):
+
+  if samples <= 1:
+    return backend.read_adc(channel)
+
+  reads = [backend.read_adc(channel) for x in range(samples)]
+
+  return combine_samples(reads, method, trim)
+
+
+def combine_samples(reads, method="median", trim=0.25):
+
+  if method == "decimate":
+    return sum(reads) / float(len(reads))
+
+  reads = sorted(reads)
+  count = len(reads)
+
+  if method == "trimmed":
+    cut = int(count * trim)
+    if count - 2 * cut > 0:
+      reads = reads[cut:count - cut]
+    return sum(reads) / float(len(reads))
+
+  #median
+  if count % 2: return reads[count // 2]
+
+  return (reads[count // 2 - 1] + reads[count // 2]) / 2.0
+
+#pick a backend##########################################################
+def get_backend(name, r_bias, vdd_adc, t_a, t_b, t_c, speed=1.0):
+
+  if name == "sim":
+    return SimBackend(r_bias, vdd_adc, t_a, t_b, t_c, speed)
+
+  return BBIOBackend() #raises ImportError when the library is not installed
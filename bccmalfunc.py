@@ -0,0 +1,225 @@
+"""
+    bccmalfunc.py - heater and cooler malfunction detector for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+A RelayWatch looks at what the temperature does while its relay is on. Every
+reading is passed to update(), which keeps running least squares sums of the
+readings of the current on period, from lag seconds after the relay closed
+(element warm up, compressor spin up) - nothing is kept but the sums.
+
+  learning   - when the relay drops, the slope of the on period is added to
+               an exponentially weighted mean and variance of the response
+               of the earlier cycles ("the cooler takes 4.1 +/- 0.6 degrees
+               an hour off"). Cycles flagged as malfunctions are left out.
+  checking   - once window seconds of readings are in, the slope so far is
+               compared with what was learned: the relay is flagged when it
+               does less than fraction of the usual response and is sigmas
+               standard deviations below it. Before min_cycles cycles are
+               learned, only a relay that is surely not moving the
+               temperature its way at all is flagged.
+  early      - a relay that is losing ground (cooler on and the temperature
+               going up) is flagged straight away, without waiting for the
+               window, when the slope would take the temperature past limit
+               within horizon seconds - a failed compressor is caught before
+               the batch warms past the yeast's high temperature.
+
+A malfunction clears when the relay drops or when a new window shows the
+usual response again. Temperatures are Celsius, slopes degrees an hour.
+
+  python bccmalfunc.py - runs a simulated chamber whose cooler fails
+"""
+
+import math
+import sys
+
+class RelayWatch:
+
+  def __init__(self, name, direction, message, lag=3 * 60, window=5 * 60, sigmas=3.0, fraction=0.25, alpha=0.2,
+               min_cycles=3, horizon=30 * 60):
+
+    self.name = name #alarm name, "heater" or "cooler"
+    self.direction = direction #1 for a heater, -1 for a cooler
+    self.message = message
+    self.lag = lag
+    self.window = window
+    self.sigmas = sigmas
+    self.fraction = fraction
+    self.alpha = alpha #weight of the last cycle in the learned response
+    self.min_cycles = min_cycles
+    self.horizon = horizon
+
+    self.mean = 0.0 #learned response in degrees an hour, positive when the relay does its job
+    self.variance = 0.0
+    self.cycles = 0 #number of on periods learned
+
+    self.active = False
+    self.value = None #slope in degrees an hour when the alarm was raised or cleared
+    self.was_on = False
+    self.on_since = None
+    self.failed = False #this on period was flagged - don't learn from it
+    self.clear_sums(None)
+
+    return
+
+
+  def clear_sums(self, start):
+
+    self.start = start #time the sums start from
+    self.n = 0
+    self.sum_t = self.sum_tt = self.sum_y = self.sum_yy = self.sum_ty = 0.0
+
+    return
+
+
+  def add(self, now, temp):
+
+    t = now - self.start
+    self.n += 1
+    self.sum_t += t
+    self.sum_tt += t * t
+    self.sum_y += temp
+    self.sum_yy += temp * temp
+    self.sum_ty += t * temp
+
+    return
+
+
+  def fit(self):#(slope, standard error of the slope, seconds covered) in degrees an hour
+
+    if self.n < 3: return None
+
+    n = float(self.n)
+    stt = self.sum_tt - self.sum_t * self.sum_t / n
+    if stt <= 0: return None
+
+    sty = self.sum_ty - self.sum_t * self.sum_y / n
+    syy = self.sum_yy - self.sum_y * self.sum_y / n
+    slope = sty / stt
+    residual = max(syy - slope * sty, 0.0) / (n - 2)
+
+    return slope * 3600.0, math.sqrt(residual / stt) * 3600.0, math.sqrt(12.0 * stt / n) #span of evenly spaced readings
+
+
+  def update(self, now, temp, relay_on, limit=None):
+    #one reading, relay_on is the relay state since the reading before - limit is the temperature the
+    #relay is there to keep the batch away from (yeast high temp for the cooler) or None
+    #returns True if the malfunction was raised, False if it was cleared, None if nothing changed
+
+    if not relay_on:
+      if self.was_on: self.learn()
+      self.was_on = False
+      if self.active:
+        self.active = False
+        return False
+      return None
+
+    if not self.was_on:
+      self.was_on = True
+      self.on_since = now
+      self.failed = False
+      self.clear_sums(now + self.lag)
+
+    if now < self.start: return None
+
+    self.add(now, temp)
+    result = self.fit()
+    if result is None: return None
+    slope, error, span = result
+    progress = slope * self.direction #positive when the temperature goes the relay's way
+
+    if self.active:
+      if span >= self.window and progress >= self.threshold(error):
+        self.active = False
+        self.value = slope
+        return False
+      return None
+
+    failing = False
+    if span >= self.window and progress < self.threshold(error): failing = True
+    if progress + self.sigmas * error < 0 and limit is not None: #losing ground - how soon is limit reached
+      distance = (limit - temp) * -self.direction #still to go before limit
+      if distance <= 0 or distance < -progress * self.horizon / 3600.0: failing = True
+
+    if not failing: return None
+
+    self.active = True
+    self.failed = True
+    self.value = slope
+    self.clear_sums(now) #the next window decides whether it recovered
+
+    return True
+
+
+  def threshold(self, error):#least progress a working relay makes, error is the uncertainty of the slope
+
+    if self.cycles < self.min_cycles: return self.sigmas * error #anything surely better than nothing
+
+    spread = self.sigmas * math.sqrt(self.variance + error * error)
+
+    return min(self.mean - spread, self.mean * self.fraction)
+
+
+  def learn(self):#the relay dropped - add the on period to the learned response
+
+    result = self.fit()
+    if self.failed or result is None: return
+    slope, error, span = result
+    if span < self.window / 2.0: return #too short to say much
+
+    progress = slope * self.direction
+    if self.cycles == 0:
+      self.mean = progress
+      self.variance = error * error
+    else:
+      difference = progress - self.mean
+      self.mean += self.alpha * difference
+      self.variance = (1.0 - self.alpha) * (self.variance + self.alpha * difference * difference)
+    self.cycles += 1
+
+    return
+
+
+  def expected(self):#learned response in degrees an hour (signed like the slope), None before min_cycles
+
+    if self.cycles < self.min_cycles: return None
+
+    return self.mean * self.direction
+
+#demo#######################################################################
+if __name__ == "__main__":
+
+  import bcchw
+
+  chamber = bcchw.SimChamber(temp=20.0, ambient=26.0, cool_rate=0.002, noise=0.0)
+  cooler = RelayWatch("cooler", -1, "Cooler Not Cooling")
+  now = 0.0
+  fail_at = 12 * 3600.0
+  failed = None
+  while now < 16 * 3600:
+    if now >= fail_at: chamber.cool_rate = 0.0
+    chamber.step(15.0)
+    now += 15.0
+    relay_on = chamber.cooler_relay
+    if chamber.temp > 18.5: chamber.cooler_relay = True
+    if chamber.temp < 17.5: chamber.cooler_relay = False
+    if cooler.update(now, chamber.temp, relay_on, 21.0) and failed is None: failed = (now, chamber.temp)
+
+  print("learned response: " + str(round(cooler.mean, 2)) + " +/- " + str(round(math.sqrt(cooler.variance), 2)) +
+        " degrees an hour from " + str(cooler.cycles) + " cycles")
+  if failed is None:
+    print("cooler failure not detected")
+    sys.exit(1)
+  print("cooler failed after " + str(int(fail_at / 60)) + " minutes, flagged " + str(int((failed[0] - fail_at) / 60)) +
+        " minutes later at " + str(round(failed[1], 2)) + " C")
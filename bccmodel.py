@@ -0,0 +1,544 @@
+"""
+    bccmodel.py - fits the thermal model of a brew chamber to its database.csv rows
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+ModelFit works out the coefficients of the chamber model that mpc control
+(bcccontrol.ThermalModel) and the simulator (bcchw.SimChamber) run:
+
+  dT/dt = (ambient - T) / tau + heat_rate * h - cool_rate * c
+
+from the average temperature and the heater and cooler columns of the
+database.csv rows. h and c are the heater and cooler power, which follow
+their relay through a lag. The relays are taken as held from one row to
+the next, which is what the rows say with DATABASE_MODE change (a row for
+every relay switch). With a row every DATABASE_INTERVAL the relays switch
+between the rows unseen and the fit is worth nothing, so bcc.py only fits
+in change mode.
+
+For a given lag the average power of a relay between two rows is known, and
+with the average temperature of the two rows the step is linear in the
+unknowns:
+
+  T1 - T0 = hours * (ambient / tau - T / tau + heat_rate * h - cool_rate * c)
+
+The room temperature doesn't hold still for days, so it is an unknown of
+its own in every block of BLOCK seconds: the block's normal equations are
+worked out first, its ambient is eliminated from them and what is left
+(1 / tau, heat rate, cool rate) is added to the sums of the fit. Only those
+sums are kept (and saved), so new rows are added without going over the
+old ones again, and the sums fade with memory seconds so the fit follows
+the chamber. Every lag of LAGS has its own sums, the one with the smallest
+residual wins.
+
+A relay's rate is only fitted once it has been on for MIN_RELAY_HOURS, and
+tau only once the temperature has moved enough to tell it apart from the
+room temperature (a crash or a ramp - holding the target doesn't) - until
+then the MODEL_ setting is kept.
+
+Steps longer than max_gap (bcc.py was not running) are left out. The sums
+are worked out with numpy if it is installed.
+
+  python bccmodel.py <database.csv> [chamber name] [store directory] - fit the rows written since the
+                                                                       last run and save the model
+  python bccmodel.py --sim - fit the rows of a simulated chamber and compare with its coefficients
+"""
+
+import json
+import math
+import operator
+import os
+import sys
+import time
+
+import bccdb
+import bccstore
+
+try:
+  import numpy #optional - only used to add up the columns of many rows at once
+except ImportError:
+  numpy = None
+
+VERSION = 1
+LAGS = [0, 30, 60, 90, 120, 180, 300, 600] #relay lags tried, seconds
+MIN_RELAY_HOURS = 0.5 #hours a relay has to be on before its rate is fitted
+UNKNOWNS = 4 #ambient / tau, 1 / tau, heat rate, cool rate - degrees and hours
+BLOCK = 3 * 3600 #seconds the room temperature is taken as steady
+MAX_ERROR = 0.2 #largest standard error of 1 / tau, as a fraction of it, for tau to be fitted
+
+#what is saved besides the version and the lags
+STATE = ["sums", "blocks", "rooms", "block_start", "closed_at", "relay_hours", "last", "powers", "offsets", "fitted"]
+
+class ModelFit:
+
+  def __init__(self, filename=None, tau=3 * 3600, memory=14 * 86400, max_gap=30 * 60, lags=LAGS):
+
+    self.filename = filename #saved model, None to keep it in memory only
+    self.tau = tau #seconds, used until the rows tell tau
+    self.memory = memory #seconds for a row to fade to 37% of the weight of a new one
+    self.max_gap = max_gap
+    self.lags = list(lags)
+    self.clear()
+    if filename is not None and os.path.exists(filename): self.load()
+
+    return
+
+
+  def clear(self):#forget every row
+
+    self.sums = [new_sums(UNKNOWNS - 1) for lag in self.lags] #1 / tau, heat rate, cool rate of the blocks so far
+    self.blocks = [new_sums(UNKNOWNS) for lag in self.lags] #the block still open, with its ambient
+    self.rooms = [None for lag in self.lags] #the last block closed
+    self.block_start = None
+    self.closed_at = None #time the last block was closed
+    self.relay_hours = [0.0, 0.0] #weighted hours the heater and cooler were on
+    self.last = None #(time, temperature, heater on, cooler on) of the last row added
+    self.powers = [(0.0, 0.0) for lag in self.lags] #heater and cooler power at the last row for every lag
+    self.offsets = {} #csv filename: bytes read
+    self.fitted = None #the fitted coefficients, None until there are enough rows
+    self.behind = False #the last read() left rows to read
+
+    return
+
+
+  def load(self):
+
+    model_file = open(self.filename)
+    try:
+      data = json.load(model_file)
+    except ValueError:
+      return #damaged - fit again from the start
+    finally:
+      model_file.close()
+
+    if data.get("version") != VERSION or data.get("lags") != self.lags: return #fit again from the start
+
+    for name in STATE:
+      setattr(self, name, data[name])
+    if self.last is not None: self.last = tuple(self.last)
+    self.powers = [tuple(powers) for powers in self.powers]
+    self.offsets = dict([(str(name), offset) for name, offset in self.offsets.items()])
+
+    return
+
+
+  def save(self):
+
+    data = {"version": VERSION, "lags": self.lags}
+    for name in STATE:
+      data[name] = getattr(self, name)
+    bccdb.atomic_write(self.filename, json.dumps(data, sort_keys=True) + "\n", False)
+
+    return
+
+
+  def read(self, csv_filename, chamber_name, max_bytes=0):
+    #add the chamber's rows written to csv_filename since the last read and fit again - returns the steps added
+    #at most max_bytes (0 for all) of csv_filename are read, self.behind is True if there is more to read
+    #a file shorter than what was read was rotated (bccdb.py): the rest of csv_filename.1 is read first
+
+    offset = self.offsets.get(csv_filename, 0)
+    sources = []
+    if os.path.exists(csv_filename) and os.path.getsize(csv_filename) < offset:
+      sources.append((csv_filename + ".1", offset))
+      offset = 0
+    sources.append((csv_filename, offset))
+
+    rows = []
+    self.behind = False
+    for name, start in sources:
+      if not os.path.exists(name): continue
+      csv_file = open(name)
+      try:
+        csv_file.seek(start)
+        if name == csv_filename and max_bytes > 0:
+          text = csv_file.read(max_bytes)
+          self.behind = len(text) == max_bytes
+        else: text = csv_file.read()
+      finally:
+        csv_file.close()
+      text = text[:text.rfind("\n") + 1] #a line still being written is read next time
+      if name == csv_filename: self.offsets[csv_filename] = start + len(text)
+      for line in text.splitlines():
+        row = read_row(line, chamber_name)
+        if row is not None: rows.append(row)
+
+    added = self.add(rows)
+    self.fitted = self.solve()
+
+    return added
+
+
+  def add(self, rows):#(time, Celsius, heater on, cooler on) in time order - returns the steps added
+
+    if self.last is not None: rows = [row for row in rows if row[0] > self.last[0]]
+    if not rows: return 0
+
+    #the steps between the rows - lists of the same length
+    ends = [] #time the step ends
+    hours = []
+    changes = [] #temperature change
+    means = [] #average temperature
+    heaters = [] #relays held through the step
+    coolers = []
+    fresh = [] #first step after a gap - the relay powers start settled
+    previous = self.last
+    gap = previous is None
+    for row in rows:
+      if previous is None or row[0] - previous[0] > self.max_gap:
+        previous = row
+        gap = True
+        continue
+      if row[0] <= previous[0]: #same second - the later row has the state
+        previous = (previous[0],) + row[1:]
+        continue
+      ends.append(row[0])
+      hours.append((row[0] - previous[0]) / 3600.0)
+      changes.append(row[1] - previous[1])
+      means.append((row[1] + previous[1]) / 2.0)
+      heaters.append(1.0 if previous[2] else 0.0)
+      coolers.append(1.0 if previous[3] else 0.0)
+      fresh.append(gap)
+      gap = False
+      previous = row
+
+    #a block ends after BLOCK seconds or at a gap - steps[splits[n]] is the first step of a new block
+    splits = []
+    for index in range(len(ends)):
+      start = ends[index] - hours[index] * 3600.0
+      if self.block_start is None: self.block_start = start
+      elif fresh[index] or ends[index] - self.block_start > BLOCK:
+        splits.append(index)
+        self.block_start = start
+
+    column_a = hours
+    column_b = [-span * mean for span, mean in zip(hours, means)]
+    bounds = [0] + splits + [len(ends)]
+    for index in range(len(self.lags)):
+      heat, cool, self.powers[index] = relay_powers(self.lags[index], self.powers[index], hours, heaters, coolers,
+                                                    fresh)
+      columns = [column_a, column_b, [span * power for span, power in zip(hours, heat)],
+                 [-span * power for span, power in zip(hours, cool)]]
+      closed_at = self.closed_at
+      for part in range(len(bounds) - 1):
+        first, end = bounds[part], bounds[part + 1]
+        add_sums(self.blocks[index], [column[first:end] for column in columns], changes[first:end])
+        if part == len(bounds) - 2: break #still open
+        if closed_at is None: decay = 1.0
+        else: decay = math.exp(-(ends[end - 1] - closed_at) / float(self.memory))
+        closed_at = ends[end - 1]
+        self.rooms[index] = self.blocks[index]
+        close_block(self.blocks[index], self.sums[index], decay)
+        self.blocks[index] = new_sums(UNKNOWNS)
+
+    for part in range(len(bounds) - 2): #the relay hours fade the same way
+      first, end = bounds[part], bounds[part + 1]
+      if self.closed_at is None: decay = 1.0
+      else: decay = math.exp(-(ends[end - 1] - self.closed_at) / float(self.memory))
+      self.closed_at = ends[end - 1]
+      self.relay_hours = [self.relay_hours[0] * decay + dot(hours[first:end], heaters[first:end]),
+                          self.relay_hours[1] * decay + dot(hours[first:end], coolers[first:end])]
+
+    self.last = previous
+
+    return len(ends)
+
+
+  def solve(self):#the coefficients of the lag that fits best, None before there are enough steps
+
+    if self.sums[0]["steps"] < 10 * UNKNOWNS or self.rooms[0] is None: return None
+
+    used = [0] + [1 + relay for relay in (0, 1) if self.relay_hours[relay] > 0] #a relay that was on at all
+    best = None
+    for index in range(len(self.lags)):
+      sums = self.sums[index]
+      solution = fit_sums(sums, used)
+      tau_fitted = solution is not None and solution[0] > 0
+      if tau_fitted: #is 1 / tau known well enough
+        spread = residual(sums, used, solution) / max(sums["weight"] - len(used), 1.0)
+        inverse = solve_linear([[sums["xx"][row][column] for column in used] for row in used],
+                               [1.0] + [0.0] * (len(used) - 1)) #first column of the inverse - its variance
+        tau_fitted = spread * inverse[0] <= (MAX_ERROR * solution[0]) ** 2
+      if not tau_fitted: #hold 1 / tau where it is and fit the relays alone
+        rates = fit_sums(fix_first(sums, 3600.0 / self.tau), [row - 1 for row in used[1:]])
+        if rates is None: continue
+        solution = [3600.0 / self.tau] + rates
+      error = residual(sums, used, solution)
+      if best is None or error < best[0]: best = (error, index, dict(zip(used, solution)), tau_fitted)
+      if len(used) == 1: break #no relay to tell the lags apart
+
+    if best is None: return None
+    error, index, solution, tau_fitted = best
+
+    #the room temperature of the last block closed, with what was fitted
+    room = self.rooms[index]
+    rates = [solution.get(row, 0.0) for row in range(UNKNOWNS - 1)]
+    leak = room["xy"][0] - sum([room["xx"][0][row + 1] * rates[row] for row in range(UNKNOWNS - 1)])
+    leak /= room["xx"][0][0] #ambient / tau
+
+    fitted = {"tau": None, "ambient": leak / rates[0], "heat_rate": None, "cool_rate": None, "lag": None,
+              "rms": math.sqrt(max(error, 0.0) / self.sums[index]["weight"]), "steps": self.sums[index]["steps"],
+              "time": self.last[0]}
+    if tau_fitted: fitted["tau"] = 3600.0 / rates[0]
+    if rates[1] > 0 and self.relay_hours[0] >= MIN_RELAY_HOURS: fitted["heat_rate"] = rates[1]
+    if rates[2] > 0 and self.relay_hours[1] >= MIN_RELAY_HOURS: fitted["cool_rate"] = rates[2]
+    if len(used) > 1: fitted["lag"] = self.lags[index]
+
+    return fitted
+
+
+  def apply(self, model):#set what was fitted on a bcccontrol.ThermalModel - the rest is left as it is
+
+    if self.fitted is None: return
+
+    for name in ("tau", "heat_rate", "cool_rate", "lag"):
+      if self.fitted[name] is not None: setattr(model, name, self.fitted[name])
+
+    return
+
+
+  def sim_model(self):#what was fitted as bcchw.SimChamber arguments
+
+    if self.fitted is None: return {}
+
+    model = {"ambient": self.fitted["ambient"]}
+    if self.fitted["tau"] is not None: model["tau"] = self.fitted["tau"]
+    if self.fitted["heat_rate"] is not None: model["heat_rate"] = self.fitted["heat_rate"] / 3600.0
+    if self.fitted["cool_rate"] is not None: model["cool_rate"] = self.fitted["cool_rate"] / 3600.0
+    if self.fitted["lag"] is not None: model["lag"] = self.fitted["lag"]
+
+    return model
+
+
+def new_sums(size):#normal equations of size unknowns
+
+  return {"xx": [[0.0] * size for row in range(size)], "xy": [0.0] * size, "yy": 0.0, "weight": 0.0, "steps": 0}
+
+
+def add_sums(sums, columns, values):#add the rows of columns and values to the normal equations
+
+  size = len(columns)
+  for row in range(size):
+    for column in range(row, size):
+      sums["xx"][row][column] += dot(columns[row], columns[column])
+      sums["xx"][column][row] = sums["xx"][row][column]
+    sums["xy"][row] += dot(columns[row], values)
+  sums["yy"] += dot(values, values)
+  sums["weight"] += len(values)
+  sums["steps"] += len(values)
+
+  return
+
+
+def close_block(block, sums, decay):#eliminate the block's ambient (the first unknown) and add it to sums
+
+  pivot = block["xx"][0][0]
+  if pivot <= 0: return
+
+  size = len(sums["xy"])
+  for row in range(size):
+    for column in range(size):
+      eliminated = block["xx"][row + 1][column + 1] - block["xx"][row + 1][0] * block["xx"][0][column + 1] / pivot
+      sums["xx"][row][column] = sums["xx"][row][column] * decay + eliminated
+    sums["xy"][row] = sums["xy"][row] * decay + block["xy"][row + 1] - block["xx"][row + 1][0] * block["xy"][0] / pivot
+  sums["yy"] = sums["yy"] * decay + block["yy"] - block["xy"][0] * block["xy"][0] / pivot
+  sums["weight"] = sums["weight"] * decay + block["weight"] - 1.0 #one unknown less
+  sums["steps"] += block["steps"]
+
+  return
+
+
+def fix_first(sums, value):#the normal equations of the other unknowns with the first one held at value
+
+  size = len(sums["xy"])
+  fixed = new_sums(size - 1)
+  for row in range(1, size):
+    for column in range(1, size):
+      fixed["xx"][row - 1][column - 1] = sums["xx"][row][column]
+    fixed["xy"][row - 1] = sums["xy"][row] - sums["xx"][row][0] * value
+  fixed["yy"] = sums["yy"] - 2.0 * value * sums["xy"][0] + value * value * sums["xx"][0][0]
+  fixed["weight"] = sums["weight"]
+  fixed["steps"] = sums["steps"]
+
+  return fixed
+
+
+def fit_sums(sums, used):#least squares solution for the unknowns used, None if they can't be told apart
+
+  if not used: return []
+
+  return solve_linear([[sums["xx"][row][column] for column in used] for row in used], [sums["xy"][row] for row in used])
+
+
+def model_filename(directory, chamber_name):#saved model of a chamber - Chamber 2 is chamber-2.model.json
+
+  return bccstore.store_filename(directory, chamber_name)[:-4] + ".model.json"
+
+
+def read_row(line, chamber_name):#(time, Celsius, heater on, cooler on) of a chamber's status row or None
+
+  fields = line.rstrip("\r\n").split(",")
+  if len(fields) == 19 and fields[18].strip() != chamber_name: return None #another chamber's - not worth parsing
+
+  row = bccstore.parse_database_row(fields)
+  if row is None: return None
+
+  when, values, name = row
+  if name != chamber_name: return None
+  if values["avg"] == 0 and values["min"] == 0 and values["max"] == 0: return None #no reading yet at startup
+
+  temp = values["avg"]
+  if not values["celsius"]: temp = (temp - 32.0) * 5.0 / 9.0
+
+  return when, temp, values["heater"], values["cooler"]
+
+
+def dot(a, b):
+
+  if numpy is not None: return float(numpy.dot(a, b))
+
+  return sum(map(operator.mul, a, b))
+
+
+def relay_powers(lag, powers, hours, heaters, coolers, fresh):
+  #average heater and cooler power of every step and the (heater, cooler) power after the last one
+
+  if lag <= 0:
+    if not hours: return heaters, coolers, powers
+    return heaters, coolers, (heaters[-1], coolers[-1])
+
+  heat, cool = powers
+  heat_means = []
+  cool_means = []
+  for span, heater, cooler, settled in zip(hours, heaters, coolers, fresh):
+    if settled or (abs(heat - heater) < 1e-6 and abs(cool - cooler) < 1e-6): #nothing left to follow
+      heat, cool = heater, cooler
+      heat_means.append(heater)
+      cool_means.append(cooler)
+      continue
+    e_lag = math.exp(-span * 3600.0 / lag)
+    part = lag * (1.0 - e_lag) / (span * 3600.0) #of the start power left on average
+    heat_means.append(heater + (heat - heater) * part)
+    cool_means.append(cooler + (cool - cooler) * part)
+    heat = heater + (heat - heater) * e_lag
+    cool = cooler + (cool - cooler) * e_lag
+
+  return heat_means, cool_means, (heat, cool)
+
+
+def residual(sums, used, solution):#sum of the squared errors left with solution for the unknowns used
+
+  total = sums["yy"]
+  for value, row in zip(solution, used):
+    total -= 2.0 * value * sums["xy"][row]
+    for other, column in zip(solution, used):
+      total += value * other * sums["xx"][row][column]
+
+  return total
+
+
+def solve_linear(matrix, vector):#Gaussian elimination with partial pivoting, None if singular
+
+  size = len(vector)
+  rows = [list(matrix[row]) + [vector[row]] for row in range(size)]
+  scale = max([abs(rows[row][row]) for row in range(size)] + [1e-300])
+
+  for column in range(size):
+    pivot = max(range(column, size), key=lambda row: abs(rows[row][column]))
+    if abs(rows[pivot][column]) <= scale * 1e-12: return None
+    rows[column], rows[pivot] = rows[pivot], rows[column]
+    for row in range(column + 1, size):
+      factor = rows[row][column] / rows[column][column]
+      for index in range(column, size + 1):
+        rows[row][index] -= factor * rows[column][index]
+
+  solution = [0.0] * size
+  for row in range(size - 1, -1, -1):
+    total = rows[row][size] - sum([rows[row][index] * solution[index] for index in range(row + 1, size)])
+    solution[row] = total / rows[row][row]
+
+  return solution
+
+
+def describe(fitted):#one line of what was fitted
+
+  if fitted is None: return "not enough rows to fit the model yet"
+
+  if fitted["tau"] is None: line = "tau not fitted"
+  else: line = "tau " + str(round(fitted["tau"] / 3600.0, 2)) + " h"
+  line += ", room " + str(round(fitted["ambient"], 1)) + " C"
+  for name, label in (("heat_rate", "heater"), ("cool_rate", "cooler")):
+    if fitted[name] is None: line += ", " + label + " not fitted"
+    else: line += ", " + label + " " + str(round(fitted[name], 2)) + " C/h"
+  if fitted["lag"] is not None: line += ", lag " + str(fitted["lag"]) + " s"
+
+  return line + ", rms " + str(round(fitted["rms"], 3)) + " C over " + str(fitted["steps"]) + " steps"
+
+#command line################################################################
+if __name__ == "__main__":
+
+  if sys.argv[1:2] == ["--sim"]:
+    import bcchw
+    import random
+
+    #a week of a simulated chamber in a room that swings 6C every day: 18C, a rest at 21C from day 3, a crash to 2C
+    #from day 5 - a row whenever a relay switches and at least every minute
+    chamber = bcchw.SimChamber(temp=18.0, ambient=20.0, tau=4.0 * 3600, heat_rate=0.004, cool_rate=0.007, lag=60.0,
+                               noise=0.0)
+    noise = random.Random(1)
+    rows = []
+    now = time.time() - 7 * 86400
+    last_row = None
+    for step in range(7 * 86400 // 15):
+      elapsed = step * 15.0
+      chamber.ambient = 20.0 + 3.0 * math.sin(2 * math.pi * elapsed / 86400)
+      target = 18.0
+      if elapsed >= 3 * 86400: target = 21.0
+      if elapsed >= 5 * 86400: target = 2.0
+      chamber.step(15.0)
+      now += 15.0
+      relays = (chamber.heater_relay, chamber.cooler_relay)
+      chamber.heater_relay = chamber.temp < target - 0.4 or (relays[0] and chamber.temp < target)
+      chamber.cooler_relay = chamber.temp > target + 0.4 or (relays[1] and chamber.temp > target)
+      if last_row is None or now - last_row >= 60 or relays != (chamber.heater_relay, chamber.cooler_relay):
+        rows.append((int(now), chamber.temp + noise.gauss(0.0, 0.01), chamber.heater_relay, chamber.cooler_relay))
+        last_row = now
+
+    fit = ModelFit()
+    started = time.time()
+    fit.add(rows)
+    fit.fitted = fit.solve()
+    print("fitted " + str(len(rows)) + " rows in " + str(round(time.time() - started, 3)) + " s")
+    print("real:   tau 4.0 h, room 17.0 - 23.0 C, heater 14.4 C/h, cooler 25.2 C/h, lag 60 s")
+    print("fitted: " + describe(fit.fitted))
+    sys.exit(0)
+
+  if len(sys.argv) < 2:
+    print("usage: python bccmodel.py <database.csv> [chamber name] [store directory]")
+    print("       python bccmodel.py --sim")
+    sys.exit(1)
+
+  csv_filename = sys.argv[1]
+  chamber_name = "Chamber 1"
+  if len(sys.argv) > 2: chamber_name = sys.argv[2]
+  directory = "store"
+  if len(sys.argv) > 3: directory = sys.argv[3]
+
+  if not os.path.isdir(directory): os.makedirs(directory)
+  fit = ModelFit(model_filename(directory, chamber_name))
+  started = time.time()
+  added = fit.read(csv_filename, chamber_name)
+  fit.save()
+  print(str(added) + " new steps fitted in " + str(round(time.time() - started, 3)) + " s - " + fit.filename)
+  print(describe(fit.fitted))
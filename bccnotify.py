@@ -0,0 +1,337 @@
+"""
+    bccnotify.py - alarm notifications for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Dispatcher sends alarm messages from a thread of its own, so a slow or
+unreachable server never holds up the temperature control:
+
+  notify(key, message) - puts the message in a queue of at most queue_size
+                         and returns straight away. key names the alarm
+                         ("Chamber 1 high"): a message is dropped if one for
+                         the same key went out less than rate_limit seconds
+                         ago, or the same message is still waiting.
+  worker thread        - sends the message with every transport. A transport
+                         that fails is tried again after backoff seconds,
+                         doubled every time up to max_backoff, at most
+                         retries times.
+  on_result            - called from the worker thread after every try with
+                         (notification, transport name, ok, error text)
+
+Transports (make_transports() builds them from a "http,file" list):
+
+  http   - form POST, textbelt.com by default (number, message)
+  email  - plain text mail through an SMTP server
+  file   - appends a line to a file - for testing and for a log of the alarms
+  socket - sends a UDP datagram - for testing or a local listener
+"""
+
+import heapq
+import itertools
+import smtplib
+import socket
+import threading
+import time
+
+try:
+  from urllib import urlencode #python 2
+  from urllib2 import urlopen
+except ImportError:
+  from urllib.parse import urlencode
+  from urllib.request import urlopen
+
+from email.mime.text import MIMEText
+
+class Notification:
+
+  def __init__(self, key, message, chamber=None):
+
+    self.key = key
+    self.message = message
+    self.chamber = chamber #name of the chamber the alarm is for
+    self.created = time.time()
+    self.attempts = {} #transport name: tries so far
+
+    return
+
+
+class Dispatcher:
+
+  def __init__(self, transports, queue_size=20, rate_limit=60 * 60, retries=5, backoff=30, max_backoff=60 * 60,
+               on_result=None):
+
+    self.transports = transports
+    self.queue_size = queue_size
+    self.rate_limit = rate_limit #seconds between messages of one key
+    self.retries = retries
+    self.backoff = backoff
+    self.max_backoff = max_backoff
+    self.on_result = on_result
+
+    self.queue = [] #heap of (due time, sequence, notification, transport names)
+    self.sequence = itertools.count()
+    self.sent = {} #key: time the last message for it was queued
+    self.dropped = 0 #messages dropped because the queue was full
+    self.lock = threading.Condition()
+    self.closed = False
+    self.busy = False #True while the worker is sending
+
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+    return
+
+
+  def notify(self, key, message, chamber=None, rate_limit=None):#returns True if the message was queued - never blocks
+
+    if rate_limit is None: rate_limit = self.rate_limit
+    now = time.time()
+
+    self.lock.acquire()
+    try:
+      if self.closed or not self.transports: return False
+      if now - self.sent.get(key, -rate_limit) < rate_limit: return False
+      for entry in self.queue:
+        if entry[2].message == message: return False #same message is still waiting
+      if len(self.queue) >= self.queue_size:
+        self.dropped += 1
+        return False
+
+      notification = Notification(key, message, chamber)
+      heapq.heappush(self.queue, (now, next(self.sequence), notification, [transport.name for transport in self.transports]))
+      self.sent[key] = now
+      self.lock.notify()
+    finally:
+      self.lock.release()
+
+    return True
+
+
+  def run(self):#worker thread
+
+    while True:
+      self.lock.acquire()
+      try:
+        while not self.closed and (not self.queue or self.queue[0][0] > time.time()):
+          if self.queue: self.lock.wait(self.queue[0][0] - time.time())
+          else: self.lock.wait()
+        if self.closed: return
+        due, sequence, notification, names = heapq.heappop(self.queue)
+        self.busy = True
+      finally:
+        self.lock.release()
+
+      try:
+        self.send(notification, names)
+      finally:
+        self.busy = False
+
+    return
+
+
+  def send(self, notification, names):
+
+    failed = []
+    for transport in self.transports:
+      if transport.name not in names: continue
+      tries = notification.attempts.get(transport.name, 0) + 1
+      notification.attempts[transport.name] = tries
+      try:
+        transport.send(notification)
+        error = None
+      except Exception as exception: #whatever the network or the server does, the worker keeps going
+        error = str(exception) or exception.__class__.__name__
+        if tries < self.retries: failed.append(transport.name)
+      if self.on_result is not None:
+        try:
+          self.on_result(notification, transport.name, error is None, error)
+        except Exception:
+          pass
+
+    if failed:
+      tries = max([notification.attempts[name] for name in failed])
+      delay = min(self.backoff * 2 ** (tries - 1), self.max_backoff)
+      self.lock.acquire()
+      try:
+        if not self.closed:
+          heapq.heappush(self.queue, (time.time() + delay, next(self.sequence), notification, failed))
+      finally:
+        self.lock.release()
+
+    return
+
+
+  def flush(self, timeout=5):#send what is due now - waits at most timeout seconds
+
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+      self.lock.acquire()
+      try:
+        if not self.busy and (not self.queue or self.queue[0][0] > time.time()): return
+      finally:
+        self.lock.release()
+      time.sleep(0.05)
+
+    return
+
+
+  def close(self, timeout=5):#give messages due now timeout seconds to go out, then stop the worker
+
+    self.flush(timeout)
+
+    self.lock.acquire()
+    try:
+      self.closed = True
+      self.lock.notify()
+    finally:
+      self.lock.release()
+
+    self.thread.join(timeout)
+
+    return
+
+#transports#################################################################
+class HttpTransport:
+
+  name = "http"
+
+  def __init__(self, url, fields, message_field="message", timeout=20):
+
+    self.url = url
+    self.fields = fields #sent with every message - the cell number for textbelt
+    self.message_field = message_field
+    self.timeout = timeout
+
+    return
+
+
+  def send(self, notification):
+
+    fields = dict(self.fields)
+    fields[self.message_field] = notification.message
+    response = urlopen(self.url, urlencode(fields).encode("ascii"), self.timeout)
+    try:
+      status = response.getcode()
+      body = response.read()
+    finally:
+      response.close()
+
+    if status is not None and status >= 400: raise IOError("HTTP " + str(status))
+    if b'"success":false' in body.replace(b" ", b""): raise IOError(body.decode("utf-8", "replace").strip())
+
+    return
+
+
+class EmailTransport:
+
+  name = "email"
+
+  def __init__(self, host, sender, recipients, timeout=20):
+
+    self.host = host #host or host:port
+    self.sender = sender
+    self.recipients = recipients
+    self.timeout = timeout
+
+    return
+
+
+  def send(self, notification):
+
+    mail = MIMEText(notification.message)
+    mail["Subject"] = notification.message
+    mail["From"] = self.sender
+    mail["To"] = ", ".join(self.recipients)
+
+    server = smtplib.SMTP(self.host, timeout=self.timeout)
+    try:
+      server.sendmail(self.sender, self.recipients, mail.as_string())
+    finally:
+      server.quit()
+
+    return
+
+
+class FileTransport:
+
+  name = "file"
+
+  def __init__(self, filename):
+
+    self.filename = filename
+
+    return
+
+
+  def send(self, notification):
+
+    notify_file = open(self.filename, "a")
+    try:
+      notify_file.write(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(notification.created)) + " " +
+                        notification.key + ": " + notification.message + "\n")
+    finally:
+      notify_file.close()
+
+    return
+
+
+class SocketTransport:
+
+  name = "socket"
+
+  def __init__(self, address):
+
+    host, port = address.rsplit(":", 1)
+    self.address = (host, int(port))
+
+    return
+
+
+  def send(self, notification):
+
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+      sender.sendto((notification.key + ": " + notification.message).encode("utf-8"), self.address)
+    finally:
+      sender.close()
+
+    return
+
+
+def make_transports(names, url="http://textbelt.com/text", number="", smtp_host="localhost", email_from="",
+                    email_to="", filename="notify.log", address="127.0.0.1:5005"):
+  #names: comma separated list of transports - returns (transports, problems)
+
+  transports = []
+  problems = []
+
+  for name in [name.strip() for name in names.split(",") if name.strip()]:
+    if name == "http":
+      transports.append(HttpTransport(url, {"number": number}))
+    elif name == "email":
+      recipients = [recipient.strip() for recipient in email_to.split(",") if recipient.strip()]
+      if recipients: transports.append(EmailTransport(smtp_host, email_from or recipients[0], recipients))
+      else: problems.append("email needs NOTIFY_EMAIL_TO")
+    elif name == "file":
+      transports.append(FileTransport(filename))
+    elif name == "socket":
+      try:
+        transports.append(SocketTransport(address))
+      except ValueError:
+        problems.append("socket needs NOTIFY_SOCKET as host:port")
+    else:
+      problems.append("unknown transport " + repr(name))
+
+  return transports, problems
@@ -0,0 +1,367 @@
+"""
+    bccrollup.py - multi resolution history for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Rollup keeps the history of one chamber at four resolutions:
+
+  raw    - every reading (moving average temp, heater, cooler, alarm, setpoints), last RAW_KEEP seconds
+  60     - 1 minute buckets, last 7 days
+  900    - 15 minute buckets, last 90 days
+  3600   - hourly buckets, last 3 years
+
+Every reading is added to the open bucket of every resolution, a bucket is
+written out once a reading arrives for the next one. A bucket row is:
+
+  start time, readings, mean temp, min temp, max temp, heater duty, cooler duty, alarms,
+  desired temp, low alarm, high alarm
+
+(duty is the fraction of readings the relay was on, alarms counts the times
+an alarm was raised, the setpoints are the last ones of the bucket - empty in
+rows written before they were kept). Temperatures are Celsius.
+
+Every resolution has its own file in the rollup directory. Lines are
+appended in batches by flush(); once a file holds a quarter more lines than
+it keeps, it is written again with only the lines kept, so the files never
+grow past 1.25 times their retention. close() writes the open buckets too;
+they are opened again by the next start, so a restart loses no readings.
+
+query(start, end) picks the finest resolution that still covers start and
+gives at most max_points rows - a few hours come from the raw readings, a
+multi week lager from the hourly buckets. bcc.py draws the brew session
+charts from it, a chart of 800 columns never reads more than 800 rows.
+
+  python bccrollup.py <rollup directory> <chamber number> <hours> - print the last hours
+"""
+
+import os
+import sys
+import time
+
+from collections import deque
+
+import bccdb
+
+RAW_KEEP = 2 * 86400 #seconds of raw readings kept
+
+#bucket seconds: seconds of buckets kept
+LEVELS = [(60, 7 * 86400), (900, 90 * 86400), (3600, 3 * 365 * 86400)]
+
+NO_SETPOINTS = (None, None, None)
+RAW_FIELDS = 8 #fields of a raw row
+BUCKET_FIELDS = 11 #fields of a bucket row
+
+class Bucket:
+
+  def __init__(self, start):
+
+    self.start = start
+    self.count = 0
+    self.total = 0.0
+    self.low = None
+    self.high = None
+    self.heater = 0
+    self.cooler = 0
+    self.alarms = 0
+    self.setpoints = NO_SETPOINTS #desired temp, low alarm, high alarm
+    self.written = False #the row is in the file as it is - a bucket opened again after a restart
+
+    return
+
+
+  def add(self, temp, heater_on, cooler_on, alarm_raised, setpoints):
+
+    self.count += 1
+    self.total += temp
+    if self.low is None or temp < self.low: self.low = temp
+    if self.high is None or temp > self.high: self.high = temp
+    if heater_on: self.heater += 1
+    if cooler_on: self.cooler += 1
+    if alarm_raised: self.alarms += 1
+    self.setpoints = tuple(setpoints)
+    self.written = False
+
+    return
+
+
+  def row(self):#(start, readings, mean, min, max, heater duty, cooler duty, alarms, desired, low alarm, high alarm)
+
+    return (self.start, self.count, self.total / self.count, self.low, self.high,
+            self.heater / float(self.count), self.cooler / float(self.count), self.alarms) + self.setpoints
+
+
+def open_bucket(row):#a bucket row read back as the open bucket
+
+  bucket = Bucket(row[0])
+  bucket.count = row[1]
+  bucket.total = row[2] * row[1]
+  bucket.low = row[3]
+  bucket.high = row[4]
+  bucket.heater = int(round(row[5] * row[1]))
+  bucket.cooler = int(round(row[6] * row[1]))
+  bucket.alarms = row[7]
+  bucket.setpoints = tuple(row[8:11])
+  bucket.written = True
+
+  return bucket
+
+
+class Level:
+
+  def __init__(self, filename, seconds, keep):
+
+    self.filename = filename
+    self.seconds = seconds #bucket size, 0 for raw readings
+    self.keep = keep #seconds of history kept
+    self.rows = deque() #rows kept, oldest first
+    self.pending = [] #rows not written to the file yet
+    self.file_lines = 0 #lines in the file
+    self.bucket = None #open bucket
+
+    return
+
+
+  def load(self):
+
+    if not os.path.exists(self.filename): return
+
+    if self.seconds == 0: fields = RAW_FIELDS
+    else: fields = BUCKET_FIELDS
+
+    level_file = open(self.filename)
+    try:
+      for line in level_file:
+        try:
+          row = parse_row(line)
+        except (ValueError, IndexError):
+          continue #half written line after a power cut
+        self.file_lines += 1
+        row += (None,) * (fields - len(row)) #written before the setpoints were kept
+        if self.seconds and self.rows and self.rows[-1][0] == row[0]:
+          self.rows[-1] = row #an open bucket written on exit, then finished
+        else:
+          self.rows.append(row)
+    finally:
+      level_file.close()
+
+    if not self.rows: return
+    self.trim(self.rows[-1][0])
+    if self.seconds: self.bucket = open_bucket(self.rows.pop()) #readings for it may still come
+
+    return
+
+
+  def append(self, row):
+
+    self.rows.append(row)
+    self.pending.append(row)
+    self.trim(row[0])
+
+    return
+
+
+  def finish(self):#the open bucket is done - a bucket that is already in the file is only kept
+
+    if self.bucket.written: self.rows.append(self.bucket.row())
+    else: self.append(self.bucket.row())
+    self.bucket = None
+
+    return
+
+
+  def trim(self, now):
+
+    while self.rows and self.rows[0][0] < now - self.keep:
+      self.rows.popleft()
+
+    return
+
+
+  def flush(self):
+
+    if not self.pending: return
+
+    if self.file_lines + len(self.pending) > 1.25 * max(len(self.rows), 1):
+      #too much history in the file - write it again with just what is kept
+      bccdb.atomic_write(self.filename, "".join([format_row(row) for row in self.rows]))
+      self.file_lines = len(self.rows)
+    else:
+      level_file = open(self.filename, "a")
+      try:
+        level_file.write("".join([format_row(row) for row in self.pending]))
+      finally:
+        level_file.close()
+      self.file_lines += len(self.pending)
+
+    self.pending = []
+
+    return
+
+
+class Rollup:
+
+  def __init__(self, directory, name, raw_keep=RAW_KEEP, levels=LEVELS):
+
+    self.directory = directory
+    self.name = name #file names start with this
+    self.alarm = False #alarm state of the last reading
+
+    if not os.path.isdir(directory): os.makedirs(directory)
+
+    self.raw = Level(self.filename("raw"), 0, raw_keep)
+    self.levels = [Level(self.filename(str(seconds)), seconds, keep) for seconds, keep in levels]
+
+    for level in [self.raw] + self.levels:
+      level.load()
+
+    return
+
+
+  def filename(self, level):
+
+    return os.path.join(self.directory, self.name + "-" + level + ".csv")
+
+
+  def add(self, when, temp, heater_on, cooler_on, alarm, setpoints=NO_SETPOINTS):
+    #one reading - temp and setpoints (desired temp, low alarm, high alarm) in Celsius
+
+    alarm_raised = alarm and not self.alarm
+    self.alarm = alarm
+
+    self.raw.append((when, temp, int(bool(heater_on)), int(bool(cooler_on)), int(bool(alarm))) + tuple(setpoints))
+
+    for level in self.levels:
+      start = when - when % level.seconds
+      if level.bucket is not None and level.bucket.start != start:
+        level.finish() #reading for the next bucket - this one is done
+      if level.bucket is None:
+        level.bucket = Bucket(start)
+      level.bucket.add(temp, heater_on, cooler_on, alarm_raised, setpoints)
+
+    return
+
+
+  def flush(self):#write the rows waiting in memory
+
+    for level in [self.raw] + self.levels:
+      level.flush()
+
+    return
+
+
+  def close(self):#write everything, the open buckets too - load() opens them again
+
+    for level in self.levels:
+      if level.bucket is not None and not level.bucket.written:
+        level.append(level.bucket.row())
+        level.bucket.written = True
+    self.flush()
+
+    return
+
+
+  def first_time(self):#time of the oldest row kept, None without history
+
+    times = [level.rows[0][0] for level in [self.raw] + self.levels if level.rows]
+    times += [level.bucket.start for level in self.levels if level.bucket is not None]
+    if not times: return None
+
+    return min(times)
+
+
+  def choose(self, start, end, max_points=800):#finest level covering start with no more than max_points rows
+
+    for level in [self.raw] + self.levels:
+      if level.rows and level.rows[0][0] > start and level is not self.levels[-1]:
+        continue #doesn't go back far enough
+      if level.seconds == 0:
+        points = count_between(level.rows, start, end)
+      else:
+        points = (end - start) / level.seconds
+      if points <= max_points: return level
+
+    return self.levels[-1]
+
+
+  def query(self, start, end=None, max_points=800):
+    #rows from start to end - raw readings (time, temp, heater, cooler, alarm, desired, low alarm, high alarm) or
+    #buckets (start, readings, mean, min, max, heater duty, cooler duty, alarms, desired, low alarm, high alarm)
+    #returns (bucket seconds - 0 for raw, rows)
+
+    if end is None: end = time.time()
+
+    level = self.choose(start, end, max_points)
+    rows = [row for row in level.rows if start <= row[0] <= end]
+    if level.bucket is not None and start <= level.bucket.start <= end:
+      rows.append(level.bucket.row()) #the bucket still filling up
+
+    return level.seconds, rows
+
+
+def count_between(rows, start, end):
+
+  count = 0
+  for row in reversed(rows):
+    if row[0] < start: break
+    if row[0] <= end: count += 1
+
+  return count
+
+
+def format_row(row):
+
+  return ",".join([format_value(value) for value in row]) + "\n"
+
+
+def format_value(value):
+
+  if value is None: return ""
+  if isinstance(value, float): return repr(round(value, 4))
+
+  return str(value)
+
+
+def parse_row(line):
+
+  fields = line.strip().split(",")
+  if len(fields) not in (5, RAW_FIELDS, BUCKET_FIELDS): raise ValueError("not a rollup row")
+
+  return tuple([float(fields[0])] + [parse_value(field) for field in fields[1:]])
+
+
+def parse_value(field):
+
+  if not field: return None
+  if "." in field or "e" in field: return float(field)
+
+  return int(field)
+
+#report#####################################################################
+if __name__ == "__main__":
+
+  if len(sys.argv) != 4:
+    print("usage: python bccrollup.py <rollup directory> <chamber number> <hours>")
+    sys.exit(1)
+
+  rollup = Rollup(sys.argv[1], "chamber" + sys.argv[2])
+  seconds, rows = rollup.query(time.time() - float(sys.argv[3]) * 3600)
+
+  if seconds == 0:
+    print("raw readings: time, temp C, heater, cooler, alarm, desired C, low alarm C, high alarm C")
+  else:
+    print(str(seconds) + " second buckets: start, readings, mean C, min C, max C, heater duty, cooler duty, alarms, " +
+          "desired C, low alarm C, high alarm C")
+
+  for row in rows:
+    print(time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(row[0])) + "," + format_row(row[1:]).strip())
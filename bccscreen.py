@@ -0,0 +1,270 @@
+"""
+    bccscreen.py - flicker free screen updates for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Screen stands in for sys.stdout. bcc.py keeps printing its escape codes
+(cursor moves, clear screen, clear line, colours) but they only change a
+copy of the screen kept in memory. render() compares that copy with what
+was sent to the terminal last time and sends just the characters that
+changed, so a redraw of the whole screen where only the time and one
+temperature changed costs a few dozen bytes instead of a few thousand,
+and the screen never blanks.
+
+Only the escape codes bcc.py uses are understood:
+  ESC[r;cH  move the cursor     ESC[2J  clear the screen
+  ESC[K     clear to end of line ESC[nm  colour (30-37, 90-97, 39 and 0)
+"""
+
+import re
+import time
+
+ESCAPE = re.compile("\033\\[([0-9;]*)([A-Za-z])")
+BLANK = (" ", None) #cell: (character, colour code or None)
+
+class Screen:
+
+  def __init__(self, out, rows=60, cols=160, min_interval=0.25, clock=time.time):
+
+    self.out = out #the real terminal
+    self.rows = rows
+    self.cols = cols
+    self.min_interval = min_interval #rate cap - seconds between renders
+    self.clock = clock
+
+    self.cells = [[BLANK] * cols for x in range(rows)] #what the screen should look like
+    self.shown = None #what the terminal shows - None means unknown, paint everything
+    self.stale_rows = set() #rows the terminal may show differently (typing echo)
+
+    self.row = 0 #cursor
+    self.col = 0
+    self.colour = None
+    self.cursor_shown = (0, 0) #where the real cursor was left
+
+    self.softspace = 0 #needed by the print statement
+    self.dirty = False
+    self.last_render = 0
+    self.bytes_sent = 0 #for measuring
+
+    return
+
+#file methods used by print######################################
+  def write(self, text):
+
+    pos = 0
+    for match in ESCAPE.finditer(text):
+      if match.start() > pos: self.put_text(text[pos:match.start()])
+      self.escape(match.group(1), match.group(2))
+      pos = match.end()
+
+    if pos < len(text): self.put_text(text[pos:])
+
+    self.dirty = True
+
+    return
+
+
+  def flush(self):#send the changes now - used when somebody is waiting for a prompt
+
+    self.render(True)
+
+    return
+
+
+  def put_text(self, text):
+
+    for line in text.split("\n")[:-1]: #every newline moves to the start of the next row
+      self.put_line(line)
+      self.row += 1
+      self.col = 0
+
+    self.put_line(text[text.rfind("\n") + 1:])
+
+    return
+
+
+  def put_line(self, text):
+
+    if not text or self.row >= self.rows or self.col >= self.cols:
+      self.col += len(text)
+      return
+
+    text = text[:self.cols - self.col]
+    self.cells[self.row][self.col:self.col + len(text)] = [(char, self.colour) for char in text]
+    self.col += len(text)
+
+    return
+
+
+  def escape(self, params, command):
+
+    if command == "H": #cursor position - 1 based, 0 is taken as 1 like a terminal does
+      numbers = (params.split(";") + ["", ""])[:2]
+      self.row = max(int(numbers[0] or 1), 1) - 1
+      self.col = max(int(numbers[1] or 1), 1) - 1
+
+    elif command == "J" and params == "2": #clear screen
+      self.cells = [[BLANK] * self.cols for x in range(self.rows)]
+
+    elif command == "K" and self.row < self.rows: #clear line
+      row = self.cells[self.row]
+      if params in ("", "0"): row[self.col:] = [BLANK] * (self.cols - min(self.col, self.cols))
+      elif params == "1": row[:self.col + 1] = [BLANK] * min(self.col + 1, self.cols)
+      elif params == "2": self.cells[self.row] = [BLANK] * self.cols
+
+    elif command == "m": #colour
+      for code in params.split(";"):
+        if code in ("", "0", "39"): self.colour = None
+        elif code.isdigit() and (30 <= int(code) <= 37 or 90 <= int(code) <= 97): self.colour = code
+
+    return
+
+#terminal updates################################################
+  def invalidate(self):#paint the whole screen next time - something else wrote on the terminal
+
+    self.shown = None
+    self.dirty = True
+
+    return
+
+
+  def input_echoed(self):#the terminal echoed a typed line where the cursor was - repaint those rows
+
+    row = self.cursor_shown[0]
+    self.stale_rows.add(row)
+    self.stale_rows.add(row + 1)
+    self.dirty = True
+
+    return
+
+
+  def due(self):#when the next render is allowed, None if there is nothing to send
+
+    if not self.dirty: return None
+
+    return self.last_render + self.min_interval
+
+
+  def render(self, force=False):#send what changed to the terminal - returns False if held back by the rate cap
+
+    if not self.dirty: return True
+
+    now = self.clock()
+    if not force and now - self.last_render < self.min_interval: return False
+
+    output = []
+    colour = [None] #colour the terminal is set to
+
+    if self.shown is None:
+      output.append("\033[0m\033[2J")
+      self.shown = [[BLANK] * self.cols for x in range(self.rows)]
+      self.stale_rows = set()
+
+    for r in range(self.rows):
+      new = self.cells[r]
+      old = self.shown[r]
+      stale = r in self.stale_rows
+
+      if new == old and not stale: continue
+
+      end_new = last_used(new)
+
+      if stale:
+        self.move(output, r, 0)
+        self.send(output, colour, new, 0, end_new)
+        output.append("\033[K")
+      else:
+        for start, end in changed_runs(new, old, end_new):
+          self.move(output, r, start)
+          self.send(output, colour, new, start, end)
+
+        if last_used(old) > end_new: #old text past the end of the new line
+          self.move(output, r, end_new)
+          self.set_colour(output, colour, None)
+          output.append("\033[K")
+
+      self.shown[r] = new[:]
+
+    self.stale_rows = set()
+
+    #leave the real cursor and colour where the program left them (after a prompt)
+    self.set_colour(output, colour, self.colour)
+    self.move(output, min(self.row, self.rows - 1), self.col)
+    self.cursor_shown = (self.row, self.col)
+
+    text = "".join(output)
+    self.out.write(text)
+    self.out.flush()
+
+    self.bytes_sent += len(text)
+    self.last_render = now
+    self.dirty = False
+
+    return True
+
+
+  def move(self, output, row, col):
+
+    output.append("\033[%d;%dH" % (row + 1, col + 1))
+
+    return
+
+
+  def set_colour(self, output, colour, code):
+
+    if colour[0] != code:
+      if code is None: output.append("\033[0m")
+      else: output.append("\033[" + code + "m")
+      colour[0] = code
+
+    return
+
+
+  def send(self, output, colour, row, start, end):
+
+    for char, code in row[start:end]:
+      self.set_colour(output, colour, code)
+      output.append(char)
+
+    return
+
+
+def last_used(row):#column after the last non blank cell
+
+  for x in range(len(row) - 1, -1, -1):
+    if row[x] != BLANK: return x + 1
+
+  return 0
+
+
+def changed_runs(new, old, end, gap=4):#(start, end) of the changed parts of a row up to column end
+  #runs closer than gap columns are joined - resending a few characters is cheaper than a cursor move
+
+  runs = []
+  x = 0
+  while x < end:
+    if new[x] == old[x]:
+      x += 1
+      continue
+
+    start = x
+    last = x
+    while x < end and x - last <= gap:
+      if new[x] != old[x]: last = x
+      x += 1
+
+    runs.append((start, last + 1))
+    x = last + 1
+
+  return runs
@@ -0,0 +1,429 @@
+"""
+    bccsettings.py - settings file for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+The settings are kept in bccsettings.json:
+
+  {"version": 1, "settings": {"TEMP_SCALE": "Fahrenheit", ...}}
+
+load() reads the file in one go and never runs anything in it. Every setting
+is checked against SCHEMA - a missing, unknown or bad value (wrong type, not
+one of the allowed choices, below its MINIMUMS entry) is replaced by the
+program's default and reported instead of stopping bcc.py.
+
+The first time bcc.py starts without bccsettings.json but with an old
+bccconfig.py, the values are read out of bccconfig.py as plain text (no
+import, so a yeast description with an apostrophe in it can't break it),
+bccsettings.json is written and bccconfig.py is renamed to bccconfig.py.old.
+
+save() writes the file with bccdb.atomic_write(), so a crash leaves either
+the old or the new file.
+"""
+
+import ast
+import json
+import math
+import os
+
+import bccalarms
+import bcccontrol
+import bccdb
+
+VERSION = 1 #version of the file layout - bump it and add a step to MIGRATIONS when it changes
+
+try:
+  text_type = unicode #python 2 - json gives back unicode strings
+  long_type = long
+except NameError:
+  text_type = str
+  long_type = int
+
+#schema###################################################################
+#setting name: (type, allowed values or None)
+#types: "float", "int", "bool", "str", "pins" (list of (AIN, heater pin, cooler pin[, wort AIN]))
+#"chambers" (list of dicts of CHAMBER_FIELDS, one per chamber) and "rules" (list of alarm rules, see bccalarms.py)
+
+SCHEMA = {
+  "TEMP_SCALE": ("str", ["Fahrenheit", "Celsius"]),
+  "LAGER_TEMP": ("float", None),
+  "WARM_TEMP": ("float", None),
+  "NORM_TEMP": ("float", None),
+  "CRASH_TEMP": ("float", None),
+  "CLEAR_TEMP": ("float", None),
+  "DESIRED_TEMP": ("float", None),
+  "DWELL": ("float", None),
+  "MAX_HIGH_TEMP": ("float", None),
+  "MIN_LOW_TEMP": ("float", None),
+  "MIN_TEMP": ("float", None),
+  "MAX_TEMP": ("float", None),
+  "BREW_CYCLE": ("str", None),
+  "Y_PROF_ID": ("int", None),
+  "Y_LAB": ("str", None),
+  "Y_NUM": ("str", None),
+  "Y_NAME": ("str", None),
+  "Y_STYLE": ("str", None),
+  "Y_DESC": ("str", None),
+  "Y_LOW_TEMP": ("float", None),
+  "Y_HIGH_TEMP": ("float", None),
+  "SMS_ALARM_ON": ("bool", None),
+  "ALARM_SYS_ON": ("bool", None),
+  "CELL_NUMBER": ("str", None),
+  "BREW_NAME": ("str", None),
+  "BREW_BATCH_NUM": ("str", None),
+  "BREW_BATCH_SIZE": ("float", None),
+  "BREW_STYLE": ("str", None),
+  "BREW_METHOD": ("str", None),
+  "BREW_SESSION_FILENAME": ("str", None),
+  "CHARTING_ON": ("bool", None),
+  "CHARTING_INTERVAL": ("float", None),
+  "DATA_TO_PLOT": ("bool", None),
+  "CHART_BACKEND": ("str", ["native", "gnuplot"]),
+  "CHART_FORMAT": ("str", ["png", "svg"]),
+  "CHART_WRITE_INTERVAL": ("float", None),
+  "ADC_SAMPLES": ("int", None),
+  "ADC_FILTER": ("str", ["median", "trimmed", "decimate"]),
+  "TREND_WINDOW": ("float", None),
+  "DATABASE_FLUSH_INTERVAL": ("float", None),
+  "DATABASE_FLUSH_SIZE": ("int", None),
+  "DATABASE_FSYNC": ("bool", None),
+  "DATABASE_MAX_BYTES": ("int", None),
+  "DATABASE_BACKUPS": ("int", None),
+  "DATABASE_INTERVAL": ("float", None),
+  "ARCHIVE_ON": ("bool", None),
+  "SETTINGS_DELAY": ("float", None),
+  "COOLER_TIME": ("float", None),
+  "DATABASE_MODE": ("str", ["interval", "change"]),
+  "DATABASE_TOLERANCE": ("float", None),
+  "NOTIFY_TRANSPORTS": ("str", None),
+  "NOTIFY_RATE_LIMIT": ("float", None),
+  "NOTIFY_URL": ("str", None),
+  "NOTIFY_SMTP_HOST": ("str", None),
+  "NOTIFY_EMAIL_FROM": ("str", None),
+  "NOTIFY_EMAIL_TO": ("str", None),
+  "NOTIFY_FILE": ("str", None),
+  "NOTIFY_SOCKET": ("str", None),
+  "ALARM_RULES": ("rules", None),
+  "MALFUNC_LAG": ("float", None),
+  "MALFUNC_WINDOW": ("float", None),
+  "CONTROL_MODE": ("str", bcccontrol.MODES),
+  "PID_KP": ("float", None),
+  "PID_TI": ("float", None),
+  "PID_TD": ("float", None),
+  "CASCADE_KP": ("float", None),
+  "CASCADE_TI": ("float", None),
+  "CASCADE_LIMIT": ("float", None),
+  "HEATER_WINDOW": ("float", None),
+  "COOLER_WINDOW": ("float", None),
+  "RELAY_MIN_ON": ("float", None),
+  "MODEL_TAU": ("float", None),
+  "MODEL_HEAT_RATE": ("float", None),
+  "MODEL_COOL_RATE": ("float", None),
+  "MODEL_LAG": ("float", None),
+  "MPC_HORIZON": ("float", None),
+  "MPC_START_COST": ("float", None),
+  "MODEL_REFIT": ("float", None),
+  "CHAMBER_NAME": ("str", None),
+  "CHAMBER_PINS": ("pins", None),
+  "CHAMBER_SETTINGS": ("chambers", None),
+}
+
+#lowest value of a number setting - a setting below it gets the default (a flush size of 0 would
+#keep the database writer from ever waiting, a charting interval of 0 leaves no time per chart column)
+MINIMUMS = {
+  "CHARTING_INTERVAL": 60,
+  "CHART_WRITE_INTERVAL": 0,
+  "ADC_SAMPLES": 1,
+  "TREND_WINDOW": 1,
+  "DATABASE_FLUSH_INTERVAL": 1,
+  "DATABASE_FLUSH_SIZE": 1,
+  "DATABASE_MAX_BYTES": 0, #0 never rotates
+  "DATABASE_BACKUPS": 0,
+  "DATABASE_INTERVAL": 0,
+  "SETTINGS_DELAY": 0,
+  "COOLER_TIME": 0,
+  "NOTIFY_RATE_LIMIT": 0,
+  "MALFUNC_LAG": 0,
+  "MALFUNC_WINDOW": 1,
+  "HEATER_WINDOW": 1,
+  "COOLER_WINDOW": 1,
+  "RELAY_MIN_ON": 0,
+  "MODEL_TAU": 60,
+  "MODEL_LAG": 0,
+  "MPC_HORIZON": 60,
+}
+
+#settings kept for every chamber in CHAMBER_SETTINGS
+CHAMBER_FIELDS = ["CHAMBER_NAME","TEMP_SCALE","LAGER_TEMP","WARM_TEMP","NORM_TEMP","CRASH_TEMP","CLEAR_TEMP",
+                  "DESIRED_TEMP","DWELL","MAX_HIGH_TEMP","MIN_LOW_TEMP","MIN_TEMP","MAX_TEMP","BREW_CYCLE",
+                  "Y_PROF_ID","Y_LAB","Y_NUM","Y_NAME","Y_STYLE","Y_DESC","Y_LOW_TEMP","Y_HIGH_TEMP",
+                  "SMS_ALARM_ON","ALARM_SYS_ON","BREW_NAME","BREW_BATCH_NUM","BREW_BATCH_SIZE","BREW_STYLE",
+                  "BREW_METHOD","BREW_SESSION_FILENAME","CHARTING_ON","CHARTING_INTERVAL","DATA_TO_PLOT"]
+
+#load and save############################################################
+#load() returns (settings, problems, source):
+#  settings - {name: value} for every name in SCHEMA, defaults filled in
+#  problems - list of messages about values that were replaced by a default
+#  source   - "json", "bccconfig.py" (migrated) or None (no settings file yet)
+
+def load(filename, defaults, legacy_filename=None):
+
+  problems = []
+  source = None
+  data = None
+
+  if os.path.exists(filename):
+    source = "json"
+    try:
+      settings_file = open(filename)
+      try:
+        data = json.loads(settings_file.read())
+      finally:
+        settings_file.close()
+      data = migrate(data)
+    except (IOError, ValueError) as error:
+      problems.append(filename + " could not be read (" + str(error) + ") - using defaults")
+      keep_bad_copy(filename)
+      data = None
+
+  elif legacy_filename and os.path.exists(legacy_filename):
+    source = legacy_filename
+    data = {"version": VERSION, "settings": read_legacy(legacy_filename, problems)}
+
+  if data is None:
+    return dict(defaults), problems, source
+
+  settings = validate(data["settings"], defaults, problems)
+
+  if source != "json": #migrated - write the new file and move the old one out of the way
+    save(filename, settings)
+    os.rename(legacy_filename, legacy_filename + ".old")
+    if os.path.exists(legacy_filename + "c"): os.remove(legacy_filename + "c")
+
+  return settings, problems, source
+
+
+def save(filename, settings, fsync=True):
+
+  bccdb.atomic_write(filename, dumps(settings), fsync)
+
+  return
+
+
+def dumps(settings):#file contents - one setting per line so the file is easy to read and edit
+
+  lines = []
+  for name in sorted(settings):
+    if name not in SCHEMA: continue
+    lines.append("  " + json.dumps(name) + ": " + json.dumps(to_json(settings[name]), sort_keys=True))
+
+  return '{"version": ' + str(VERSION) + ', "settings": {\n' + ",\n".join(lines) + "\n}}\n"
+
+
+def keep_bad_copy(filename):#keep a file that could not be read for a look later - it is replaced on the next save
+
+  try:
+    os.rename(filename, filename + ".bad")
+  except OSError:
+    pass
+
+  return
+
+#versions################################################################
+#MIGRATIONS[n] turns a version n file into a version n + 1 file
+
+MIGRATIONS = {}
+
+def migrate(data):
+
+  if not isinstance(data, dict) or not isinstance(data.get("settings"), dict):
+    raise ValueError("not a settings file")
+
+  version = data.get("version", 1)
+  if not isinstance(version, int) or version > VERSION:
+    raise ValueError("unknown settings version " + repr(version))
+
+  while version < VERSION:
+    data = MIGRATIONS[version](data)
+    version += 1
+    data["version"] = version
+
+  return data
+
+#checking#################################################################
+def validate(values, defaults, problems):
+
+  settings = dict(defaults)
+
+  for name, value in values.items():
+    name = native(name)
+    if name not in SCHEMA:
+      problems.append("unknown setting " + name + " ignored")
+      continue
+
+    try:
+      settings[name] = check(name, value, defaults)
+    except (TypeError, ValueError) as error:
+      problems.append(name + ": " + str(error) + " - using " + repr(defaults.get(name)))
+
+  return settings
+
+
+def check(name, value, defaults):#return value as the setting's type or raise ValueError
+
+  kind, choices = SCHEMA[name]
+
+  if kind == "float":
+    if not is_number(value): raise ValueError("not a number: " + repr(value))
+    value = float(value)
+
+  elif kind == "int":
+    if not is_number(value) or value != int(value): raise ValueError("not a whole number: " + repr(value))
+    value = int(value)
+
+  elif kind == "bool":
+    if not isinstance(value, bool): raise ValueError("not true/false: " + repr(value))
+
+  elif kind == "str":
+    if not isinstance(value, (str, text_type)): raise ValueError("not text: " + repr(value))
+    value = native(value)
+
+  elif kind == "pins":
+    value = [check_pins(entry) for entry in value]
+    if not value: raise ValueError("no chambers")
+
+  elif kind == "chambers":
+    value = [check_chamber(entry, defaults) for entry in value]
+
+  elif kind == "rules":
+    if not isinstance(value, list): raise ValueError("not a list of rules: " + repr(value))
+    value = [bccalarms.check_rule(entry) for entry in value]
+
+  if choices is not None and value not in choices:
+    raise ValueError(repr(value) + " is not one of " + ", ".join(choices))
+  if name in MINIMUMS and value < MINIMUMS[name]:
+    raise ValueError(repr(value) + " is below " + repr(MINIMUMS[name]))
+
+  return value
+
+
+def is_number(value):#json reads NaN and Infinity too - neither is a usable setting
+
+  if isinstance(value, bool) or not isinstance(value, (int, long_type, float)): return False
+  try:
+    value = float(value)
+  except OverflowError: #a whole number too big for a float
+    return False
+
+  return not (math.isinf(value) or math.isnan(value))
+
+
+def check_pins(entry):
+
+  if not isinstance(entry, (list, tuple)) or len(entry) not in (3, 4):
+    raise ValueError("pins must be (AIN, heater pin, cooler pin[, wort AIN]): " + repr(entry))
+
+  for pin in entry:
+    if not isinstance(pin, (str, text_type)): raise ValueError("not a pin name: " + repr(pin))
+
+  return tuple([native(pin) for pin in entry])
+
+
+def check_chamber(entry, defaults):#one chamber's settings - a bad value is dropped so the chamber uses the default
+
+  if not isinstance(entry, dict): raise ValueError("not a chamber: " + repr(entry))
+
+  chamber = {}
+  for name, value in entry.items():
+    name = native(name)
+    if name not in CHAMBER_FIELDS: continue
+    try:
+      chamber[name] = check(name, value, defaults)
+    except (TypeError, ValueError):
+      pass
+
+  return chamber
+
+#text####################################################################
+#python 2 strings in bcc.py are bytes, json wants unicode - bytes that are not
+#UTF-8 (old latin-1 yeast descriptions) are read as latin-1 instead of failing
+
+def native(text):
+
+  if text_type is not str and isinstance(text, text_type): return text.encode("utf-8")
+
+  return text
+
+
+def to_json(value):
+
+  if text_type is not str and isinstance(value, str):
+    try:
+      return value.decode("utf-8")
+    except UnicodeDecodeError:
+      return value.decode("latin-1")
+
+  if isinstance(value, (list, tuple)): return [to_json(item) for item in value]
+
+  if isinstance(value, dict): return dict([(to_json(key), to_json(item)) for key, item in value.items()])
+
+  return value
+
+#old bccconfig.py#########################################################
+#bccconfig.py was a python file of NAME = value lines (CHAMBER_SETTINGS over
+#several lines). It is read as text, values are taken with ast.literal_eval
+#which only accepts plain values, so nothing in the file is ever run.
+
+def read_legacy(filename, problems):
+
+  legacy_file = open(filename)
+  try:
+    text = legacy_file.read()
+  finally:
+    legacy_file.close()
+
+  values = {}
+  name = None
+  value_lines = []
+
+  for line in text.splitlines() + ["END = None"]:
+    if "=" in line and line.split("=")[0].strip().isupper() and not line.startswith(" "):
+      if name is not None: read_legacy_value(name, "\n".join(value_lines), values, problems)
+      name, first = line.split("=", 1)
+      name = name.strip()
+      value_lines = [first]
+    elif name is not None:
+      value_lines.append(line) #value carries on over more than one line
+
+  return values
+
+
+def read_legacy_value(name, text, values, problems):
+
+  text = text.strip()
+
+  try:
+    values[name] = ast.literal_eval(text)
+    return
+  except (SyntaxError, ValueError):
+    pass
+
+  #'...' around text with an apostrophe in it - everything between the outside quotes
+  if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+    values[name] = text[1:-1]
+    return
+
+  problems.append(name + " could not be read from the old settings file")
+
+  return
@@ -0,0 +1,377 @@
+"""
+    bccstore.py - binary session store for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Store keeps the status rows of one chamber (what database.csv has as text)
+as fixed size binary records after a small header, in time order:
+
+  header  (HEADER_SIZE bytes): magic "BCCS", version, record size, created time
+  record  (RECORD_SIZE bytes): time (double), avg, min, max, desired, min low, max high (floats),
+                               yeast ID, brew cycle, flags
+
+Because every record has the same size and the times only go up, the file
+is its own timestamp index: find() is a binary search on the time of the
+records, and view() hands back the records between two times as a slice of
+the memory mapped file without copying or parsing anything. records()
+unpacks them when the values are needed.
+
+Flags are bits: heater, cooler, alarm sys, is alarm, high temp alarm, low
+temp alarm, cooler malfunction, heater malfunction, SMS on, Celsius.
+
+Converters to and from the text files:
+
+  from_database_csv(csv filename, store directory) - status rows of database.csv (18 or 19 columns)
+  to_database_csv(store, file, chamber name)        - 19 column database.csv rows
+  from_dat(dat filename, store) / to_dat(store, file) - brew session .dat rows
+
+  python bccstore.py import database.csv <store directory>
+  python bccstore.py export <store file> <hours>
+"""
+
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+
+MAGIC = b"BCCS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHd16x") #magic, version, record size, created
+HEADER_SIZE = HEADER.size
+RECORD = struct.Struct("<d6fHBBH2x") #time, avg, min, max, desired, min low, max high, yeast ID, cycle, spare, flags
+RECORD_SIZE = RECORD.size
+
+CYCLES = ["Off  ", "Norm ", "Warm ", "Lager", "Crash", "Clear"] #brew cycle codes
+
+FLAGS = ["heater", "cooler", "alarm_sys", "is_alarm", "high_alarm", "low_alarm",
+         "cooler_malfunc", "heater_malfunc", "sms", "celsius"]
+
+DATABASE_TIME_FORMAT = "%y-%m-%d %H:%M:%S"
+DAT_TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+try:
+  buffer #python 2 - mmap has no memoryview support
+  def file_view(mapped, start, end):
+    return buffer(mapped, start, end - start)
+except NameError:
+  def file_view(mapped, start, end):
+    return memoryview(mapped)[start:end]
+
+class Store:
+
+  def __init__(self, filename):
+
+    self.filename = filename
+    self.pending = [] #packed records not written yet
+    self.mapped = None
+    self.mapped_size = 0
+    self.last_time = None
+
+    if not os.path.exists(filename) or os.path.getsize(filename) < HEADER_SIZE:
+      store_file = open(filename, "wb")
+      try:
+        store_file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, time.time()))
+      finally:
+        store_file.close()
+
+    store_file = open(filename, "rb")
+    try:
+      magic, version, record_size, created = HEADER.unpack(store_file.read(HEADER_SIZE))
+    finally:
+      store_file.close()
+
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+      raise ValueError(filename + " is not a version " + str(VERSION) + " session store")
+
+    self.created = created
+
+    size = self.file_records() #a record cut short by a power cut is dropped
+    if size and self.time(size - 1) is not None: self.last_time = self.time(size - 1)
+
+    return
+
+#writing#################################################################
+  def append(self, when, values):
+    #values: avg, min, max, desired, min_low, max_high (alarm thresholds), yeast, cycle and the FLAGS
+    #missing ones are 0/False
+
+    if self.last_time is not None and when < self.last_time:
+      when = self.last_time #times never go back - the binary search depends on it
+
+    flags = 0
+    for bit, name in enumerate(FLAGS):
+      if values.get(name): flags |= 1 << bit
+
+    cycle = values.get("cycle", "Off  ")
+    if cycle in CYCLES: cycle = CYCLES.index(cycle)
+    else: cycle = 0
+
+    self.pending.append(RECORD.pack(when, values.get("avg", 0.0), values.get("min", 0.0), values.get("max", 0.0),
+                                    values.get("desired", 0.0), values.get("min_low", 0.0),
+                                    values.get("max_high", 0.0), int(values.get("yeast", 0)) & 0xffff, cycle, 0,
+                                    flags))
+    self.last_time = when
+
+    return
+
+
+  def flush(self):
+
+    if not self.pending: return
+
+    store_file = open(self.filename, "r+b")
+    try:
+      store_file.seek(HEADER_SIZE + self.file_records() * RECORD_SIZE) #over a cut short record, if any
+      store_file.write(b"".join(self.pending))
+      store_file.truncate()
+    finally:
+      store_file.close()
+
+    self.pending = []
+
+    return
+
+#reading#################################################################
+  def file_records(self):
+
+    return (os.path.getsize(self.filename) - HEADER_SIZE) // RECORD_SIZE
+
+
+  def map(self):#map the file again if it grew since it was last mapped
+
+    size = HEADER_SIZE + self.file_records() * RECORD_SIZE
+    if self.mapped is not None and size == self.mapped_size: return self.mapped
+
+    self.close()
+    if size == HEADER_SIZE: return None
+
+    store_file = open(self.filename, "rb")
+    try:
+      self.mapped = mmap.mmap(store_file.fileno(), size, access=mmap.ACCESS_READ)
+    finally:
+      store_file.close()
+    self.mapped_size = size
+
+    return self.mapped
+
+
+  def close(self):
+
+    if self.mapped is not None:
+      self.mapped.close()
+      self.mapped = None
+      self.mapped_size = 0
+
+    return
+
+
+  def __len__(self):#records on file
+
+    return self.file_records()
+
+
+  def time(self, index):
+
+    mapped = self.map()
+    if mapped is None: return None
+
+    return struct.unpack_from("<d", mapped, HEADER_SIZE + index * RECORD_SIZE)[0]
+
+
+  def find(self, when):#index of the first record at or after when - binary search
+
+    mapped = self.map()
+    if mapped is None: return 0
+
+    low = 0
+    high = (self.mapped_size - HEADER_SIZE) // RECORD_SIZE
+    while low < high:
+      middle = (low + high) // 2
+      if struct.unpack_from("<d", mapped, HEADER_SIZE + middle * RECORD_SIZE)[0] < when: low = middle + 1
+      else: high = middle
+
+    return low
+
+
+  def span(self, start, end):#(first, last + 1) record index between two times
+
+    return self.find(start), self.find(end + 1e-6)
+
+
+  def view(self, start, end):#the records between two times as a slice of the file - no copy
+
+    first, last = self.span(start, end)
+    if first >= last: return b""
+
+    return file_view(self.mapped, HEADER_SIZE + first * RECORD_SIZE, HEADER_SIZE + last * RECORD_SIZE)
+
+
+  def records(self, start=0.0, end=float("inf")):#unpacked records between two times
+
+    data = self.view(start, end)
+
+    for offset in range(0, len(data), RECORD_SIZE):
+      yield unpack(data, offset)
+
+
+  def last(self, seconds):#records of the last seconds
+
+    if self.last_time is None: return iter(())
+
+    return self.records(self.last_time - seconds)
+
+
+def unpack(data, offset=0):#one record as a dict
+
+  when, avg, low, high, desired, min_low, max_high, yeast, cycle, spare, flags = RECORD.unpack_from(data, offset)
+
+  record = {"time": when, "avg": avg, "min": low, "max": high, "desired": desired, "min_low": min_low,
+            "max_high": max_high, "yeast": yeast, "cycle": CYCLES[cycle] if cycle < len(CYCLES) else "Off  "}
+  for bit, name in enumerate(FLAGS):
+    record[name] = bool(flags & (1 << bit))
+
+  return record
+
+#database.csv############################################################
+def store_filename(directory, chamber_name):#file of a chamber - Chamber 2 is chamber-2.bcs
+
+  return os.path.join(directory, re.sub("[^A-Za-z0-9]+", "-", chamber_name.strip()).strip("-").lower() + ".bcs")
+
+
+def parse_database_row(fields):#(time, values, chamber name) or None for banner and brew info lines
+
+  if len(fields) not in (18, 19): return None
+
+  try:
+    when = parse_database_time(fields[0].strip())
+    values = {"cycle": fields[1], "avg": float(fields[2]), "min": float(fields[3]), "max": float(fields[4]),
+              "min_low": float(fields[5]), "max_high": float(fields[6]), "yeast": int(fields[7])}
+  except ValueError:
+    return None
+
+  for name, field in zip(FLAGS[:9], fields[8:17]):
+    values[name] = field.strip() == "True"
+  values["celsius"] = fields[17].strip() == "Celsius"
+
+  if len(fields) == 19: chamber_name = fields[18].strip()
+  else: chamber_name = "Chamber 1" #written before there was more than one chamber
+
+  return when, values, chamber_name
+
+
+def parse_database_time(text):#DATABASE_TIME_FORMAT to time.time() - by hand, strptime is slow on a long file
+
+  if len(text) != 17 or text[2] != "-" or text[5] != "-" or text[8] != " " or text[11] != ":" or text[14] != ":":
+    return time.mktime(time.strptime(text, DATABASE_TIME_FORMAT))
+
+  year = int(text[0:2])
+  if year < 69: year += 2000 #the same pivot as %y
+  else: year += 1900
+
+  return time.mktime((year, int(text[3:5]), int(text[6:8]), int(text[9:11]), int(text[12:14]),
+                      int(text[15:17]), 0, 0, -1))
+
+
+def from_database_csv(csv_filename, directory):#returns {chamber name: Store}
+
+  if not os.path.isdir(directory): os.makedirs(directory)
+
+  stores = {}
+  csv_file = open(csv_filename)
+  try:
+    for line in csv_file:
+      row = parse_database_row(line.rstrip("\r\n").split(","))
+      if row is None: continue
+      when, values, chamber_name = row
+      if chamber_name not in stores: stores[chamber_name] = Store(store_filename(directory, chamber_name))
+      stores[chamber_name].append(when, values)
+  finally:
+    csv_file.close()
+
+  for store in stores.values():
+    store.flush()
+
+  return stores
+
+
+def database_row(record, chamber_name):#one 19 column database.csv line
+
+  if record["celsius"]: scale = "Celsius"
+  else: scale = "Fahrenheit"
+
+  return (time.strftime(DATABASE_TIME_FORMAT, time.localtime(record["time"])) + "," + record["cycle"] + "," +
+          str(round(record["avg"], 4)) + "," + str(round(record["min"], 4)) + "," + str(round(record["max"], 4)) + "," +
+          str(float(round(record["min_low"]))) + "," + str(float(round(record["max_high"]))) + "," + str(record["yeast"]) + "," +
+          ",".join([str(record[name]) for name in FLAGS[:9]]) + "," + scale + "," + chamber_name + "\n")
+
+
+def to_database_csv(store, out_file, chamber_name, start=0.0, end=float("inf")):
+
+  for record in store.records(start, end):
+    out_file.write(database_row(record, chamber_name))
+
+  return
+
+#brew session .dat#######################################################
+#time, avg temp, min temp, max temp, desired temp, high alarm, low alarm
+
+def from_dat(dat_filename, store):
+
+  dat_file = open(dat_filename)
+  try:
+    for line in dat_file:
+      fields = line.strip().split(",")
+      if len(fields) != 7: continue
+      try:
+        when = time.mktime(time.strptime(fields[0], DAT_TIME_FORMAT))
+        temps = [float(field) for field in fields[1:]]
+      except ValueError:
+        continue
+      store.append(when, dict(zip(["avg", "min", "max", "desired", "max_high", "min_low"], temps)))
+  finally:
+    dat_file.close()
+
+  store.flush()
+
+  return
+
+
+def to_dat(store, out_file, start=0.0, end=float("inf")):
+
+  for record in store.records(start, end):
+    out_file.write(time.strftime(DAT_TIME_FORMAT, time.localtime(record["time"])) + "," +
+                   ",".join([str(round(record[name], 4)) for name in
+                             ["avg", "min", "max", "desired", "max_high", "min_low"]]) + "\n")
+
+  return
+
+#command line############################################################
+if __name__ == "__main__":
+
+  if len(sys.argv) == 4 and sys.argv[1] == "import":
+    for name, store in sorted(from_database_csv(sys.argv[2], sys.argv[3]).items()):
+      print(name + ": " + str(len(store)) + " records in " + store.filename)
+
+  elif len(sys.argv) == 4 and sys.argv[1] == "export":
+    store = Store(sys.argv[2])
+    start = (store.last_time or 0.0) - float(sys.argv[3]) * 3600
+    name = os.path.basename(sys.argv[2])[:-4].replace("-", " ").title()
+    to_database_csv(store, sys.stdout, name, start)
+
+  else:
+    print("usage: python bccstore.py import database.csv <store directory>")
+    print("       python bccstore.py export <store file> <hours>")
+    sys.exit(1)
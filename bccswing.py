@@ -0,0 +1,170 @@
+"""
+    bccswing.py - change based logging for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+SwingingDoor decides which status rows are worth writing. Every reading is
+offered to it, it hands back the rows to write - usually none.
+
+Temperature - swinging door compression: every reading offered since the
+last row written opens a door of +/- tolerance, which limits the slopes a
+straight line from the last row written may have. A reading is held back as
+long as the line to it passes through all the doors before it. Once the
+line to a new reading doesn't, the reading held is written and the doors
+start again from it. Drawing straight lines between the rows written gives
+every reading back within the tolerance.
+
+State - the rest of the row (relays, alarms, brew cycle, set temperatures,
+yeast...) is a key. The first reading of a new state is always written, so
+no change is lost: playback keeps the state of a row until the next row.
+
+A row is also written when max_interval seconds went by without one, and
+finish() hands back the reading still held when the program stops.
+
+  python bccswing.py <tolerance> [database.csv] - rows written and the largest error
+"""
+
+import sys
+
+class SwingingDoor:
+
+  def __init__(self):
+
+    self.archived = None #(time, value) of the last row written
+    self.key = None #state of the last reading offered
+    self.held = None #(time, value, row) of the last reading offered and not written
+    self.upper = None #lowest slope of the upper door
+    self.lower = None #highest slope of the lower door
+
+    return
+
+
+  def offer(self, when, value, key, row, tolerance, max_interval=None):#returns the rows to write
+
+    if self.archived is None: #first reading
+      self.key = key
+      self.start(when, value)
+      return [row]
+
+    rows = []
+    if self.held is not None and (not self.fits(when, value) or
+                                  (max_interval is not None and when - self.archived[0] >= max_interval)):
+      #the line to this reading would miss one before it - write the last one that fitted and start from it
+      rows.append(self.held[2])
+      self.start(self.held[0], self.held[1])
+
+    if key != self.key: #the state changed - write the first reading of the new state
+      self.key = key
+      self.start(when, value)
+      return rows + [row]
+
+    self.swing(when, value, tolerance)
+    self.held = (when, value, row)
+
+    return rows
+
+
+  def fits(self, when, value):#True if the line from the last row written to this reading passes every door
+
+    elapsed = float(when - self.archived[0])
+    if elapsed <= 0: return value == self.archived[1]
+
+    return self.lower <= (value - self.archived[1]) / elapsed <= self.upper
+
+
+  def start(self, when, value):
+
+    self.archived = (when, value)
+    self.held = None
+    self.upper = float("inf")
+    self.lower = float("-inf")
+
+    return
+
+
+  def swing(self, when, value, tolerance):
+
+    elapsed = float(when - self.archived[0])
+    if elapsed <= 0: return
+
+    self.upper = min(self.upper, (value + tolerance - self.archived[1]) / elapsed)
+    self.lower = max(self.lower, (value - tolerance - self.archived[1]) / elapsed)
+
+    return
+
+
+  def finish(self):#the reading still held - None if there is none
+
+    if self.held is None: return None
+
+    row = self.held[2]
+    self.start(self.held[0], self.held[1])
+
+    return row
+
+
+def playback(points, times):#values at every time - times in order
+
+  index = 0
+  for when in times:
+    while index < len(points) - 2 and points[index + 1][0] <= when:
+      index += 1
+    if when <= points[0][0] or len(points) == 1:
+      yield points[0][1]
+    elif when >= points[-1][0]:
+      yield points[-1][1]
+    else:
+      (start, low), (end, high) = points[index], points[index + 1]
+      if end == start: yield high
+      else: yield low + (high - low) * (when - start) / float(end - start)
+
+#report#####################################################################
+if __name__ == "__main__":
+
+  if len(sys.argv) not in (2, 3):
+    print("usage: python bccswing.py <tolerance> [database.csv]")
+    sys.exit(1)
+
+  import bccstore
+
+  tolerance = float(sys.argv[1])
+  readings = []
+  if len(sys.argv) == 3:
+    for line in open(sys.argv[2]):
+      parsed = bccstore.parse_database_row(line.rstrip("\r\n").split(","))
+      if parsed is None or parsed[2] != "Chamber 1": continue
+      when, values, name = parsed
+      readings.append((when, values["avg"], (values["cycle"], values["heater"], values["cooler"], values["is_alarm"])))
+  else: #a day of a lager, 15 second readings
+    import random
+    random.seed(1)
+    temp = 50.0
+    heater = False
+    for x in range(5760):
+      temp += random.gauss(0, 0.005) + (0.01 if heater else -0.004)
+      if temp < 49.5: heater = True
+      if temp > 50.2: heater = False
+      readings.append((x * 15.0, temp, ("Lager", heater)))
+
+  door = SwingingDoor()
+  written = []
+  for when, value, key in readings:
+    written += door.offer(when, value, key, (when, value), tolerance, 15 * 60)
+  last = door.finish()
+  if last is not None: written.append(last)
+
+  error = max([abs(value - played) for (when, value, key), played in
+               zip(readings, playback(written, [reading[0] for reading in readings]))] + [0.0])
+  print(str(len(readings)) + " readings, " + str(len(written)) + " rows written (" +
+        str(round(100.0 * len(written) / max(len(readings), 1), 1)) + "%), largest error " + str(round(error, 4)))
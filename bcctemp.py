@@ -0,0 +1,115 @@
+"""
+    bcctemp.py - thermistor lookup table for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+Instead of working out the Steinhart-Hart polynomial (two logs and a cube)
+on every read, ThermistorTable works it out once for a table of evenly
+spaced ADC readings and interpolates between the two nearest entries.
+
+ADC readings are what ADC.read() returns: Vout / VDD_ADC, 0.0 - 1.0.
+The table covers readings from 0.05 to 0.95 (about -31C to 107C with the
+bcc.py constants), readings outside of that use the exact formula.
+
+With the default 1024 entries the interpolation error is less than 0.002C
+(0.004F) against the exact formula - far less than one step of the 12 bit
+ADC. The error is measured when the table is built and kept in max_error.
+"""
+
+import math
+
+try:
+  import numpy #optional - only used by temperatures() to convert many readings at once
+except ImportError:
+  numpy = None
+
+c2kelvin = 273.15
+
+class ThermistorTable:
+
+  def __init__(self, r_bias, vdd_adc, t_a, t_b, t_c, size=1024, low=0.05, high=0.95):
+
+    self.r_bias = r_bias
+    self.vdd_adc = vdd_adc
+    self.t_a = t_a
+    self.t_b = t_b
+    self.t_c = t_c
+    self.size = size
+    self.low = low
+    self.high = high
+
+    self.build()
+
+    return
+
+
+  def build(self):#(re)build the table - call again if the constants are changed
+
+    self.step = (self.high - self.low) / (self.size - 1)
+    self.scale = 1.0 / self.step
+
+    self.ratios = [self.low + x * self.step for x in range(self.size)]
+    self.table = [self.exact(ratio) for ratio in self.ratios]
+
+    #measure the worst interpolation error half way between the entries
+    self.max_error = 0.0
+    for x in range(self.size - 1):
+      ratio = self.low + (x + 0.5) * self.step
+      error = abs(self.temperature(ratio) - self.exact(ratio))
+      if error > self.max_error: self.max_error = error
+
+    if numpy is not None:
+      self.np_ratios = numpy.array(self.ratios)
+      self.np_table = numpy.array(self.table)
+
+    return
+
+
+  def exact(self, ratio):#Steinhart-Hart - temperature in Celsius
+
+    #calculate thermistor resistance from the voltage divider
+    res_therm = self.r_bias * (1.0 - ratio) / ratio
+    log_res = math.log(res_therm)
+
+    return 1.0 / (self.t_a + self.t_b * log_res + self.t_c * log_res * log_res * log_res) - c2kelvin
+
+
+  def temperature(self, ratio):#one ADC reading to Celsius
+
+    position = (ratio - self.low) * self.scale
+    x = int(position)
+
+    if position < 0 or x >= self.size - 1:
+      return self.exact(ratio)
+
+    temp = self.table[x]
+
+    return temp + (self.table[x + 1] - temp) * (position - x)
+
+
+  def temperatures(self, ratios):#a list or array of ADC readings to Celsius in one call
+
+    if numpy is None:
+      return [self.temperature(ratio) for ratio in ratios]
+
+    ratios = numpy.asarray(ratios, dtype=float)
+    temps = numpy.interp(ratios, self.np_ratios, self.np_table)
+
+    outside = (ratios < self.low) | (ratios > self.high)
+    if outside.any():
+      res_therm = self.r_bias * (1.0 - ratios[outside]) / ratios[outside]
+      log_res = numpy.log(res_therm)
+      temps[outside] = 1.0 / (self.t_a + self.t_b * log_res + self.t_c * log_res ** 3) - c2kelvin
+
+    return temps
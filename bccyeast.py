@@ -0,0 +1,176 @@
+"""
+    bccyeast.py - yeast strain catalog for bcc.py
+    Copyright (C) 2014,  Timothy J. Millea
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, version 3 of the License.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see http://www.gnu.org/licenses.
+
+YeastCatalog reads Yeast Strains.csv once and keeps it in memory:
+
+  ID,Lab,Number,Name,Style,Description,Low Temp,High Temp,Type,Floc.,Atten.
+
+refresh() reads the file again only when its modification time changed,
+everything else works on the copy in memory and never touches the disk.
+
+Indexes:
+  get(id)               - strain by ID
+  by_lab(lab)           - strains of a lab (White Labs, Wyeast...)
+  by_name(name)         - strain by name
+  by_style(style)       - strains listing a style (Ale, Lager, Belgian...)
+  covering(temp)        - strains whose Low Temp - High Temp range covers temp
+  overlapping(low, high) - strains whose range overlaps low - high
+
+Names are matched without regard to case. Temperatures are Fahrenheit like
+the file.
+"""
+
+import bisect
+import csv
+import math
+import os
+import sys
+
+class Strain:
+
+  def __init__(self, row):
+
+    self.row = tuple(row)
+    self.id = int(row[0])
+    self.lab = row[1]
+    self.number = row[2]
+    self.name = row[3]
+    self.style = row[4]
+    self.description = row[5]
+    self.low_temp = int(row[6])
+    self.high_temp = int(row[7])
+
+    self.styles = [style.strip().lower() for style in self.style.split(",") if style.strip()]
+
+    if self.high_temp < self.low_temp: raise ValueError("high temp below low temp")
+
+    return
+
+
+  def covers(self, temp):
+
+    return self.low_temp <= temp <= self.high_temp
+
+
+class YeastCatalog:
+
+  def __init__(self, filename):
+
+    self.filename = filename
+    self.mtime = None #modification time of the file when it was read
+    self.problems = [] #rows that could not be read
+    self.index([])
+
+    return
+
+
+  def refresh(self):#read the file if it changed since the last time - returns True if it was read
+
+    mtime = os.stat(self.filename).st_mtime
+    if mtime == self.mtime: return False
+
+    self.load()
+    self.mtime = mtime
+
+    return True
+
+
+  def load(self):
+
+    strains = []
+    self.problems = []
+
+    if sys.version_info[0] < 3:
+      yeast_file = open(self.filename, "rb")
+    else:
+      yeast_file = open(self.filename, newline="", encoding="latin-1")
+
+    try:
+      for line_number, row in enumerate(csv.reader(yeast_file)):
+        if line_number == 0 or not row or not row[0].strip(): continue #header and blank lines
+        try:
+          strains.append(Strain(row))
+        except (IndexError, ValueError):
+          self.problems.append(line_number + 1)
+    finally:
+      yeast_file.close()
+
+    self.index(strains)
+
+    return
+
+#indexes#################################################################
+  def index(self, strains):
+
+    self.strains = sorted(strains, key=lambda strain: strain.id)
+    self.ids = {}
+    self.labs = {}
+    self.names = {}
+    self.styles = {}
+    self.degrees = {} #whole degree: strains covering it
+
+    for strain in self.strains:
+      self.ids[strain.id] = strain
+      self.labs.setdefault(strain.lab.lower(), []).append(strain)
+      self.names[strain.name.lower()] = strain
+      for style in strain.styles:
+        self.styles.setdefault(style, []).append(strain)
+      for degree in range(strain.low_temp, strain.high_temp + 1):
+        self.degrees.setdefault(degree, []).append(strain)
+
+    #strains sorted by low temp for range queries
+    self.by_low = sorted(self.strains, key=lambda strain: strain.low_temp)
+    self.lows = [strain.low_temp for strain in self.by_low]
+
+    return
+
+
+  def __len__(self):
+
+    return len(self.strains)
+
+
+  def get(self, strain_id):#None if there is no such strain
+
+    return self.ids.get(strain_id)
+
+
+  def by_lab(self, lab):
+
+    return list(self.labs.get(lab.lower(), []))
+
+
+  def by_name(self, name):
+
+    return self.names.get(name.lower())
+
+
+  def by_style(self, style):
+
+    return list(self.styles.get(style.lower(), []))
+
+
+  def covering(self, temp):
+    #every strain covering temp also covers the whole degree below it - only that list needs checking
+
+    return [strain for strain in self.degrees.get(int(math.floor(temp)), []) if strain.covers(temp)]
+
+
+  def overlapping(self, low, high):
+
+    end = bisect.bisect_right(self.lows, high) #strains starting at or below high
+
+    return sorted([strain for strain in self.by_low[:end] if strain.high_temp >= low], key=lambda strain: strain.id)